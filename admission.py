@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Memory budget for concurrent full workbook loads, plus RSS sampling.
+
+A full ``openpyxl.load_workbook`` of the inspection template costs tens of
+MB, so a morning shift opening inspections together can push the server
+into swap. Every full load asks ``admit(kind, file_size)`` first. The cost
+is estimated as file size x a per-kind factor; the factor starts at a
+conservative guess and is replaced by the measured RSS growth of loads
+that ran alone (an exponential moving average). Loads are admitted while
+the estimated costs in flight fit the budget, which is sized once from the
+memory available at start. One load is always admitted even if it alone
+exceeds the budget.
+
+A load that cannot get in within ``max_wait`` seconds, or that arrives while
+the system is below ``reserve_bytes`` of available memory, raises
+MemoryBudgetExceeded (a PoolSaturated, so routes answer 503 + Retry-After
+and background callers back off as they already do for the render pool).
+
+``sample_request`` records per-endpoint RSS after each request and the
+growth of the process peak RSS while it ran, to tune the limits.
+
+psutil is used when installed; otherwise /proc (Linux) or the resource
+module, and a fixed budget when nothing can be measured.
+"""
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from render_pool import PoolSaturated
+
+try:
+    import psutil
+except ImportError:  # optional
+    psutil = None
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetExceeded(PoolSaturated):
+    """No room in the memory budget for another workbook load."""
+
+    def __init__(self, message, retry_after=2):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def available_memory():
+    """Bytes of memory available to new allocations, or None if unknown."""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None if unknown."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None if unknown."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        if psutil is not None:
+            return getattr(psutil.Process().memory_info(), "peak_wset", None)
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes vs KiB
+
+
+class AdmissionControl:
+    """Weighted semaphore over estimated bytes of in-flight workbook loads."""
+
+    def __init__(self, budget_fraction=0.5, min_budget=256 * MB, max_budget=4096 * MB,
+                 default_budget=1024 * MB, reserve_bytes=256 * MB, max_wait=2.0,
+                 factors=None, min_factor=5.0):
+        available = available_memory()
+        if available is None:
+            self.budget = default_budget
+        else:
+            self.budget = int(min(max(available * budget_fraction, min_budget), max_budget))
+        self.reserve_bytes = reserve_bytes
+        self.max_wait = max_wait
+        self.factors = dict(factors or {})  # kind -> bytes of memory per byte on disk
+        self.min_factor = min_factor
+        self._cond = threading.Condition()
+        self._in_use = 0
+        self._active = 0
+        self._available = (time.monotonic(), available)
+        self._waits = deque(maxlen=500)   # seconds spent queueing, recent admissions
+        self._holds = deque(maxlen=100)   # seconds a slot was held
+        self.admitted = 0
+        self.rejected = 0
+        self.measured = {}  # kind -> number of loads that updated the factor
+        self._requests = {}  # endpoint -> {count, rss_max, growth_max}
+
+    def estimate(self, kind, size) -> int:
+        return int(size * self.factors.get(kind, 20))
+
+    def _low_memory(self) -> bool:
+        """True if the system is below the reserve (sampled at most 1/s)."""
+        now = time.monotonic()
+        sampled_at, available = self._available
+        if now - sampled_at > 1.0:
+            available = available_memory()
+            self._available = (now, available)
+        return available is not None and available < self.reserve_bytes
+
+    def _retry_after(self) -> int:
+        holds = list(self._holds)
+        return max(1, min(30, round(sum(holds) / len(holds)))) if holds else 2
+
+    @contextmanager
+    def admit(self, kind, size, max_wait=None, measure=True):
+        """Hold budget for one load of a size-byte file of the given kind.
+
+        measure=False for loads that happen in another process (nothing to
+        learn from this process's RSS).
+        """
+        cost = self.estimate(kind, size)
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        with self._cond:
+            while self._active and (self._in_use + cost > self.budget or self._low_memory()):
+                remaining = max_wait - (time.monotonic() - start)
+                if remaining <= 0:
+                    self.rejected += 1
+                    raise MemoryBudgetExceeded(
+                        f"memory budget full ({self._active} loads in flight)",
+                        retry_after=self._retry_after())
+                self._cond.wait(remaining)
+            self._in_use += cost
+            self._active += 1
+            self.admitted += 1
+            alone = self._active == 1
+            self._waits.append(time.monotonic() - start)
+        held_at = time.monotonic()
+        rss_before = current_rss() if alone and measure else None
+        try:
+            yield
+            if rss_before is not None and size >= 64 * 1024:  # small files: noise
+                self._learn(kind, size, rss_before)
+        finally:
+            with self._cond:
+                self._in_use -= cost
+                self._active -= 1
+                self._holds.append(time.monotonic() - held_at)
+                self._cond.notify_all()
+
+    def _learn(self, kind, size, rss_before):
+        """Fold the RSS growth of a load that ran alone into the kind's factor."""
+        rss_after = current_rss()
+        if rss_after is None or rss_after - rss_before < size:
+            return  # mostly reused memory from earlier loads: nothing to learn
+        factor = (rss_after - rss_before) / size
+        with self._cond:
+            old = self.factors.get(kind)
+            factor = factor if old is None else 0.7 * old + 0.3 * factor
+            self.factors[kind] = max(factor, self.min_factor)
+            self.measured[kind] = self.measured.get(kind, 0) + 1
+
+    # -- per-request sampling ----------------------------------------------
+
+    def sample_request(self, endpoint, peak_before):
+        """Record RSS after a request and the peak growth while it ran."""
+        rss, peak = current_rss(), peak_rss()
+        if rss is None:
+            return
+        growth = peak - peak_before if peak is not None and peak_before is not None else 0
+        with self._cond:
+            entry = self._requests.setdefault(endpoint, {"count": 0, "rss_max": 0,
+                                                         "peak_growth_max": 0})
+            entry["count"] += 1
+            entry["rss_max"] = max(entry["rss_max"], rss)
+            entry["peak_growth_max"] = max(entry["peak_growth_max"], growth)
+
+    def stats(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            requests = {k: {"count": v["count"], "rss_max_mb": round(v["rss_max"] / MB, 1),
+                            "peak_growth_max_mb": round(v["peak_growth_max"] / MB, 1)}
+                        for k, v in self._requests.items()}
+            rss = current_rss()
+            return {
+                "budget_mb": round(self.budget / MB, 1),
+                "in_use_mb": round(self._in_use / MB, 1),
+                "active": self._active,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "factors": {k: round(v, 1) for k, v in self.factors.items()},
+                "measured": dict(self.measured),
+                "wait_avg_ms": round(1000 * sum(waits) / len(waits), 1) if waits else 0,
+                "wait_p95_ms": round(1000 * waits[int(len(waits) * 0.95)], 1) if waits else 0,
+                "wait_max_ms": round(1000 * waits[-1], 1) if waits else 0,
+                "rss_mb": round(rss / MB, 1) if rss else None,
+                "requests": requests,
+            }
@@ -2,56 +2,137 @@
 import os
 import json
 import base64
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
 from datetime import datetime
 from pathlib import Path
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, url_for, g
 
 import openpyxl
+from openpyxl.utils.cell import get_column_letter
 from fpdf import FPDF
 import io
+import hashlib
 import tempfile
 
+from workbook_cache import WorkbookCache
+from fs_index import TreeIndex
+from search_index import SearchIndex
+from xlsx_reader import StreamingWorkbook, find_sheet_name
+import xlsx_writer
+from save_journal import SaveJournal
+from workbook_locks import WorkbookLocks, atomic_write_bytes
+from render_pool import RenderPool, PoolSaturated, TaskTimeout
+from upload_sessions import UploadSessions, UploadError
+from photo_manifest import PhotoManifests
+from photo_gallery import list_photos, ThumbnailCache, THUMB_SIZES, THUMB_FORMATS
+from photo_ingest import PhotoIngest, IngestPolicy
+from artifact_cache import ArtifactCache
+from render_fonts import FontRegistry
+from batch_reports import BatchReports, RENDERED, SKIPPED, MISSING
+from job_queue import JobQueue, PRIORITY_INTERACTIVE, PRIORITY_BATCH, TERMINAL
+from admission import AdmissionControl, peak_rss
+from snapshot_store import SnapshotStore
+from template_options import TemplateOptionsCache, helper_fingerprint, read_template
+from cell_layouts import default_registry, cell_text, make_ref, SECRETARY, EXAMINER, FINDINGS, HELPER
+
 BASE_DIR = Path(r"C:\Users\Ran Slapak\Desktop\יצרנים")
 APP_DIR = Path(__file__).parent.resolve()
 
+# Extra folders searched (before the system font folders) for the Hebrew
+# fonts used in the deficiency PDF/PNG, e.g. [APP_DIR / "fonts"]
+FONT_DIRS = [APP_DIR / "fonts"]
+
 app = Flask(__name__, template_folder=str(APP_DIR / "templates"))
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
 
+# Cached manufacturer / date / vehicle listings (see fs_index.py)
+TREE_INDEX = TreeIndex(BASE_DIR, ttl=2.0, refresh_interval=30.0)
+
+# Cell layouts (מזכירה reference, בוחן form, deficiency tables, notes,
+# classification) per category and template version, compiled once; extra
+# template versions are declared in layouts.json (see cell_layouts.py)
+LAYOUTS = default_registry()
+LAYOUTS_FILE = APP_DIR / "layouts.json"
+if LAYOUTS_FILE.is_file():
+    LAYOUTS.load_file(LAYOUTS_FILE)
+
+# Worker processes of all pools together stay within the CPU count: render
+# and image pools are long-lived, the search crawl gets what is left over
+_CPUS = os.cpu_count() or 1
+RENDER_WORKERS = min(4, max(1, _CPUS // 2))
+IMAGE_WORKERS = min(2, max(1, _CPUS // 4))
+INDEX_WORKERS = max(1, _CPUS - RENDER_WORKERS - IMAGE_WORKERS)
+
+# License / VIN / report number search over all vehicles (see search_index.py)
+SEARCH_INDEX = SearchIndex(APP_DIR / ".search_index.sqlite3", BASE_DIR,
+                           workers=INDEX_WORKERS, interval=600.0, registry=LAYOUTS)
+
+# Memory budget for concurrent full (openpyxl) workbook loads; saturated
+# requests get 503 + Retry-After (see admission.py)
+ADMISSION = AdmissionControl(budget_fraction=0.5, reserve_bytes=256 * 1024 * 1024,
+                             max_wait=2.0, factors={"openpyxl": 20})
+
+# Parsed workbooks shared by all read paths (see workbook_cache.py)
+WORKBOOK_CACHE = WorkbookCache(max_entries=32, max_bytes=1024 * 1024 * 1024,
+                               admit=lambda size: ADMISSION.admit("openpyxl", size))
+
+# Writers to the same vehicle are serialised, across processes too
+WORKBOOK_LOCKS = WorkbookLocks(APP_DIR / ".locks")
+
+# Fonts parsed once per process for PDF/PNG rendering (see render_fonts.py)
+FONTS = FontRegistry(FONT_DIRS)
+# Pillow sizes used by render_deficiency_image
+PNG_FONT_SIZES = (("B", 48), ("", 28), ("", 30), ("B", 30))
+
+
+def warm_render_fonts():
+    """Load the render fonts up front (main process and pool workers)."""
+    return FONTS.warm_up(PNG_FONT_SIZES)
+
+
+# Worker processes for openpyxl parsing and PDF/PNG rendering (0 = inline)
+RENDER_POOL = RenderPool(max_workers=RENDER_WORKERS,
+                         max_queue=16, default_timeout=60.0,
+                         initializer=warm_render_fonts)
+
+# Photo work (gallery thumbnails, upload ingest) gets its own pool: a gallery
+# page requests dozens of thumbnails at once
+IMAGE_POOL = RenderPool(max_workers=IMAGE_WORKERS, max_queue=64,
+                        default_timeout=30.0)
+THUMBNAILS = ThumbnailCache(IMAGE_POOL.run)
+
+# Rendered deficiency PDF/PNG keyed by the hash of their content
+ARTIFACT_CACHE = ArtifactCache(WORKBOOK_LOCKS, max_bytes=64 * 1024 * 1024)
+
+# Long-running work handed off by the routes (renders, batches, reindexing);
+# one of the workers is always left free for interactive jobs
+JOBS = JobQueue(APP_DIR / ".jobs.sqlite3", workers=3)
+
+# Backend for read_vehicle_snapshot: "streaming" reads only the needed cells
+# (xlsx_reader.py), "openpyxl" loads the full workbook through WORKBOOK_CACHE
+XLSX_READER = "streaming"
+
 # ---------------------------------------------------------------------------
 # Directory helpers
 # ---------------------------------------------------------------------------
 
 def list_manufacturers():
     """List manufacturer folders in BASE_DIR."""
-    if not BASE_DIR.is_dir():
-        return []
-    return sorted([d.name for d in BASE_DIR.iterdir() if d.is_dir()])
+    return TREE_INDEX.list_manufacturers()
 
 
 def list_dates(manufacturer):
     """List date folders under a manufacturer."""
-    mfr_dir = BASE_DIR / manufacturer
-    if not mfr_dir.is_dir():
-        return []
-    return sorted([d.name for d in mfr_dir.iterdir() if d.is_dir()], reverse=True)
+    return TREE_INDEX.list_dates(manufacturer)
 
 
 def list_vehicles(manufacturer, date_folder):
     """List vehicle folders under a date."""
-    date_dir = BASE_DIR / manufacturer / date_folder
-    if not date_dir.is_dir():
-        return []
-    vehicles = []
-    for d in sorted(date_dir.iterdir()):
-        if d.is_dir():
-            # Check if matching xlsx exists inside
-            xlsx = d / f"{d.name}.xlsx"
-            vehicles.append({
-                "name": d.name,
-                "has_excel": xlsx.is_file(),
-            })
-    return vehicles
+    return TREE_INDEX.list_vehicles(manufacturer, date_folder)
 
 
 def get_vehicle_path(manufacturer, date_folder, vehicle):
@@ -70,357 +151,620 @@ def get_photos_dir(manufacturer, date_folder, vehicle):
     return get_vehicle_path(manufacturer, date_folder, vehicle) / "תמונות"
 
 
+# Uploads are copied to disk in chunks of this size (constant memory)
+PHOTO_CHUNK_SIZE = 64 * 1024
+
+# Resumable chunked uploads, stored under תמונות/.uploads (see upload_sessions.py)
+UPLOAD_SESSIONS = UploadSessions(chunk_size=256 * 1024,
+                                 max_size=app.config['MAX_CONTENT_LENGTH'])
+
+# sha256 -> stored file per vehicle, so re-sent photos are not duplicated
+PHOTO_MANIFESTS = PhotoManifests()
+
+
+def photo_extension(content_type: str, filename: str = "") -> str:
+    """File extension for an uploaded photo: png or jpg."""
+    if "png" in (content_type or "") or filename.lower().endswith(".png"):
+        return "png"
+    return "jpg"
+
+
+def new_photo_path(photos_dir: Path, photo_key: str, ext: str) -> Path:
+    """Timestamped target path for a new photo: <key>_<timestamp>.<ext>."""
+    photo_key = Path(photo_key).name or "photo"
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return photos_dir / f"{photo_key}_{ts}.{ext}"
+
+
+def store_photo_stream(photos_dir: Path, photo_key: str, stream, ext: str,
+                       expected_sha256: str = None):
+    """Copy an upload stream into photos_dir via a temp file + rename.
+
+    The content is hashed on the way; a photo whose hash is already in the
+    vehicle's manifest is not stored twice. Returns (path, sha256, duplicate).
+    Raises ValueError if the stream is empty or does not match expected_sha256.
+    """
+    target = new_photo_path(photos_dir, photo_key, ext)
+    fd, tmp = tempfile.mkstemp(prefix=".~", suffix=".part", dir=str(photos_dir))
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            while True:
+                chunk = stream.read(PHOTO_CHUNK_SIZE)
+                if not chunk:
+                    break
+                fh.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+        if size == 0:
+            raise ValueError("empty upload")
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600; photos are shared
+        sha256 = digest.hexdigest()
+        if expected_sha256 and expected_sha256 != sha256:
+            raise ValueError("sha256 mismatch")
+        path, duplicate = PHOTO_MANIFESTS.commit(photos_dir, tmp, sha256, target, photo_key)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    if not duplicate:
+        PHOTO_INGEST.submit(photos_dir, path)
+    return path, sha256, duplicate
+
+
+def _commit_ingested(photos_dir: Path, path: Path, result: dict):
+    """Swap an ingested photo into place (called from PHOTO_INGEST threads)."""
+    if result["tmp"] is None:  # nothing to process: record the capture time
+        if result["captured"] is None:
+            return path
+        return PHOTO_MANIFESTS.replace_file(photos_dir, path, None, path,
+                                            captured=result["captured"])
+    archive = (PHOTO_INGEST.archive_path(photos_dir, path)
+               if PHOTO_INGEST.policy.keep_original else None)
+    return PHOTO_MANIFESTS.replace_file(photos_dir, path, result["tmp"],
+                                        path.with_suffix(result["suffix"]), archive,
+                                        captured=result["captured"])
+
+
+# Downscale / re-encode / strip new photos after the upload is acknowledged
+PHOTO_INGEST = PhotoIngest(IMAGE_POOL.run, _commit_ingested,
+                           IngestPolicy(max_dimension=2560, jpeg_quality=85,
+                                        png_to_jpeg=True, strip_metadata=True,
+                                        keep_original=False))
+
+
 # ---------------------------------------------------------------------------
 # Excel helpers
 # ---------------------------------------------------------------------------
 
-# Cell mapping: מזכירה reference data (source of truth)
-SECRETARY_CELLS = {
-    "N": {  # N2/N3
-        "license":       ("מזכירה", "D16"),
-        "category":      ("מזכירה", "D17"),
-        "tire_front":    ("מזכירה", "D22"),
-        "tire_rear":     ("מזכירה", "D23"),
-        "total_weight":  ("מזכירה", "D24"),
-        "vin":           ("מזכירה", "D25"),
-        "num_wheels":    ("מזכירה", "D29"),
-        "color":         ("מזכירה", "D30"),
-        "axle_distance": ("מזכירה", "D32"),
-        "manufacturer":  ("מזכירה", "D33"),
-        "num_axles":     ("מזכירה", "D42"),
-        "tire_front_hr": ("מזכירה", "D44"),
-        "tire_rear_hr":  ("מזכירה", "D47"),
-        "wvta":          ("מזכירה", "D50"),
-        "weight_total":  ("מזכירה", "D51"),
-        "weight_front":  ("מזכירה", "D52"),
-        "weight_rear":   ("מזכירה", "D53"),
-        "axle_dist_hr":  ("מזכירה", "D55"),
-        # Device 1 secretary reference
-        "sec_dev1_name":         ("מזכירה", "D102"),
-        "sec_dev1_installer":    ("מזכירה", "D100"),
-        "sec_dev1_manufacturer": ("מזכירה", "D108"),
-        "sec_dev1_model":        ("מזכירה", "D109"),
-        "sec_dev1_serial":       ("מזכירה", "D110"),
-        # Device 2 secretary reference
-        "sec_dev2_name":         ("מזכירה", "D128"),
-        "sec_dev2_installer":    ("מזכירה", "D126"),
-        "sec_dev2_manufacturer": ("מזכירה", "D141"),
-        "sec_dev2_model":        ("מזכירה", "D142"),
-        "sec_dev2_serial":       ("מזכירה", "D143"),
-        # Device 3 secretary reference
-        "sec_dev3_name":         ("מזכירה", "D154"),
-        "sec_dev3_installer":    ("מזכירה", "D152"),
-        "sec_dev3_manufacturer": ("מזכירה", "D167"),
-        "sec_dev3_model":        ("מזכירה", "D168"),
-        "sec_dev3_serial":       ("מזכירה", "D169"),
-    },
-    "M": {  # M1
-        "license":       ("מזכירה", "D16"),
-        "category":      ("מזכירה", "D17"),
-        "tire_front":    ("מזכירה", "D22"),
-        "tire_rear":     ("מזכירה", "D23"),
-        "total_weight":  ("מזכירה", "D24"),
-        "vin":           ("מזכירה", "D25"),
-        "color":         ("מזכירה", "D30"),
-        "axle_distance": ("מזכירה", "D32"),
-        "manufacturer":  ("מזכירה", "D33"),
-    },
-}
+def load_workbook_cached(excel_path: Path):
+    """Return the cached data_only workbook for excel_path (read-only use)."""
+    return WORKBOOK_CACHE.get(excel_path, data_only=True)
+
+
+def _find_sheet(wb, token):
+    """Return the first worksheet whose (stripped) name contains token."""
+    for sn in wb.sheetnames:
+        if token in sn.strip():
+            return wb[sn]
+    return None
+
+
+@dataclass
+class VehicleSnapshot:
+    """Everything the routes need from a vehicle workbook, read in one pass."""
+    category: str = "N2"
+    secretary: dict = field(default_factory=dict)
+    deficiencies: dict = field(default_factory=lambda: {"pre": [], "post": [], "meta": {}})
+    examiner_notes: list = field(default_factory=list)
+    examiner: dict = field(default_factory=dict)
+    classification: str = ""
+    classification_options: list = field(default_factory=list)
+    template: str = ""  # fingerprint of the עזר option texts
+    secretary_cells: dict = field(default_factory=dict)  # ref -> value, every layout
+    examiner_cells: dict = field(default_factory=dict)   # ref -> value, בוחן layout cells
+
+    def secretary_for(self, category: str) -> dict:
+        """Secretary fields for the given category's cell mapping."""
+        if not self.secretary_cells:
+            return {}
+        return LAYOUTS.select(category, self.template).secretary_values(self.secretary_cells)
+
+    @property
+    def license(self) -> str:
+        return self.secretary.get("license", "")
+
+    @property
+    def vin(self) -> str:
+        return self.secretary.get("vin", "")
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _read_classification_column(ws) -> list:
+    """Scan column D of גיליון עזר for the values under the T_13 header."""
+    options = []
+    # T_13 values are in column D, starting around row 100
+    found_header = False
+    for row in range(1, 300):
+        val = ws.cell(row=row, column=4).value  # column D
+        if val and "T_13" in str(val):
+            found_header = True
+            continue
+        if found_header and val:
+            s = str(val).strip()
+            if s and s != "-":
+                options.append(s)
+        elif found_header and not val:
+            # Empty cell after values - check if we've collected enough
+            if len(options) > 3:
+                break
+    return options
 
-# Cell mapping: בוחן sheet (where examiner writes)
-EXAMINER_CELLS_N = {
-    "license":        "E42",
-    "color":          "E43",
-    "seats_beside":   "E44",
-    "seats_behind":   "E45",
-    "sleeping":       "E46",
-    "num_axles":      "E48",
-    "num_wheels":     "E49",
-    "tire1":          "E50",
-    "tire2":          "E51",
-    "tire3":          "E52",
-    "tire4":          "E53",
-    "vin":            "E63",
-    "category":       "E65",
-    "manufacturer":   "E69",
-    "wvta":           "E70",
-    "weight_total":   "E72",
-    "weight_coupled": "E73",
-    "weight_axle1":   "E74",
-    "weight_axle2":   "E75",
-    "weight_axle3":   "E76",
-    "weight_axle4":   "E77",
-    "weight_front":   "E80",
-    "weight_rear":    "E81",
-    "axle_distance":  "E135",
-    "total_length":   "E134",
-    "body_length":    "E138",
-    "front_axle_to_edge": "E139",
-    "rear_axle_to_edge":  "E141",
-    "rear_overhang":  "E145",
-    # Weighing - bridge
-    "bridge_front_axles": "E163",
-    "bridge_rear_axles":  "E164",
-    "bridge_total":       "E165",
-    # Weighing - examiner
-    "exam_axle1_right":   "E158",
-    "exam_axle1_left":    "E159",
-    "exam_axle2_right":   "E161",
-    "exam_axle2_left":    "E162",
-    # Device 1
-    "dev1_name":         "E105",
-    "dev1_installer":    "E107",
-    "dev1_manufacturer": "E108",
-    "dev1_model":        "E109",
-    "dev1_serial":       "E110",
-    # Device 2
-    "dev2_name":         "E112",
-    "dev2_installer":    "E114",
-    "dev2_manufacturer": "E115",
-    "dev2_model":        "E116",
-    "dev2_serial":       "E117",
-    # Device 3
-    "dev3_name":         "E119",
-    "dev3_installer":    "E121",
-    "dev3_manufacturer": "E122",
-    "dev3_model":        "E123",
-    "dev3_serial":       "E124",
-}
 
+# Bump when _read_classification_column or the template fingerprint changes
+CLASSIFICATION_SCAN_VERSION = 2
+TEMPLATE_OPTIONS = TemplateOptionsCache(APP_DIR / ".template_options.json")
 
-def _cell_val(ws, cell_ref):
-    """Read a cell value, return stripped string or empty string."""
-    val = ws[cell_ref].value
-    if val is None:
+
+def template_fingerprint(excel_path: Path) -> str:
+    """Template fingerprint of a workbook (hash of its עזר option texts)."""
+    try:
+        with StreamingWorkbook(excel_path) as wb:
+            return read_template(wb)[0]
+    except Exception:
         return ""
-    return str(val).strip()
 
 
-def read_secretary_data(excel_path: Path, category: str) -> dict:
-    """Read reference data from מזכירה sheet."""
-    key = "N" if category in ("N2", "N3") else "M"
-    wb = openpyxl.load_workbook(str(excel_path), data_only=True)
-    mapping = SECRETARY_CELLS[key]
+def _classification_options(helper, template: str, excel_path: Path) -> list:
+    """T_13 options of the workbook's template, scanned once per template."""
+    if helper is None:
+        return []
+    key = f"v{CLASSIFICATION_SCAN_VERSION}-{template}"
+    options = TEMPLATE_OPTIONS.get(key)
+    if options is None:
+        options = _read_classification_column(helper)
+        TEMPLATE_OPTIONS.put(key, options, source=excel_path)
+    return options
+
+
+class _OverlaySheet:
+    """Worksheet view that shows journaled-but-unflushed values on top."""
+
+    def __init__(self, ws, updates):
+        self._ws = ws
+        self._updates = updates
+
+    def __getitem__(self, ref):
+        if ref in self._updates:
+            return _PendingCell(self._updates[ref])
+        return self._ws[ref]
+
+    def cell(self, row, column):
+        ref = f"{get_column_letter(column)}{row}"
+        if ref in self._updates:
+            return _PendingCell(self._updates[ref])
+        return self._ws.cell(row=row, column=column)
 
-    # Find the מזכירה sheet
-    sheet_name = None
-    for sn in wb.sheetnames:
-        if "מזכיר" in sn:
-            sheet_name = sn
-            break
-    if not sheet_name:
-        wb.close()
-        return {}
 
-    ws = wb[sheet_name]
-    result = {}
-    for field, (_, cell) in mapping.items():
-        result[field] = _cell_val(ws, cell)
-    wb.close()
-    return result
+class _PendingCell:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def _open_snapshot_sheets(excel_path: Path):
+    """(sheet token -> worksheet or None, classification options, template fingerprint)."""
+    if XLSX_READER == "streaming":
+        try:
+            with StreamingWorkbook(excel_path) as wb:
+                template, helper = read_template(wb)
+                sheets = {}
+                for token, cells in LAYOUTS.plan(template).items():
+                    name = find_sheet_name(wb.sheetnames, token)
+                    sheets[token] = wb.read_sheet(name, cells) if name is not None else None
+                return sheets, _classification_options(helper, template, excel_path), template
+        except Exception:
+            pass  # Unusual package layout - fall back to openpyxl
+    wb = load_workbook_cached(excel_path)
+    helper = _find_sheet(wb, HELPER)
+    template = helper_fingerprint(helper)
+    options = _classification_options(helper, template, excel_path)
+    sheets = {token: _find_sheet(wb, token) for token in LAYOUTS.plan(template)}
+    return sheets, options, template
+
+
+def extract_snapshot(excel_path: Path, pending: dict = None) -> VehicleSnapshot:
+    """Open the vehicle workbook once and extract every value the UI uses.
+
+    pending holds unflushed בוחן updates to show on top of the file. Runs in
+    RENDER_POOL workers, so arguments and result stay picklable.
+    """
+    sheets, classification_options, template = _open_snapshot_sheets(excel_path)
+    if pending and sheets.get(EXAMINER) is not None:
+        sheets[EXAMINER] = _OverlaySheet(sheets[EXAMINER], pending)
+    snap = VehicleSnapshot(template=template)
+
+    ws = sheets.get(SECRETARY)
+    if ws is not None:
+        snap.secretary_cells = {make_ref(*rc): cell_text(ws, rc)
+                                for rc in LAYOUTS.plan(template)[SECRETARY]}
+        # The category cell of the template's N2 layout decides the rest
+        snap.category = snap.secretary_for("N2").get("category") or "N2"
+        # Every field of every layout; the detected category's cells win
+        for layout in [LAYOUTS.select(snap.category, template)] + LAYOUTS.layouts(template):
+            for f, value in layout.secretary_values(snap.secretary_cells).items():
+                snap.secretary.setdefault(f, value)
+    # Category-specific cells come from the detected category's layout
+    layout = LAYOUTS.select(snap.category, template)
+
+    ws = sheets.get(FINDINGS)
+    if ws is not None:
+        snap.deficiencies = layout.findings_values(ws)
+
+    ws = sheets.get(EXAMINER)
+    if ws is not None:
+        snap.examiner_cells = {make_ref(*rc): cell_text(ws, rc)
+                               for rc in LAYOUTS.plan(template)[EXAMINER]}
+        snap.examiner_notes = layout.note_values(ws)
+        snap.examiner = layout.examiner_values(ws)
+        snap.classification = layout.classification_value(ws)
+
+    snap.classification_options = classification_options
+
+    return snap
+
+
+def parse_vehicle_snapshot(excel_path: Path, pending: dict = None) -> VehicleSnapshot:
+    """Parse the workbook now, with pending edits shown on top."""
+    if XLSX_READER == "openpyxl":
+        # Full openpyxl parses are CPU-heavy; keep them off request threads.
+        # The worker holds the workbook, so charge it to the budget here
+        with ADMISSION.admit("openpyxl", excel_path.stat().st_size, measure=False):
+            return RENDER_POOL.run(extract_snapshot, excel_path, pending)
+    return extract_snapshot(excel_path, pending)
+
+
+def published_snapshot(excel_path: Path) -> VehicleSnapshot:
+    """Snapshot for output that leaves the app (files in the vehicle folder).
+
+    Journaled edits are written into the xlsx first, so the workbook next to
+    the rendered PDF/PNG shows the same data.
+    """
+    SAVE_JOURNAL.flush(excel_path)
+    return read_vehicle_snapshot(excel_path)
+
+
+def read_vehicle_snapshot(excel_path: Path) -> VehicleSnapshot:
+    """Snapshot of the workbook including journaled-but-unflushed edits."""
+    pending = SAVE_JOURNAL.pending(excel_path)
+    if pending:
+        # Edits not yet in the xlsx: the sidecar cannot show them
+        return parse_vehicle_snapshot(excel_path, pending)
+    return SNAPSHOTS.get(excel_path)
+
+
+def read_secretary_data(excel_path: Path, category: str) -> dict:
+    """Read reference data from מזכירה sheet."""
+    return read_vehicle_snapshot(excel_path).secretary_for(category)
 
 
 def detect_category(excel_path: Path) -> str:
     """Auto-detect category from מזכירה D17 cell."""
     try:
-        wb = openpyxl.load_workbook(str(excel_path), data_only=True)
-        for sn in wb.sheetnames:
-            if "מזכיר" in sn:
-                ws = wb[sn]
-                val = _cell_val(ws, "D17")
-                wb.close()
-                if val:
-                    return val
-                break
-        wb.close()
+        return read_vehicle_snapshot(excel_path).category
+    except PoolSaturated:
+        raise  # overloaded: answer 503 rather than guess the category
     except Exception:
-        pass
-    return "N2"
+        return "N2"
 
 
-def write_examiner_data(excel_path: Path, data: dict):
-    """Write examiner field data to בוחן sheet."""
-    wb = openpyxl.load_workbook(str(excel_path))
-
-    # Find בוחן sheet
-    sheet_name = None
-    for sn in wb.sheetnames:
-        if "בוחן" in sn.strip():
-            sheet_name = sn
-            break
-    if not sheet_name:
+def _write_cells_openpyxl(excel_path: Path, sheet_token: str, updates: dict) -> bool:
+    """Full load/save fallback for workbooks the surgical writer rejects."""
+    # Runs in the journal flusher: wait for memory rather than give up
+    with ADMISSION.admit("openpyxl", excel_path.stat().st_size, max_wait=60):
+        wb = openpyxl.load_workbook(str(excel_path))
+        ws = _find_sheet(wb, sheet_token)
+        if ws is None:
+            wb.close()
+            return False
+        for cell_ref, value in updates.items():
+            ws[cell_ref] = value
+        buf = io.BytesIO()
+        wb.save(buf)
         wb.close()
-        return False
+    atomic_write_bytes(excel_path, buf.getvalue())
+    return True
 
-    ws = wb[sheet_name]
-    for field, cell_ref in EXAMINER_CELLS_N.items():
-        if field in data and data[field]:
-            ws[cell_ref] = data[field]
 
-    wb.save(str(excel_path))
-    wb.close()
+def write_examiner_cells(excel_path: Path, updates: dict) -> bool:
+    """Write {cell_ref: value} into the בוחן sheet. False if the sheet is missing."""
+    with WORKBOOK_LOCKS.lock(excel_path.parent):
+        try:
+            ok = xlsx_writer.write_cells(excel_path, EXAMINER, updates)
+        except xlsx_writer.UnsupportedWorkbook:
+            ok = _write_cells_openpyxl(excel_path, EXAMINER, updates)
+        WORKBOOK_CACHE.invalidate(excel_path)
+        SNAPSHOTS.invalidate(excel_path)
+    return ok
+
+
+# Write-behind journal: saves are acknowledged once journaled and flushed to
+# the xlsx in coalesced batches (see save_journal.py)
+JOURNAL_DIR = APP_DIR / ".journal"
+SAVE_JOURNAL = SaveJournal(JOURNAL_DIR, write_examiner_cells, WORKBOOK_LOCKS,
+                           idle_seconds=2.0, max_delay=30.0, max_cells=200)
+
+
+def iter_workbooks():
+    """Every vehicle workbook, most recent date folders first."""
+    for manufacturer in TREE_INDEX.list_manufacturers():
+        for date_folder in TREE_INDEX.list_dates(manufacturer):
+            for v in TREE_INDEX.list_vehicles(manufacturer, date_folder):
+                if v["has_excel"]:
+                    yield get_excel_path(manufacturer, date_folder, v["name"])
+
+
+def _warm_snapshot(excel_path: Path) -> VehicleSnapshot:
+    """Background parse: in a worker process, off the request threads' GIL."""
+    if XLSX_READER == "openpyxl":
+        return parse_vehicle_snapshot(excel_path)
+    return RENDER_POOL.run(extract_snapshot, excel_path, None)
+
+
+# Bump when extract_snapshot changes what it derives from the same cells
+SNAPSHOT_VERSION = 3
+SNAPSHOT_SCHEMA = hashlib.sha1(json.dumps(
+    [SNAPSHOT_VERSION, CLASSIFICATION_SCAN_VERSION, LAYOUTS.signature()],
+    ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+# Parsed snapshots persisted as JSON sidecars, pre-built in the background
+# so cold pages and restarts skip the xlsx parse (see snapshot_store.py)
+SNAPSHOTS = SnapshotStore(
+    APP_DIR / ".snapshots", parse_vehicle_snapshot,
+    dump=asdict, load=lambda data: VehicleSnapshot(**data), schema=SNAPSHOT_SCHEMA,
+    warm_extract=lambda path: _warm_snapshot(path),
+    list_workbooks=iter_workbooks, interval=300.0)
+
+
+def has_examiner_sheet(excel_path: Path) -> bool:
+    """Cheap check (workbook.xml only) that the בוחן sheet exists."""
+    try:
+        with StreamingWorkbook(excel_path) as wb:
+            return find_sheet_name(wb.sheetnames, EXAMINER) is not None
+    except Exception:
+        return True  # let the flush surface the real problem
+
+
+def save_examiner_cells(excel_path: Path, updates: dict) -> bool:
+    """Journal {cell_ref: value} for the בוחן sheet; flushed in the background."""
+    if not has_examiner_sheet(excel_path):
+        return False
+    SAVE_JOURNAL.append(excel_path, updates)
     return True
 
 
-def read_deficiencies(excel_path: Path) -> dict:
-    """Read deficiency data from פ. ממצאים מסכם sheet."""
-    wb = openpyxl.load_workbook(str(excel_path), data_only=True)
-    sheet_name = None
-    for sn in wb.sheetnames:
-        if "ממצאים" in sn:
-            sheet_name = sn
-            break
-    if not sheet_name:
-        wb.close()
-        return {"pre": [], "post": [], "meta": {}}
-
-    ws = wb[sheet_name]
-    meta = {
-        "report_num": _cell_val(ws, "A13"),
-        "manufacturer": _cell_val(ws, "E13"),
-        "license": _cell_val(ws, "H13"),
-        "vin": _cell_val(ws, "J13"),
-    }
+def layout_for(excel_path: Path, category: str = None):
+    """Cell layout of the workbook's template for category.
+
+    Without a category the workbook's own (D17) decides; a missing or
+    unrecognised one means the baseline N layout, as saves always wrote.
+    """
+    template = template_fingerprint(excel_path)
+    if not category:
+        category = LAYOUTS.category_of(detect_category(excel_path), template)
+    return LAYOUTS.select(category, template)
+
+
+def _as_text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def examiner_state(excel_path: Path, pending: dict = None) -> dict:
+    """{ref: text} of the בוחן layout cells as a save finds them (file + journal).
+
+    The journal is read first: a flush finishing in between then only
+    makes the snapshot newer, never drops the edits from both.
+    """
+    if pending is None:
+        pending = SAVE_JOURNAL.pending(excel_path)
+    cells = dict(SNAPSHOTS.get(excel_path).examiner_cells)
+    for ref, value in pending.items():
+        cells[ref] = _as_text(value)
+    return cells
+
+
+# Save sections, each with its own version token so the form, the notes
+# and the classification can be saved concurrently without conflicting
+SAVE_SECTIONS = ("examiner", "notes", "classification")
+
+
+def cells_version(cells: dict, refs) -> str:
+    """Version token of the values of refs; changes whenever one of them does."""
+    raw = json.dumps([cells.get(ref, "") for ref in refs], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def save_versions(cells: dict, layout) -> dict:
+    return {section: cells_version(cells, layout.refs(section)) for section in SAVE_SECTIONS}
+
+
+def _is_fields(value) -> bool:
+    """A JSON object of field -> cell value, as patches and forms carry."""
+    return (isinstance(value, dict) and all(isinstance(k, str) for k in value)
+            and all(v is None or isinstance(v, (str, int, float)) for v in value.values()))
+
+
+def notes_error(layout, notes, patch=False) -> str:
+    """Why notes (a list, or a patch {row index: fields}) are malformed; "" if fine."""
+    if not patch:
+        if not isinstance(notes, list) or not all(_is_fields(n) for n in notes):
+            return "notes חייב להיות רשימה של שורות"
+        return ""
+    if not isinstance(notes, dict):
+        return "patch חייב להיות אובייקט"
+    for key, note in notes.items():
+        if not (isinstance(key, str) and key.isdigit() and int(key) < len(layout.notes)):
+            return f"שורת הערה לא חוקית: {key}"
+        if not _is_fields(note):
+            return f"שדות לא חוקיים בשורת הערה {key}"
+    return ""
+
+
+SAVE_STATS = {"saves": 0, "written": 0, "noop": 0, "cells_written": 0,
+              "cells_unchanged": 0, "conflicts": 0}
+
+
+def save_examiner_delta(excel_path: Path, layout, section: str, updates: dict,
+                        base_version: str = None):
+    """Journal only the updates that change a cell. Returns (response, status).
+
+    The xlsx is not touched when every value is already in place. A
+    base_version other than the section's current token is a conflict
+    (409, with the current token) unless the save changes nothing.
+    """
+    refs = layout.refs(section)
+    if not refs:
+        # e.g. M categories: no examiner form on בוחן yet
+        return {"ok": False, "error": "אין שדות בוחן לשמירה בקטגוריה זו"}, 400
+    # The workbook's journal lock (workbook_locks.py) makes compare-then-
+    # journal atomic across threads and worker processes
+    with SAVE_JOURNAL.locked(excel_path) as journal:
+        cells = examiner_state(excel_path, journal.pending())
+        current = cells_version(cells, refs)
+        changes = {ref: value for ref, value in updates.items()
+                   if _as_text(value) != cells.get(ref, "")}
+        SAVE_STATS["saves"] += 1
+        SAVE_STATS["cells_unchanged"] += len(updates) - len(changes)
+        if not changes:
+            SAVE_STATS["noop"] += 1
+            return {"ok": True, "changed": 0, "version": current}, 200
+        if base_version and base_version != current:
+            SAVE_STATS["conflicts"] += 1
+            return {"ok": False, "conflict": True, "version": current,
+                    "error": "הנתונים שונו ממקום אחר מאז הטעינה"}, 409
+        if not has_examiner_sheet(excel_path):
+            return {"ok": False, "error": "גיליון בוחן לא נמצא"}, 404
+        journal.append(changes)
+        SAVE_STATS["written"] += 1
+        SAVE_STATS["cells_written"] += len(changes)
+        cells.update({ref: _as_text(value) for ref, value in changes.items()})
+        return {"ok": True, "changed": len(changes), "version": cells_version(cells, refs)}, 200
+
+
+def write_examiner_data(excel_path: Path, data: dict, category: str = None,
+                        base_version: str = None, patch=False):
+    """Write examiner field data to בוחן sheet (only the cells that change)."""
+    layout = layout_for(excel_path, category)
+    return save_examiner_delta(excel_path, layout, "examiner",
+                               layout.examiner_updates(data, clear=patch), base_version)
 
-    # Pre-inspection deficiencies (rows 22-27, items 1-6)
-    pre = []
-    for row in range(22, 28):
-        item = {
-            "num": row - 21,
-            "finding": _cell_val(ws, f"B{row}"),
-            "doc_required": _cell_val(ws, f"H{row}"),
-            "photo_required": _cell_val(ws, f"I{row}"),
-            "reinspect": _cell_val(ws, f"J{row}"),
-        }
-        pre.append(item)
-
-    # Post-inspection deficiencies (rows 29-34, items 7-12)
-    post = []
-    for row in range(29, 35):
-        item = {
-            "num": row - 22,
-            "finding": _cell_val(ws, f"B{row}"),
-            "doc_required": _cell_val(ws, f"H{row}"),
-            "photo_required": _cell_val(ws, f"I{row}"),
-            "reinspect": _cell_val(ws, f"J{row}"),
-        }
-        post.append(item)
 
-    wb.close()
-    return {"pre": pre, "post": post, "meta": meta}
+def read_deficiencies(excel_path: Path) -> dict:
+    """Read deficiency data from פ. ממצאים מסכם sheet."""
+    return read_vehicle_snapshot(excel_path).deficiencies
 
 
 def read_examiner_notes(excel_path: Path) -> list:
     """Read examiner deficiency notes from בוחן sheet section 10 (rows 312-319)."""
-    wb = openpyxl.load_workbook(str(excel_path), data_only=True)
-    sheet_name = None
-    for sn in wb.sheetnames:
-        if "בוחן" in sn.strip():
-            sheet_name = sn
-            break
-    if not sheet_name:
-        wb.close()
-        return []
-
-    ws = wb[sheet_name]
-    notes = []
-    for row in range(312, 320):
-        note = {
-            "num": f"10.{row - 311}",
-            "finding": _cell_val(ws, f"D{row}"),
-            "doc_required": _cell_val(ws, f"G{row}"),
-            "photo_required": _cell_val(ws, f"H{row}"),
-        }
-        notes.append(note)
-    wb.close()
-    return notes
+    return read_vehicle_snapshot(excel_path).examiner_notes
 
 
-def write_examiner_notes(excel_path: Path, notes: list):
+def write_examiner_notes(excel_path: Path, notes, category: str = None,
+                         base_version: str = None, patch=False):
     """Write examiner deficiency notes to בוחן sheet section 10 (rows 312-319)."""
-    wb = openpyxl.load_workbook(str(excel_path))
-    sheet_name = None
-    for sn in wb.sheetnames:
-        if "בוחן" in sn.strip():
-            sheet_name = sn
-            break
-    if not sheet_name:
-        wb.close()
-        return False
+    layout = layout_for(excel_path, category)
+    error = notes_error(layout, notes, patch)
+    if error:
+        return {"ok": False, "error": error}, 400
+    return save_examiner_delta(excel_path, layout, "notes",
+                               layout.note_updates(notes, clear=patch), base_version)
+
+
+def collect_deficiency_items(snap: VehicleSnapshot) -> list:
+    """Unified list of findings: pre, post, then section-10 examiner notes."""
+    items = []
+    for item in snap.deficiencies.get("pre", []):
+        if item.get("finding"):
+            items.append(item["finding"])
+    for item in snap.deficiencies.get("post", []):
+        if item.get("finding"):
+            items.append(item["finding"])
+    for note in snap.examiner_notes:
+        if note.get("finding") and note["finding"] != "-":
+            items.append(note["finding"])
+    return items
 
-    ws = wb[sheet_name]
-    for i, note in enumerate(notes[:8]):
-        row = 312 + i
-        if note.get("finding"):
-            ws[f"D{row}"] = note["finding"]
-        if note.get("doc_required"):
-            ws[f"G{row}"] = note["doc_required"]
-        if note.get("photo_required"):
-            ws[f"H{row}"] = note["photo_required"]
-
-    wb.save(str(excel_path))
-    wb.close()
-    return True
 
+# Bump when the PDF/PNG layout changes so cached artifacts are re-rendered
+DEFICIENCY_RENDER_VERSION = 2
 
-def generate_deficiency_pdf(excel_path: Path, manufacturer_name: str) -> bytes:
-    """Generate a PDF summarizing deficiencies."""
-    deficiencies = read_deficiencies(excel_path)
-    examiner_notes = read_examiner_notes(excel_path)
 
-    # Read license + VIN from מזכירה sheet (actual data, not headers)
-    license_num = ""
-    vin_num = ""
-    try:
-        wb_meta = openpyxl.load_workbook(str(excel_path), data_only=True)
-        for sn in wb_meta.sheetnames:
-            if "מזכיר" in sn:
-                ws_meta = wb_meta[sn]
-                license_num = _cell_val(ws_meta, "D16")
-                vin_num = _cell_val(ws_meta, "D25")
-                break
-        wb_meta.close()
-    except Exception:
-        pass
+def deficiency_fingerprint(snap: VehicleSnapshot, manufacturer_name: str, vehicle: str) -> str:
+    """sha256 of everything the deficiency PDF/PNG show."""
+    def findings(rows):
+        return [str(r["finding"]).strip() for r in rows
+                if r.get("finding") and r["finding"] != "-"]
+
+    payload = {
+        "version": DEFICIENCY_RENDER_VERSION,
+        "pre": findings(snap.deficiencies.get("pre", [])),
+        "post": findings(snap.deficiencies.get("post", [])),
+        "notes": findings(snap.examiner_notes),
+        "license": str(snap.license or "").strip(),
+        "vin": str(snap.vin or "").strip(),
+        "manufacturer": manufacturer_name,
+        "vehicle": vehicle,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _pdf_rtl(text):
+    """Reverse Hebrew text for RTL display in PDF."""
+    if not text:
+        return ""
+    return text[::-1] if any('\u0590' <= c <= '\u05FF' for c in text) else text
+
+
+def deficiency_info_line(snap: VehicleSnapshot, manufacturer_name: str, vehicle_name: str) -> str:
+    """"manufacturer  |  license  |  VIN" header line of the deficiency report."""
+    # License + VIN from מזכירה sheet (actual data, not headers)
+    license_num = snap.license
+    vin_num = snap.vin
     # Fallback: extract from vehicle folder name
     if not license_num or not vin_num:
-        vehicle_name = excel_path.stem
         license_num = license_num or vehicle_name
         vin_num = vin_num or ""
 
-    # Use Arial from Windows fonts (supports Hebrew)
-    font_path = r"C:\Windows\Fonts\arial.ttf"
-    font_bold_path = r"C:\Windows\Fonts\arialbd.ttf"
+    parts = []
+    if manufacturer_name:
+        parts.append(manufacturer_name)
+    if license_num:
+        parts.append(license_num)
+    if vin_num:
+        parts.append(vin_num)
+    return "  |  ".join(parts) if parts else vehicle_name
 
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.add_font("Arial", "", font_path, uni=True)
-    pdf.add_font("Arial", "B", font_bold_path, uni=True)
 
-    # Helper for RTL text
-    def rtl(text):
-        """Reverse Hebrew text for RTL display in PDF."""
-        if not text:
-            return ""
-        return text[::-1] if any('\u0590' <= c <= '\u05FF' for c in text) else text
+def _draw_deficiency_page(pdf: FPDF, info_line: str, items: list):
+    """One deficiency report page: title, vehicle line, numbered findings."""
+    pdf.add_page()
 
     # Title
     pdf.set_font("Arial", "B", 20)
-    pdf.cell(0, 14, rtl("חוסרים"), ln=True, align="C")
+    pdf.cell(0, 14, _pdf_rtl("חוסרים"), ln=True, align="C")
     pdf.ln(3)
 
     # Vehicle info
     pdf.set_font("Arial", "", 11)
     pdf.set_text_color(100, 100, 100)
-    parts = []
-    if manufacturer_name:
-        parts.append(manufacturer_name)
-    if license_num:
-        parts.append(license_num)
-    if vin_num:
-        parts.append(vin_num)
-    info_line = "  |  ".join(parts) if parts else excel_path.stem
-    pdf.cell(0, 8, rtl(info_line), ln=True, align="C")
+    pdf.cell(0, 8, _pdf_rtl(info_line), ln=True, align="C")
     pdf.set_text_color(0, 0, 0)
     pdf.ln(8)
 
@@ -429,43 +773,230 @@ def generate_deficiency_pdf(excel_path: Path, manufacturer_name: str) -> bytes:
     pdf.line(10, pdf.get_y(), 200, pdf.get_y())
     pdf.ln(6)
 
-    # Collect all items: deficiencies + examiner notes in one unified list
-    all_items = []
-    idx = 1
-    for item in deficiencies.get("pre", []):
-        if item.get("finding"):
-            all_items.append({"num": idx, "text": item["finding"]})
-            idx += 1
-    for item in deficiencies.get("post", []):
-        if item.get("finding"):
-            all_items.append({"num": idx, "text": item["finding"]})
-            idx += 1
-    for note in examiner_notes:
-        if note.get("finding") and note["finding"] != "-":
-            all_items.append({"num": idx, "text": note["finding"]})
-            idx += 1
-
-    if all_items:
-        for item in all_items:
+    if items:
+        for num, text in enumerate(items, 1):
             pdf.set_font("Arial", "B", 11)
-            pdf.cell(12, 9, str(item["num"]) + ".", border=0, align="C")
+            pdf.cell(12, 9, str(num) + ".", border=0, align="C")
             pdf.set_font("Arial", "", 11)
-            pdf.cell(0, 9, rtl(item["text"]), border=0, ln=True)
+            pdf.cell(0, 9, _pdf_rtl(text), border=0, ln=True)
             # Light separator
             pdf.set_draw_color(230, 230, 230)
             pdf.line(22, pdf.get_y(), 200, pdf.get_y())
             pdf.ln(2)
     else:
         pdf.set_font("Arial", "", 12)
-        pdf.cell(0, 12, rtl("אין חוסרים"), ln=True, align="C")
+        pdf.cell(0, 12, _pdf_rtl("אין חוסרים"), ln=True, align="C")
 
+
+def generate_deficiency_pdf(excel_path: Path, manufacturer_name: str,
+                            snapshot: VehicleSnapshot = None) -> bytes:
+    """Generate a PDF summarizing deficiencies."""
+    snap = snapshot or read_vehicle_snapshot(excel_path)
+
+    info = deficiency_info_line(snap, manufacturer_name, excel_path.stem)
+    # Deficiencies + examiner notes in one unified list
+    items = collect_deficiency_items(snap)
+    pdf = FPDF()
+    # Hebrew-capable regular + bold, parsed once per process
+    FONTS.add_pdf_fonts(pdf, [info, *items])
+    _draw_deficiency_page(pdf, info, items)
     return pdf.output()
 
 
+def generate_batch_pdf(title: str, entries: list) -> bytes:
+    """One PDF for many vehicles: a cover summary, then a page per vehicle.
+
+    entries: [{"vehicle", "license", "info", "items"}] in report order.
+    """
+    pdf = FPDF()
+    FONTS.add_pdf_fonts(pdf, [title] + [text for e in entries
+                                        for text in (e["vehicle"], e["license"], e["info"],
+                                                     *e["items"])])
+
+    # Cover: one row per vehicle with its number of findings
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 20)
+    pdf.cell(0, 14, _pdf_rtl("ריכוז חוסרים"), ln=True, align="C")
+    pdf.set_font("Arial", "", 11)
+    pdf.set_text_color(100, 100, 100)
+    with_items = sum(1 for e in entries if e["items"])
+    pdf.cell(0, 8, _pdf_rtl(f"{title}  |  {len(entries)} רכבים  |  {with_items} עם חוסרים"),
+             ln=True, align="C")
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln(6)
+    for num, entry in enumerate(entries, 1):
+        pdf.set_font("Arial", "B", 11)
+        pdf.cell(12, 8, str(num) + ".", align="C")
+        pdf.set_font("Arial", "", 11)
+        pdf.cell(80, 8, _pdf_rtl(entry["vehicle"]))
+        pdf.cell(60, 8, _pdf_rtl(entry["license"] or ""))
+        pdf.cell(0, 8, str(len(entry["items"])), ln=True, align="C")
+
+    for entry in entries:
+        _draw_deficiency_page(pdf, entry["info"], entry["items"])
+    return pdf.output()
+
+
+def build_deficiency_text(snap: VehicleSnapshot) -> str:
+    """Format the deficiency summary as a WhatsApp text message."""
+    license_num = snap.license
+    vin_num = snap.vin
+
+    # Build text message
+    lines = []
+    lines.append("📋 *חוסרים ופערים*")
+    if license_num:
+        lines.append(f"מס׳ רישוי: {license_num}")
+    if vin_num:
+        lines.append(f"מס׳ שלדה: {vin_num}")
+    lines.append("")
+
+    idx = 1
+    has_items = False
+
+    # Pre-inspection
+    pre_items = [d for d in snap.deficiencies.get("pre", []) if d.get("finding")]
+    if pre_items:
+        has_items = True
+        lines.append("⚠️ *פערים טרם הבדיקה:*")
+        for item in pre_items:
+            lines.append(f"{idx}. {item['finding']}")
+            idx += 1
+        lines.append("")
+
+    # Post-inspection
+    post_items = [d for d in snap.deficiencies.get("post", []) if d.get("finding")]
+    if post_items:
+        has_items = True
+        lines.append("🔴 *פערים לאחר בדיקה:*")
+        for item in post_items:
+            lines.append(f"{idx}. {item['finding']}")
+            idx += 1
+        lines.append("")
+
+    # Examiner notes
+    note_items = [n for n in snap.examiner_notes if n.get("finding") and n["finding"] != "-"]
+    if note_items:
+        has_items = True
+        for note in note_items:
+            lines.append(f"{idx}. {note['finding']}")
+            idx += 1
+        lines.append("")
+
+    if not has_items:
+        lines.append("אין חוסרים.")
+
+    return "\n".join(lines)
+
+
+def render_deficiency_image(snap: VehicleSnapshot, manufacturer_name: str) -> bytes:
+    """Render the deficiency summary as a PNG image (for WhatsApp sharing)."""
+    from PIL import Image, ImageDraw
+
+    license_num = snap.license
+    vin_num = snap.vin
+    all_items = collect_deficiency_items(snap)
+
+    # Create image
+    W = 1080
+    padding = 60
+    line_h = 50
+    header_h = 200
+    content_h = max(len(all_items) * line_h + 40, 100)
+    H = header_h + content_h + padding
+
+    img = Image.new("RGB", (W, H), color=(15, 23, 42))
+    draw = ImageDraw.Draw(img)
+
+    # Cached fonts (Pillow's default font if none is installed)
+    font_title = FONTS.pil(48, "B")
+    font_sub = FONTS.pil(28)
+    font_item = FONTS.pil(30)
+    font_num = FONTS.pil(30, "B")
+
+    y = padding
+
+    # Title
+    draw.text((W // 2, y), "חוסרים", fill=(255, 255, 255), font=font_title, anchor="mt")
+    y += 70
+
+    # Info line
+    info = f"{manufacturer_name}  |  {license_num}  |  {vin_num}"
+    draw.text((W // 2, y), info, fill=(148, 163, 184), font=font_sub, anchor="mt")
+    y += 50
+
+    # Separator
+    draw.line([(padding, y), (W - padding, y)], fill=(51, 65, 85), width=2)
+    y += 30
+
+    # Items
+    if all_items:
+        for i, text in enumerate(all_items):
+            num_text = f".{i + 1}"
+            # Number on the right
+            draw.text((W - padding, y), num_text, fill=(59, 130, 246), font=font_num, anchor="rt")
+            # Text
+            draw.text((W - padding - 60, y), text, fill=(241, 245, 249), font=font_item, anchor="rt")
+            y += line_h
+    else:
+        draw.text((W // 2, y), "אין חוסרים", fill=(148, 163, 184), font=font_sub, anchor="mt")
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
 # ---------------------------------------------------------------------------
 # Routes
 # ---------------------------------------------------------------------------
 
+@app.errorhandler(PoolSaturated)
+def _pool_saturated(e):
+    # Also MemoryBudgetExceeded, which knows how long loads are taking
+    resp = jsonify({"ok": False, "error": "השרת עמוס, נסו שוב בעוד רגע"})
+    resp.headers["Retry-After"] = str(getattr(e, "retry_after", 2))
+    return resp, 503
+
+
+@app.errorhandler(TaskTimeout)
+def _task_timeout(e):
+    return jsonify({"ok": False, "error": str(e)}), 504
+
+
+_services_started = False
+_services_lock = threading.Lock()
+
+
+def start_background_services():
+    """Start background workers up front (once per process, from __main__).
+
+    Under any other host (flask run, a WSGI server) each service starts
+    itself on first use: SAVE_JOURNAL on the first append, JOBS on the
+    first submit, the indexes and SNAPSHOTS on the first lookup.
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    SAVE_JOURNAL.start()
+    TREE_INDEX.start()
+    SEARCH_INDEX.start()
+    SNAPSHOTS.start()
+    JOBS.start()
+
+
+@app.before_request
+def _sample_peak_rss():
+    g.peak_rss = peak_rss()
+
+
+@app.after_request
+def _record_request_memory(response):
+    ADMISSION.sample_request(request.endpoint or "-", g.get("peak_rss"))
+    return response
+
+
 @app.route("/")
 def page_manufacturers():
     """Level 1: list manufacturer folders."""
@@ -476,8 +1007,7 @@ def page_manufacturers():
 @app.route("/dates/<path:manufacturer>")
 def page_dates(manufacturer):
     """Level 2: list date folders for a manufacturer."""
-    mfr_dir = BASE_DIR / manufacturer
-    if not mfr_dir.is_dir():
+    if not TREE_INDEX.exists(manufacturer):
         return render_template("filelist.html", manufacturers=[],
                                error=f"התיקייה לא קיימת בנתיב: {manufacturer}")
     dates = list_dates(manufacturer)
@@ -487,8 +1017,7 @@ def page_dates(manufacturer):
 @app.route("/vehicles/<path:manufacturer>/<date_folder>")
 def page_vehicles(manufacturer, date_folder):
     """Level 3: list vehicle folders for a date."""
-    date_dir = BASE_DIR / manufacturer / date_folder
-    if not date_dir.is_dir():
+    if not TREE_INDEX.exists(manufacturer, date_folder):
         return render_template("dates.html", manufacturer=manufacturer, dates=[],
                                error=f"התיקייה לא קיימת בנתיב: {manufacturer}/{date_folder}")
     vehicles = list_vehicles(manufacturer, date_folder)
@@ -498,6 +1027,35 @@ def page_vehicles(manufacturer, date_folder):
                            vehicles=vehicles)
 
 
+@app.route("/api/tree")
+def api_tree():
+    """JSON listing of the folder tree: manufacturers, dates or vehicles."""
+    manufacturer = request.args.get("manufacturer", "")
+    date_folder = request.args.get("date", "")
+
+    if not manufacturer:
+        return jsonify({"manufacturers": list_manufacturers()})
+    if not TREE_INDEX.exists(manufacturer):
+        return jsonify({"error": "תיקייה לא נמצאה"}), 404
+    if not date_folder:
+        return jsonify({"manufacturer": manufacturer, "dates": list_dates(manufacturer)})
+    if not TREE_INDEX.exists(manufacturer, date_folder):
+        return jsonify({"error": "תיקייה לא נמצאה"}), 404
+    return jsonify({"manufacturer": manufacturer, "date": date_folder,
+                    "vehicles": list_vehicles(manufacturer, date_folder)})
+
+
+@app.route("/api/search")
+def api_search():
+    """Find vehicles by license or VIN (prefix matches first, then substring)."""
+    query = request.args.get("q", "")
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+    except ValueError:
+        limit = 20
+    return jsonify({"query": query, "results": SEARCH_INDEX.search(query, limit)})
+
+
 @app.route("/category/<path:manufacturer>/<date_folder>/<vehicle>")
 def page_category(manufacturer, date_folder, vehicle):
     """Level 4: category selection for a vehicle."""
@@ -530,14 +1088,18 @@ def inspect(manufacturer, date_folder, vehicle, category):
                                manufacturer=manufacturer,
                                date_folder=date_folder)
 
-    secretary = read_secretary_data(excel_path, category)
+    snap = read_vehicle_snapshot(excel_path)
+    secretary = snap.secretary_for(category)
     license_num = secretary.get("license", "---")
 
     # Build a vehicle_path key for the JS (for localStorage + API calls)
     vehicle_key = f"{manufacturer}/{date_folder}/{vehicle}"
 
-    # Read classification options for E87 dropdown
-    classifications = read_classification_options(excel_path)
+    # Classification options for E87 dropdown
+    classifications = snap.classification_options
+
+    # Version tokens of the cells this page saves (see save_examiner_delta)
+    versions = save_versions(snap.examiner_cells, LAYOUTS.select(category, snap.template))
 
     return render_template("inspect.html",
                            category=category,
@@ -547,40 +1109,16 @@ def inspect(manufacturer, date_folder, vehicle, category):
                            vehicle_key=vehicle_key,
                            manufacturer=manufacturer,
                            date_folder=date_folder,
-                           classifications=json.dumps(classifications, ensure_ascii=False))
+                           classifications=json.dumps(classifications, ensure_ascii=False),
+                           versions=json.dumps(versions))
 
 
 def read_classification_options(excel_path: Path) -> list:
     """Read T_13 classification dropdown values from גיליון עזר sheet."""
     try:
-        wb = openpyxl.load_workbook(str(excel_path), data_only=True)
-        ws = None
-        for sn in wb.sheetnames:
-            if "עזר" in sn:
-                ws = wb[sn]
-                break
-        if not ws:
-            wb.close()
-            return []
-
-        options = []
-        # T_13 values are in column D, starting around row 100
-        found_header = False
-        for row in range(1, 300):
-            val = ws.cell(row=row, column=4).value  # column D
-            if val and "T_13" in str(val):
-                found_header = True
-                continue
-            if found_header and val:
-                s = str(val).strip()
-                if s and s != "-":
-                    options.append(s)
-            elif found_header and not val:
-                # Empty cell after values - check if we've collected enough
-                if len(options) > 3:
-                    break
-        wb.close()
-        return options
+        return read_vehicle_snapshot(excel_path).classification_options
+    except PoolSaturated:
+        raise
     except Exception:
         return []
 
@@ -614,22 +1152,13 @@ def api_save_classification():
         return jsonify({"ok": False, "error": "קובץ לא נמצא"}), 404
 
     try:
-        wb = openpyxl.load_workbook(str(excel_path))
-        sheet_name = None
-        for sn in wb.sheetnames:
-            if "בוחן" in sn.strip():
-                sheet_name = sn
-                break
-        if not sheet_name:
-            wb.close()
-            return jsonify({"ok": False, "error": "גיליון בוחן לא נמצא"}), 404
-
-        ws = wb[sheet_name]
-        ws["E87"] = classification
-        ws["E88"] = classification
-        wb.save(str(excel_path))
-        wb.close()
-        return jsonify({"ok": True})
+        layout = layout_for(excel_path, payload.get("category"))
+        result, status = save_examiner_delta(excel_path, layout, "classification",
+                                             layout.classification_updates(classification),
+                                             payload.get("base_version"))
+        return jsonify(result), status
+    except PoolSaturated:
+        raise
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -646,29 +1175,41 @@ def api_secretary():
     if not excel_path.is_file():
         return jsonify({}), 404
 
-    data = read_secretary_data(excel_path, category)
+    data = read_vehicle_snapshot(excel_path).secretary_for(category)
     return jsonify(data)
 
 
 @app.route("/api/save", methods=["POST"])
 def api_save():
-    """Save form data to Excel."""
+    """Save form data to Excel.
+
+    "form" is the whole form (empty fields are left alone); "patch" holds
+    only the changed fields ("" clears a cell). Unchanged cells are not
+    written, and a save that changes nothing does not touch the file. With
+    "base_version" a save over someone else's newer edit answers 409.
+    """
     payload = request.get_json()
     manufacturer = payload.get("manufacturer", "")
     date_folder = payload.get("date", "")
     vehicle = payload.get("vehicle", "")
-    form_data = payload.get("form", {})
+    patch = "patch" in payload
+    form_data = payload.get("patch") if patch else payload.get("form", {})
+    if not _is_fields(form_data):
+        return jsonify({"ok": False, "error": "patch / form חייבים להיות אובייקט של שדות"}), 400
 
     excel_path = get_excel_path(manufacturer, date_folder, vehicle)
     if not excel_path.is_file():
         return jsonify({"ok": False, "error": "קובץ האקסל לא נמצא"}), 404
 
     try:
-        write_examiner_data(excel_path, form_data)
+        result, status = write_examiner_data(excel_path, form_data, payload.get("category"),
+                                             payload.get("base_version"), patch=patch)
+    except PoolSaturated:
+        raise
     except Exception as e:
         return jsonify({"ok": False, "error": f"Excel error: {e}"}), 500
 
-    return jsonify({"ok": True})
+    return jsonify(result), status
 
 
 @app.route("/api/save_photo", methods=["POST"])
@@ -691,12 +1232,196 @@ def api_save_photo():
     header, b64data = photo_b64.split(",", 1)
     ext = "png" if "png" in header else "jpg"
     img_bytes = base64.b64decode(b64data)
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    fname = f"{photo_key}_{ts}.{ext}"
-    target = photos_dir / fname
-    target.write_bytes(img_bytes)
+    target, sha256, duplicate = store_photo_stream(photos_dir, photo_key,
+                                                   io.BytesIO(img_bytes), ext)
+
+    return jsonify({"ok": True, "file": str(target), "sha256": sha256, "duplicate": duplicate})
+
+
+@app.route("/api/upload_photo", methods=["POST"])
+def api_upload_photo():
+    """Stream a photo to the vehicle's תמונות folder (raw body or multipart).
+
+    Raw: POST the image bytes with an image/* Content-Type and the vehicle
+    fields (manufacturer, date, vehicle, key) in the query string.
+    Multipart: a "photo" file part plus the same fields as form fields.
+    An optional sha256 field makes the upload idempotent: a photo already
+    stored is acknowledged without reading the body.
+    """
+    upload = request.files.get("photo") if request.mimetype == "multipart/form-data" else None
+    fields = request.form if upload is not None else request.args
+    manufacturer = fields.get("manufacturer", "")
+    date_folder = fields.get("date", "")
+    vehicle = fields.get("vehicle", "")
+    photo_key = fields.get("key", "photo")
+    declared = (fields.get("sha256") or "").lower() or None
+
+    photos_dir = get_photos_dir(manufacturer, date_folder, vehicle)
+    if not photos_dir.is_dir():
+        return jsonify({"ok": False, "error": "תיקיית תמונות לא קיימת בנתיב"}), 404
+
+    existing = PHOTO_MANIFESTS.lookup(photos_dir, declared) if declared else None
+    if existing is not None:
+        return jsonify({"ok": True, "file": str(existing), "sha256": declared, "duplicate": True})
 
-    return jsonify({"ok": True, "file": str(target)})
+    if upload is not None:
+        stream = upload.stream
+        ext = photo_extension(upload.mimetype, upload.filename or "")
+    else:
+        stream = request.stream
+        ext = photo_extension(request.mimetype)
+
+    try:
+        target, sha256, duplicate = store_photo_stream(photos_dir, photo_key, stream, ext,
+                                                       expected_sha256=declared)
+    except ValueError as e:
+        if str(e) == "sha256 mismatch":
+            return jsonify({"ok": False, "error": "אימות hash נכשל"}), 422
+        return jsonify({"ok": False, "error": "No photo data"}), 400
+    return jsonify({"ok": True, "file": str(target), "sha256": sha256, "duplicate": duplicate})
+
+
+@app.route("/api/photos/preflight", methods=["POST"])
+def api_photos_preflight():
+    """Which of {hashes} the vehicle does not have yet: {missing: [...]}."""
+    payload = request.get_json()
+    photos_dir = get_photos_dir(payload.get("manufacturer", ""), payload.get("date", ""),
+                                payload.get("vehicle", ""))
+    if not photos_dir.is_dir():
+        return jsonify({"ok": False, "error": "תיקיית תמונות לא קיימת בנתיב"}), 404
+    hashes = [str(h).lower() for h in payload.get("hashes", [])]
+    return jsonify({"ok": True, "missing": PHOTO_MANIFESTS.missing(photos_dir, hashes)})
+
+
+def _gallery_photo(photos_dir, name):
+    """Path of photo name inside photos_dir, or None for anything else."""
+    if not name or name.startswith(".") or Path(name).name != name:
+        return None
+    path = photos_dir / name
+    return path if path.is_file() else None
+
+
+@app.route("/api/photos")
+def api_photos():
+    """Paginated photo list of a vehicle, newest first (offset, limit)."""
+    photos_dir = get_photos_dir(request.args.get("manufacturer", ""),
+                                request.args.get("date", ""),
+                                request.args.get("vehicle", ""))
+    if not photos_dir.is_dir():
+        return jsonify({"ok": False, "error": "תיקיית תמונות לא קיימת בנתיב"}), 404
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", 40, type=int), 1), 200)
+
+    photos = list_photos(photos_dir, PHOTO_MANIFESTS.captured(photos_dir))
+    page = photos[offset:offset + limit]
+    for p in page:
+        del p["mtime_ns"]
+    next_offset = offset + limit if offset + limit < len(photos) else None
+    return jsonify({"ok": True, "photos": page, "total": len(photos),
+                    "offset": offset, "next_offset": next_offset})
+
+
+@app.route("/api/photos/thumb")
+def api_photo_thumb():
+    """Cached thumbnail of one photo (size=128|256|512, format=jpeg|webp)."""
+    photos_dir = get_photos_dir(request.args.get("manufacturer", ""),
+                                request.args.get("date", ""),
+                                request.args.get("vehicle", ""))
+    src = _gallery_photo(photos_dir, request.args.get("name", ""))
+    if src is None:
+        return jsonify({"ok": False, "error": "תמונה לא נמצאה"}), 404
+    px = request.args.get("size", 256, type=int)
+    fmt = request.args.get("format", "jpeg")
+    if px not in THUMB_SIZES or fmt not in THUMB_FORMATS:
+        return jsonify({"ok": False, "error": "גודל או פורמט לא נתמכים"}), 400
+
+    try:
+        thumb, etag = THUMBNAILS.get(photos_dir, src.name, px, fmt)
+    except (PoolSaturated, TaskTimeout):
+        raise
+    except Exception as e:
+        return jsonify({"ok": False, "error": f"Thumbnail error: {e}"}), 500
+    resp = send_file(thumb, mimetype=f"image/{fmt}", etag=etag, conditional=True,
+                     max_age=86400)
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    return resp
+
+
+@app.route("/api/photos/file")
+def api_photo_file():
+    """Full-resolution photo, with ETag / Last-Modified revalidation."""
+    photos_dir = get_photos_dir(request.args.get("manufacturer", ""),
+                                request.args.get("date", ""),
+                                request.args.get("vehicle", ""))
+    src = _gallery_photo(photos_dir, request.args.get("name", ""))
+    if src is None:
+        return jsonify({"ok": False, "error": "תמונה לא נמצאה"}), 404
+    return send_file(src, conditional=True)
+
+
+@app.route("/api/uploads", methods=["POST"])
+def api_upload_create():
+    """Start a resumable upload: {manufacturer, date, vehicle, key, size, sha256?}."""
+    payload = request.get_json()
+    photos_dir = get_photos_dir(payload.get("manufacturer", ""), payload.get("date", ""),
+                                payload.get("vehicle", ""))
+    if not photos_dir.is_dir():
+        return jsonify({"ok": False, "error": "תיקיית תמונות לא קיימת בנתיב"}), 404
+
+    declared = payload.get("sha256") or None
+    existing = PHOTO_MANIFESTS.lookup(photos_dir, declared) if declared else None
+    if existing is not None:
+        return jsonify({"ok": True, "file": str(existing), "sha256": declared, "duplicate": True})
+
+    info = UPLOAD_SESSIONS.create(photos_dir, payload.get("key", "photo"),
+                                  payload.get("size"),
+                                  photo_extension(payload.get("content_type", "")),
+                                  sha256=declared)
+    return jsonify({"ok": True, **info})
+
+
+def _upload_photos_dir():
+    """Photos folder for the vehicle named in the query string."""
+    photos_dir = get_photos_dir(request.args.get("manufacturer", ""),
+                                request.args.get("date", ""),
+                                request.args.get("vehicle", ""))
+    if not photos_dir.is_dir():
+        raise UploadError("תיקיית תמונות לא קיימת בנתיב", 404)
+    return photos_dir
+
+
+@app.route("/api/uploads/<session_id>")
+def api_upload_status(session_id):
+    """Received byte ranges and missing chunks of an upload session."""
+    return jsonify({"ok": True, **UPLOAD_SESSIONS.status(_upload_photos_dir(), session_id)})
+
+
+@app.route("/api/uploads/<session_id>/<int:index>", methods=["PUT"])
+def api_upload_chunk(session_id, index):
+    """Store one numbered chunk (raw body)."""
+    info = UPLOAD_SESSIONS.write_chunk(_upload_photos_dir(), session_id, index, request.stream)
+    return jsonify({"ok": True, **info})
+
+
+@app.route("/api/uploads/<session_id>/finalize", methods=["POST"])
+def api_upload_finalize(session_id):
+    """Verify the assembled upload and move it into תמונות."""
+    photos_dir = _upload_photos_dir()
+    part, meta = UPLOAD_SESSIONS.finalize(photos_dir, session_id)
+    target, duplicate = PHOTO_MANIFESTS.commit(
+        photos_dir, part, meta["computed_sha256"],
+        new_photo_path(photos_dir, meta["key"], meta["ext"]), meta["key"])
+    UPLOAD_SESSIONS.discard(photos_dir, session_id)
+    if not duplicate:
+        PHOTO_INGEST.submit(photos_dir, target)
+    return jsonify({"ok": True, "file": str(target), "sha256": meta["computed_sha256"],
+                    "duplicate": duplicate})
+
+
+@app.errorhandler(UploadError)
+def _upload_error(e):
+    return jsonify({"ok": False, "error": str(e)}), e.status
 
 
 @app.route("/api/deficiencies")
@@ -710,27 +1435,37 @@ def api_deficiencies():
     if not excel_path.is_file():
         return jsonify({"error": "קובץ לא נמצא"}), 404
 
-    deficiencies = read_deficiencies(excel_path)
-    examiner_notes = read_examiner_notes(excel_path)
-    return jsonify({"deficiencies": deficiencies, "examiner_notes": examiner_notes})
+    snap = read_vehicle_snapshot(excel_path)
+    category = request.args.get("category") or snap.category
+    versions = save_versions(snap.examiner_cells, LAYOUTS.select(category, snap.template))
+    return jsonify({"deficiencies": snap.deficiencies, "examiner_notes": snap.examiner_notes,
+                    "version": versions["notes"]})
 
 
 @app.route("/api/save_deficiency_notes", methods=["POST"])
 def api_save_deficiency_notes():
-    """Save examiner deficiency notes to בוחן sheet section 10."""
+    """Save examiner deficiency notes to בוחן sheet section 10.
+
+    "notes" is the list of all rows, or "patch" maps row index -> changed
+    fields; same delta and base_version rules as /api/save.
+    """
     payload = request.get_json()
     manufacturer = payload.get("manufacturer", "")
     date_folder = payload.get("date", "")
     vehicle = payload.get("vehicle", "")
-    notes = payload.get("notes", [])
+    patch = "patch" in payload
+    notes = payload.get("patch") if patch else payload.get("notes", [])
 
     excel_path = get_excel_path(manufacturer, date_folder, vehicle)
     if not excel_path.is_file():
         return jsonify({"ok": False, "error": "קובץ לא נמצא"}), 404
 
     try:
-        write_examiner_notes(excel_path, notes)
-        return jsonify({"ok": True})
+        result, status = write_examiner_notes(excel_path, notes, payload.get("category"),
+                                              payload.get("base_version"), patch=patch)
+        return jsonify(result), status
+    except PoolSaturated:
+        raise
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -746,74 +1481,39 @@ def api_deficiency_text():
     if not excel_path.is_file():
         return jsonify({"error": "קובץ לא נמצא"}), 404
 
-    deficiencies = read_deficiencies(excel_path)
-    examiner_notes = read_examiner_notes(excel_path)
+    snap = read_vehicle_snapshot(excel_path)
+    return jsonify({"text": build_deficiency_text(snap)})
 
-    # Read license + VIN from מזכירה
-    license_num = ""
-    vin_num = ""
-    try:
-        wb = openpyxl.load_workbook(str(excel_path), data_only=True)
-        for sn in wb.sheetnames:
-            if "מזכיר" in sn:
-                ws = wb[sn]
-                license_num = _cell_val(ws, "D16")
-                vin_num = _cell_val(ws, "D25")
-                break
-        wb.close()
-    except Exception:
-        pass
 
-    # Build text message
-    lines = []
-    lines.append("📋 *חוסרים ופערים*")
-    if license_num:
-        lines.append(f"מס׳ רישוי: {license_num}")
-    if vin_num:
-        lines.append(f"מס׳ שלדה: {vin_num}")
-    lines.append("")
+def _render_pdf(excel_path: Path, manufacturer: str, snap: VehicleSnapshot) -> bytes:
+    return RENDER_POOL.run(generate_deficiency_pdf, excel_path, manufacturer, snap)
 
-    idx = 1
-    has_items = False
 
-    # Pre-inspection
-    pre_items = [d for d in deficiencies.get("pre", []) if d.get("finding")]
-    if pre_items:
-        has_items = True
-        lines.append("⚠️ *פערים טרם הבדיקה:*")
-        for item in pre_items:
-            lines.append(f"{idx}. {item['finding']}")
-            idx += 1
-        lines.append("")
+def _render_png(excel_path: Path, manufacturer: str, snap: VehicleSnapshot) -> bytes:
+    return RENDER_POOL.run(render_deficiency_image, snap, manufacturer)
 
-    # Post-inspection
-    post_items = [d for d in deficiencies.get("post", []) if d.get("finding")]
-    if post_items:
-        has_items = True
-        lines.append("🔴 *פערים לאחר בדיקה:*")
-        for item in post_items:
-            lines.append(f"{idx}. {item['finding']}")
-            idx += 1
-        lines.append("")
 
-    # Examiner notes
-    note_items = [n for n in examiner_notes if n.get("finding") and n["finding"] != "-"]
-    if note_items:
-        has_items = True
-        for note in note_items:
-            lines.append(f"{idx}. {note['finding']}")
-            idx += 1
-        lines.append("")
+# kind -> (mimetype, renderer, endpoint serving "<vehicle> - חוסרים.<kind>")
+DEFICIENCY_ARTIFACTS = {
+    "pdf": ("application/pdf", _render_pdf, "api_deficiency_pdf"),
+    "png": ("image/png", _render_png, "api_deficiency_image"),
+}
 
-    if not has_items:
-        lines.append("אין חוסרים.")
 
-    return jsonify({"text": "\n".join(lines)})
+def _artifact_bytes(kind: str, excel_path: Path, manufacturer: str, vehicle: str,
+                    snap: VehicleSnapshot, digest: str) -> bytes:
+    """The artifact for digest, rendered and written only when content changed."""
+    render = DEFICIENCY_ARTIFACTS[kind][1]
+    return ARTIFACT_CACHE.get(excel_path.parent / f"{vehicle} - חוסרים.{kind}", digest,
+                              lambda: render(excel_path, manufacturer, snap))
 
 
-@app.route("/api/deficiency_pdf")
-def api_deficiency_pdf():
-    """Generate PDF, save to vehicle folder, and return it."""
+def _deficiency_artifact(kind: str):
+    """Serve "<vehicle> - חוסרים.<kind>", rendered only when its content changed.
+
+    The ETag is the content hash, so a repeated share gets 304 without
+    rendering anything.
+    """
     manufacturer = request.args.get("manufacturer", "")
     date_folder = request.args.get("date", "")
     vehicle = request.args.get("vehicle", "")
@@ -823,145 +1523,303 @@ def api_deficiency_pdf():
         return jsonify({"error": "קובץ לא נמצא"}), 404
 
     try:
-        pdf_bytes = generate_deficiency_pdf(excel_path, manufacturer)
-
-        # Save PDF to vehicle folder with name matching Excel + חוסרים
-        vehicle_dir = get_vehicle_path(manufacturer, date_folder, vehicle)
-        pdf_filename = f"{vehicle} - חוסרים.pdf"
-        pdf_path = vehicle_dir / pdf_filename
-        try:
-            pdf_path.write_bytes(pdf_bytes)
-        except PermissionError:
-            # File may be open; save with timestamp suffix
-            ts = datetime.now().strftime("%H%M%S")
-            pdf_path = vehicle_dir / f"{vehicle} - חוסרים_{ts}.pdf"
-            pdf_path.write_bytes(pdf_bytes)
-
-        return send_file(
-            io.BytesIO(pdf_bytes),
-            mimetype="application/pdf",
-            as_attachment=True,
-            download_name=pdf_filename
-        )
+        snap = published_snapshot(excel_path)
+        digest = deficiency_fingerprint(snap, manufacturer, vehicle)
+        etag = f"{kind}-{digest[:32]}"
+        if request.if_none_match.contains(etag):
+            ARTIFACT_CACHE.record_not_modified()
+            resp = app.response_class(status=304)
+            resp.set_etag(etag)
+            return resp
+
+        data = _artifact_bytes(kind, excel_path, manufacturer, vehicle, snap, digest)
+        return send_file(io.BytesIO(data), mimetype=DEFICIENCY_ARTIFACTS[kind][0],
+                         as_attachment=True, download_name=f"{vehicle} - חוסרים.{kind}",
+                         etag=etag, conditional=True)
+    except (PoolSaturated, TaskTimeout):
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/deficiency_pdf")
+def api_deficiency_pdf():
+    """Generate PDF, save to vehicle folder, and return it."""
+    return _deficiency_artifact("pdf")
+
+
 @app.route("/api/deficiency_image")
 def api_deficiency_image():
     """Generate a deficiency summary as PNG image for easy WhatsApp sharing."""
-    manufacturer_param = request.args.get("manufacturer", "")
+    return _deficiency_artifact("png")
+
+
+def render_deficiency_files(excel_path: Path, manufacturer: str, vehicle: str,
+                            snap: VehicleSnapshot, digest: str, progress=None) -> dict:
+    """Render every deficiency artifact concurrently; {kind: error or None}."""
+    def render(kind):
+        try:
+            _artifact_bytes(kind, excel_path, manufacturer, vehicle, snap, digest)
+            return None
+        except Exception as e:
+            return str(e)
+
+    errors = {}
+    with ThreadPoolExecutor(max_workers=len(DEFICIENCY_ARTIFACTS)) as pool:
+        futures = {kind: pool.submit(render, kind) for kind in DEFICIENCY_ARTIFACTS}
+        for kind, future in futures.items():
+            errors[kind] = future.result()
+            if progress is not None:
+                progress(len(errors), len(futures), kind)
+    return errors
+
+
+def _job_deficiency_files(ctx, manufacturer, date, vehicle):
+    excel_path = get_excel_path(manufacturer, date, vehicle)
+    if not excel_path.is_file():
+        raise FileNotFoundError(f"{excel_path.name} not found")
+    snap = published_snapshot(excel_path)
+    digest = deficiency_fingerprint(snap, manufacturer, vehicle)
+    errors = render_deficiency_files(excel_path, manufacturer, vehicle, snap, digest,
+                                     progress=ctx.progress)
+    return {"files": {kind: {"ok": error is None, "error": error, "etag": f"{kind}-{digest[:32]}"}
+                      for kind, error in errors.items()}}
+
+
+JOBS.register("deficiency_files", _job_deficiency_files,
+              retries=2, retry_on=(PoolSaturated, TaskTimeout))
+
+
+@app.route("/api/share_bundle")
+def api_share_bundle():
+    """WhatsApp text plus PDF and PNG, from one workbook read.
+
+    Both files are rendered concurrently and written to the vehicle folder;
+    the response carries the text and, per file, its name, URL and ETag.
+    A failed render does not block the text. With async=1 the files are
+    rendered by a background job and the text comes back at once, with the
+    job id to follow on /api/jobs/<id>/events.
+    """
+    manufacturer = request.args.get("manufacturer", "")
     date_folder = request.args.get("date", "")
     vehicle = request.args.get("vehicle", "")
 
-    excel_path = get_excel_path(manufacturer_param, date_folder, vehicle)
+    excel_path = get_excel_path(manufacturer, date_folder, vehicle)
     if not excel_path.is_file():
-        return jsonify({"error": "קובץ לא נמצא"}), 404
+        return jsonify({"ok": False, "error": "קובץ לא נמצא"}), 404
 
-    try:
-        from PIL import Image, ImageDraw, ImageFont
+    snap = published_snapshot(excel_path)
+    digest = deficiency_fingerprint(snap, manufacturer, vehicle)
 
-        deficiencies = read_deficiencies(excel_path)
-        examiner_notes = read_examiner_notes(excel_path)
+    files = {}
+    for kind, (_, _, endpoint) in DEFICIENCY_ARTIFACTS.items():
+        files[kind] = {
+            "ok": True,
+            "file": f"{vehicle} - חוסרים.{kind}",
+            "etag": f"{kind}-{digest[:32]}",
+            "url": url_for(endpoint, manufacturer=manufacturer, date=date_folder, vehicle=vehicle),
+        }
 
-        # Read license + VIN from מזכירה
-        license_num = ""
-        vin_num = ""
-        try:
-            wb_meta = openpyxl.load_workbook(str(excel_path), data_only=True)
-            for sn in wb_meta.sheetnames:
-                if "מזכיר" in sn:
-                    ws_meta = wb_meta[sn]
-                    license_num = _cell_val(ws_meta, "D16")
-                    vin_num = _cell_val(ws_meta, "D25")
-                    break
-            wb_meta.close()
-        except Exception:
-            pass
+    if request.args.get("async") == "1":
+        job_id = JOBS.submit("deficiency_files", {"manufacturer": manufacturer,
+                                                  "date": date_folder, "vehicle": vehicle},
+                             priority=PRIORITY_INTERACTIVE)
+        return jsonify({"ok": True, "text": build_deficiency_text(snap), "files": files,
+                        "job_id": job_id,
+                        "events": url_for("api_job_events", job_id=job_id)})
 
-        # Collect all items
-        all_items = []
-        for item in deficiencies.get("pre", []):
-            if item.get("finding"):
-                all_items.append(item["finding"])
-        for item in deficiencies.get("post", []):
-            if item.get("finding"):
-                all_items.append(item["finding"])
-        for note in examiner_notes:
-            if note.get("finding") and note["finding"] != "-":
-                all_items.append(note["finding"])
-
-        # Create image
-        W = 1080
-        padding = 60
-        line_h = 50
-        header_h = 200
-        content_h = max(len(all_items) * line_h + 40, 100)
-        H = header_h + content_h + padding
-
-        img = Image.new("RGB", (W, H), color=(15, 23, 42))
-        draw = ImageDraw.Draw(img)
-
-        # Load font
-        try:
-            font_title = ImageFont.truetype(r"C:\Windows\Fonts\arialbd.ttf", 48)
-            font_sub = ImageFont.truetype(r"C:\Windows\Fonts\arial.ttf", 28)
-            font_item = ImageFont.truetype(r"C:\Windows\Fonts\arial.ttf", 30)
-            font_num = ImageFont.truetype(r"C:\Windows\Fonts\arialbd.ttf", 30)
-        except Exception:
-            font_title = ImageFont.load_default()
-            font_sub = font_title
-            font_item = font_title
-            font_num = font_title
-
-        y = padding
-
-        # Title
-        draw.text((W // 2, y), "חוסרים", fill=(255, 255, 255), font=font_title, anchor="mt")
-        y += 70
-
-        # Info line
-        info = f"{manufacturer_param}  |  {license_num}  |  {vin_num}"
-        draw.text((W // 2, y), info, fill=(148, 163, 184), font=font_sub, anchor="mt")
-        y += 50
-
-        # Separator
-        draw.line([(padding, y), (W - padding, y)], fill=(51, 65, 85), width=2)
-        y += 30
-
-        # Items
-        if all_items:
-            for i, text in enumerate(all_items):
-                num_text = f".{i + 1}"
-                # Number on the right
-                draw.text((W - padding, y), num_text, fill=(59, 130, 246), font=font_num, anchor="rt")
-                # Text
-                draw.text((W - padding - 60, y), text, fill=(241, 245, 249), font=font_item, anchor="rt")
-                y += line_h
-        else:
-            draw.text((W // 2, y), "אין חוסרים", fill=(148, 163, 184), font=font_sub, anchor="mt")
-
-        # Save to vehicle folder
-        vehicle_dir = get_vehicle_path(manufacturer_param, date_folder, vehicle)
-        img_filename = f"{vehicle} - חוסרים.png"
-        img_path = vehicle_dir / img_filename
-        try:
-            img.save(str(img_path))
-        except Exception:
-            ts = datetime.now().strftime("%H%M%S")
-            img_path = vehicle_dir / f"{vehicle} - חוסרים_{ts}.png"
-            img.save(str(img_path))
+    errors = render_deficiency_files(excel_path, manufacturer, vehicle, snap, digest)
+    for kind, error in errors.items():
+        if error is not None:
+            files[kind] = {"ok": False, "error": error}
+    return jsonify({"ok": True, "text": build_deficiency_text(snap), "files": files})
 
-        # Return image
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        return send_file(buf, mimetype="image/png", as_attachment=True,
-                         download_name=img_filename)
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+# ---------------------------------------------------------------------------
+# Batch deficiency reports
+# ---------------------------------------------------------------------------
+
+def batch_scope(manufacturer: str, date_folder: str = None):
+    """(scope, [(manufacturer, date, vehicle)]) for a date folder or a whole manufacturer."""
+    dates = [date_folder] if date_folder else TREE_INDEX.list_dates(manufacturer)
+    vehicles = [(manufacturer, d, v["name"]) for d in dates
+                for v in TREE_INDEX.list_vehicles(manufacturer, d) if v["has_excel"]]
+    return {"manufacturer": manufacturer, "date": date_folder}, vehicles
+
+
+def batch_process_vehicle(manufacturer: str, date_folder: str, vehicle: str,
+                          options: dict) -> dict:
+    """Render the vehicle's deficiency files unless they are already current."""
+    excel_path = get_excel_path(manufacturer, date_folder, vehicle)
+    if not excel_path.is_file():
+        return {"status": MISSING}
+    snap = published_snapshot(excel_path)
+    digest = deficiency_fingerprint(snap, manufacturer, vehicle)
+    force = bool(options.get("force"))
+
+    status = SKIPPED
+    for kind in ("pdf", "png") if options.get("png") else ("pdf",):
+        path = excel_path.parent / f"{vehicle} - חוסרים.{kind}"
+        if force or not ARTIFACT_CACHE.is_current(path, digest):
+            render = DEFICIENCY_ARTIFACTS[kind][1]
+            # Batches touch many files once: keep them out of the memory cache
+            ARTIFACT_CACHE.get(path, digest, lambda: render(excel_path, manufacturer, snap),
+                               remember=False, force=force)
+            status = RENDERED
+    return {"status": status, "license": str(snap.license or ""),
+            "info": deficiency_info_line(snap, manufacturer, vehicle),
+            "items": collect_deficiency_items(snap)}
+
+
+def write_batch_pdf(scope: dict, entries: list, options: dict) -> Path:
+    """Write the merged report next to the vehicles it covers."""
+    manufacturer, date_folder = scope["manufacturer"], scope["date"]
+    if date_folder:
+        title = f"{manufacturer}  |  {date_folder}"
+        path = BASE_DIR / manufacturer / date_folder / f"חוסרים - {date_folder}.pdf"
+    else:
+        title = manufacturer
+        path = BASE_DIR / manufacturer / f"חוסרים - {manufacturer}.pdf"
+    pages = [{k: e[k] for k in ("vehicle", "license", "info", "items")} for e in entries]
+    data = RENDER_POOL.run(generate_batch_pdf, title, pages, timeout=300)
+    atomic_write_bytes(path, data)
+    return path
+
+
+BATCH_REPORTS = BatchReports(batch_process_vehicle, write_batch_pdf, workers=2)
+
+
+def _job_batch_reports(ctx, manufacturer, date=None, png=False, merged=False, force=False):
+    scope, vehicles = batch_scope(manufacturer, date)
+    options = {"png": png, "merged": merged, "force": force}
+    ctx.progress(0, len(vehicles))
+    return BATCH_REPORTS.run(scope, vehicles, options, progress=ctx.progress,
+                             cancelled=lambda: ctx.cancelled)
+
+
+JOBS.register("batch_reports", _job_batch_reports)
+
+
+@app.route("/api/batch_reports", methods=["POST"])
+def api_batch_reports():
+    """Queue a batch of deficiency reports for a date folder or manufacturer."""
+    data = request.get_json(silent=True) or {}
+    manufacturer = data.get("manufacturer", "")
+    date_folder = data.get("date") or None
+    parts = (manufacturer, date_folder) if date_folder else (manufacturer,)
+    if not manufacturer or not TREE_INDEX.exists(*parts):
+        return jsonify({"ok": False, "error": "תיקייה לא נמצאה"}), 404
+
+    _, vehicles = batch_scope(manufacturer, date_folder)
+    if not vehicles:
+        return jsonify({"ok": False, "error": "לא נמצאו רכבים עם קובץ אקסל"}), 404
+    params = {"manufacturer": manufacturer, "date": date_folder,
+              **{k: bool(data.get(k)) for k in ("png", "merged", "force")}}
+    job_id = JOBS.submit("batch_reports", params, priority=PRIORITY_BATCH)
+    return jsonify({"ok": True, "job_id": job_id, "total": len(vehicles),
+                    "events": url_for("api_job_events", job_id=job_id)})
+
+
+# ---------------------------------------------------------------------------
+# Background jobs
+# ---------------------------------------------------------------------------
+
+def _job_reindex(ctx):
+    ctx.progress(message="tree")
+    TREE_INDEX.refresh()
+    ctx.progress(message="search")
+    return SEARCH_INDEX.crawl()
+
+
+JOBS.register("reindex", _job_reindex)
+
+# SSE streams end after this long; EventSource reconnects on its own
+JOB_EVENTS_MAX_SECONDS = 300
+
+
+@app.route("/api/reindex", methods=["POST"])
+def api_reindex():
+    """Rescan the folder tree and the search index in the background."""
+    job_id = JOBS.submit("reindex", priority=PRIORITY_BATCH)
+    return jsonify({"ok": True, "job_id": job_id,
+                    "events": url_for("api_job_events", job_id=job_id)})
+
+
+@app.route("/api/jobs")
+def api_jobs():
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 200)
+    return jsonify({"ok": True, "jobs": JOBS.list(limit)})
+
+
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "משימה לא נמצאה"}), 404
+    return jsonify({"ok": True, **job})
+
+
+@app.route("/api/jobs/<job_id>/cancel", methods=["POST"])
+def api_job_cancel(job_id):
+    if not JOBS.cancel(job_id):
+        return jsonify({"ok": False, "error": "משימה לא נמצאה"}), 404
+    return jsonify({"ok": True})
+
+
+@app.route("/api/jobs/<job_id>/events")
+def api_job_events(job_id):
+    """Server-Sent Events: a "progress" event per change, "end" when finished."""
+    if JOBS.get(job_id) is None:
+        return jsonify({"ok": False, "error": "משימה לא נמצאה"}), 404
+
+    def stream():
+        yield "retry: 2000\n\n"
+        version = None
+        deadline = time.monotonic() + JOB_EVENTS_MAX_SECONDS
+        while time.monotonic() < deadline:
+            job = JOBS.wait(job_id, version, timeout=15)
+            if job is None:
+                return
+            if job["version"] == version and job["state"] not in TERMINAL:
+                yield ": keepalive\n\n"
+                continue
+            version = job["version"]
+            event = "end" if job["state"] in TERMINAL else "progress"
+            yield f"event: {event}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if event == "end":
+                return
+
+    return app.response_class(stream(), mimetype="text/event-stream",
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/api/stats")
+def api_stats():
+    """Return internal cache statistics for monitoring."""
+    return jsonify({
+        "workbook_cache": WORKBOOK_CACHE.stats(),
+        "snapshots": SNAPSHOTS.stats(),
+        "template_options": TEMPLATE_OPTIONS.stats(),
+        "admission": ADMISSION.stats(),
+        "save_journal": SAVE_JOURNAL.stats(),
+        "saves": dict(SAVE_STATS),
+        "workbook_locks": WORKBOOK_LOCKS.stats(),
+        "render_pool": RENDER_POOL.stats(),
+        "image_pool": IMAGE_POOL.stats(),
+        "thumbnails": THUMBNAILS.stats(),
+        "photo_ingest": PHOTO_INGEST.stats(),
+        "artifact_cache": ARTIFACT_CACHE.stats(),
+        "jobs": JOBS.stats(),
+        "fonts": FONTS.stats(),
+        "tree_index": TREE_INDEX.stats(),
+        "search_index": SEARCH_INDEX.stats(),
+        "photo_manifests": PHOTO_MANIFESTS.stats(),
+    })
 
 
 if __name__ == "__main__":
+    # With debug=True the reloader parent only watches files; the child
+    # (WERKZEUG_RUN_MAIN=true) is the process that serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services()
     app.run(host="0.0.0.0", port=5555, debug=True)
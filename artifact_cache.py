@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed cache for rendered deficiency artifacts (PDF / PNG).
+
+Callers hash everything an artifact shows (see deficiency_fingerprint in
+app.py) and ask for ``get(path, digest, render)``:
+
+1. the bytes are in memory under (path, digest)       -> returned as is;
+2. ``path`` on disk was written for the same digest   -> read back;
+3. otherwise ``render()`` runs and the result is written to ``path``.
+
+Which digest produced each file is kept in a sidecar ``.artifacts.json``
+in the same folder, together with the file's size and mtime, so a file
+replaced or edited by someone else is never mistaken for a cached one.
+An unchanged deficiency list therefore never re-renders or rewrites the
+file, and the folder is not littered with timestamped copies.
+
+The sidecar is read, updated and rewritten under the WorkbookLocks lock of
+the index file (a thread lock plus a file lock), so the PDF and the PNG of
+one vehicle, rendered in parallel or by different processes, never drop
+each other's entry.
+"""
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from workbook_locks import atomic_write_bytes
+
+INDEX_NAME = ".artifacts.json"
+
+
+class ArtifactCache:
+    """In-memory LRU (bounded by bytes) in front of on-disk artifacts."""
+
+    def __init__(self, locks, max_bytes=64 * 1024 * 1024):
+        self.locks = locks  # WorkbookLocks guarding the sidecar indexes
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._mem = OrderedDict()  # (path str, digest) -> bytes
+        self._mem_bytes = 0
+        self._path_locks = {}  # path str -> [threading.Lock, users], dropped when unused
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.renders = 0
+        self.not_modified = 0
+        self.write_errors = 0
+
+    # -- memory ------------------------------------------------------------
+
+    def _mem_get(self, key):
+        with self._lock:
+            data = self._mem.get(key)
+            if data is not None:
+                self._mem.move_to_end(key)
+            return data
+
+    def _mem_put(self, key, data):
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= len(old)
+            # Drop other versions of the same file first
+            for k in [k for k in self._mem if k[0] == key[0]]:
+                self._mem_bytes -= len(self._mem.pop(k))
+            self._mem[key] = data
+            self._mem_bytes += len(data)
+            while self._mem_bytes > self.max_bytes and len(self._mem) > 1:
+                _, evicted = self._mem.popitem(last=False)
+                self._mem_bytes -= len(evicted)
+
+    # -- disk index --------------------------------------------------------
+
+    @staticmethod
+    def _read_index(folder) -> dict:
+        try:
+            return json.loads((Path(folder) / INDEX_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_index(folder, index):
+        atomic_write_bytes(Path(folder) / INDEX_NAME,
+                           json.dumps(index, ensure_ascii=False).encode("utf-8"))
+
+    def _disk_get(self, path, digest):
+        if not self.is_current(path, digest):
+            return None
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    def _disk_put(self, path, digest, data):
+        try:
+            atomic_write_bytes(path, data)
+        except PermissionError:
+            # The file is open elsewhere (e.g. a PDF viewer on Windows); keep
+            # a timestamped copy only because the content really changed
+            with self._lock:
+                self.write_errors += 1
+            ts = datetime.now().strftime("%H%M%S")
+            atomic_write_bytes(path.with_name(f"{path.stem}_{ts}{path.suffix}"), data)
+            return
+        st = path.stat()
+        with self.locks.lock(path.parent / INDEX_NAME):
+            index = self._read_index(path.parent)
+            index[path.name] = {"digest": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            self._write_index(path.parent, index)
+
+    @contextmanager
+    def _render_lock(self, path):
+        """One render per file at a time; the lock is dropped once unused."""
+        key = str(path)
+        with self._lock:
+            entry = self._path_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._path_locks[key]
+
+    # -- public ------------------------------------------------------------
+
+    def is_current(self, path, digest) -> bool:
+        """True if the file at path was written for digest and is unchanged."""
+        path = Path(path)
+        entry = self._read_index(path.parent).get(path.name)
+        if not entry or entry.get("digest") != digest:
+            return False
+        try:
+            st = path.stat()
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime_ns) == (entry["size"], entry["mtime_ns"])
+
+    def get(self, path, digest, render, remember=True, force=False) -> bytes:
+        """Bytes of the artifact at path for digest, rendering on a miss.
+
+        remember=False skips the memory cache (batch runs over many files);
+        force=True re-renders even if a cached copy exists.
+        """
+        path = Path(path)
+        key = (str(path), digest)
+        data = None if force else self._mem_get(key)
+        if data is not None:
+            with self._lock:
+                self.memory_hits += 1
+            return data
+
+        with self._render_lock(path):
+            data = None if force else self._mem_get(key)
+            if data is None and not force:
+                data = self._disk_get(path, digest)
+                if data is not None:
+                    with self._lock:
+                        self.disk_hits += 1
+            if data is None:
+                data = render()
+                with self._lock:
+                    self.renders += 1
+                self._disk_put(path, digest, data)
+            if remember:
+                self._mem_put(key, data)
+        return data
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._mem),
+                "bytes": self._mem_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "renders": self.renders,
+                "not_modified": self.not_modified,
+                "write_errors": self.write_errors,
+            }
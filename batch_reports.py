@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Batch generation of deficiency reports for a date folder or manufacturer.
+
+A batch walks the vehicles in scope and calls ``process_vehicle`` for each
+one from a small thread pool. The callable renders the PDF/PNG through the
+worker-process pool, skipping vehicles whose files are already up to date.
+Only a small per-vehicle summary is kept (no workbooks and no rendered
+bytes), so hundreds of vehicles run in constant memory. With ``merged``,
+the summaries are handed to ``merge`` at the end to build one PDF with a
+cover page.
+
+From the web app a batch runs as a background job (job_queue.py) that
+reports progress per vehicle; the CLI runs one batch in the foreground:
+
+    python batch_reports.py <manufacturer> [<date>] [--png] [--merged] [--force]
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from render_pool import PoolSaturated
+
+# Per-vehicle outcomes reported by process_vehicle
+RENDERED, SKIPPED, MISSING, FAILED = "rendered", "skipped", "missing", "failed"
+
+
+class BatchReports:
+    """Runs one batch at a time per call.
+
+    process_vehicle(manufacturer, date, vehicle, options) -> summary dict
+    with at least {"status": RENDERED|SKIPPED|MISSING|FAILED}.
+    merge(scope, summaries, options) -> path of the merged PDF.
+    """
+
+    def __init__(self, process_vehicle, merge=None, workers=2, retry_seconds=1.0):
+        self.process_vehicle = process_vehicle
+        self.merge = merge
+        self.workers = workers
+        self.retry_seconds = retry_seconds
+
+    def _process(self, item, options):
+        manufacturer, date, vehicle = item
+        # Interactive renders share the pool: back off instead of failing
+        for _ in range(60):
+            try:
+                return self.process_vehicle(manufacturer, date, vehicle, options)
+            except PoolSaturated:
+                time.sleep(self.retry_seconds)
+            except Exception as e:
+                return {"status": FAILED, "error": f"{type(e).__name__}: {e}"}
+        return {"status": FAILED, "error": "render pool stayed saturated"}
+
+    def run(self, scope, vehicles, options, progress=None, cancelled=None) -> dict:
+        """Process vehicles [(manufacturer, date, vehicle)] and return a summary.
+
+        progress(done, total, message) is called after every vehicle; once
+        cancelled() is true no further vehicles are started.
+        """
+        start = time.monotonic()
+        result = {"scope": scope, "total": len(vehicles), "done": 0,
+                  RENDERED: 0, SKIPPED: 0, MISSING: 0, FAILED: 0,
+                  "errors": [], "merged_file": None, "cancelled": False}
+        summaries = [None] * len(vehicles)
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix="batch-reports") as pool:
+            results = pool.map(lambda item: self._process(item, options), vehicles)
+            for i, (item, summary) in enumerate(zip(vehicles, results)):
+                result["done"] += 1
+                result[summary["status"]] += 1
+                if summary["status"] == FAILED and len(result["errors"]) < 20:
+                    result["errors"].append({"vehicle": "/".join(item), "error": summary["error"]})
+                summaries[i] = summary if options.get("merged") else None
+                if progress is not None:
+                    progress(result["done"], len(vehicles), item[2])
+                if cancelled is not None and cancelled():
+                    result["cancelled"] = True
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    break
+
+        if options.get("merged") and self.merge is not None and not result["cancelled"]:
+            try:
+                entries = [dict(s, manufacturer=m, date=d, vehicle=v)
+                           for (m, d, v), s in zip(vehicles, summaries)
+                           if s is not None and s["status"] in (RENDERED, SKIPPED)]
+                result["merged_file"] = str(self.merge(scope, entries, options))
+            except Exception as e:
+                result["errors"].append({"vehicle": "*", "error": f"merge: {type(e).__name__}: {e}"})
+        result["seconds"] = round(time.monotonic() - start, 2)
+        return result
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    import app
+
+    parser = argparse.ArgumentParser(description="Generate deficiency reports in bulk")
+    parser.add_argument("manufacturer")
+    parser.add_argument("date", nargs="?", help="date folder (default: all dates)")
+    parser.add_argument("--png", action="store_true", help="also render the PNG image")
+    parser.add_argument("--merged", action="store_true", help="write one merged PDF with a cover")
+    parser.add_argument("--force", action="store_true", help="re-render up-to-date reports")
+    args = parser.parse_args()
+
+    scope, vehicles = app.batch_scope(args.manufacturer, args.date)
+    options = {"png": args.png, "merged": args.merged, "force": args.force}
+    print(f"{len(vehicles)} vehicles in {scope}")
+    result = app.BATCH_REPORTS.run(
+        scope, vehicles, options,
+        progress=lambda done, total, vehicle: print(f"[{done}/{total}] {vehicle}"))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    app.RENDER_POOL.shutdown()
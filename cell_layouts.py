@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""Declarative cell layouts of the inspection workbooks, compiled once.
+
+Every address the app reads or writes lives in a Layout: the מזכירה
+reference fields, the examiner form on בוחן, the numbered deficiency rows
+of פ. ממצאים מסכם, the examiner notes block and the classification cells.
+A layout covers one or more categories (N2/N3, M1, M2/M3).
+
+Layouts are compiled once into (row, col) tuples grouped by sheet and
+sorted by row, which is what the streaming reader and the surgical writer
+consume, so no "D16" string is parsed per request. Writers get the same
+addresses back as refs.
+
+The registry picks a layout by category and template fingerprint (a hash
+of the עזר option texts, see template_options.py): a layout assigned to a template
+wins, otherwise the category's default; a category no layout covers gets
+the fallback layout (M, as the original mapping did for everything but
+N2/N3). A workbook that names no known category at all (D17 empty or
+unrecognised) is taken as the baseline category N2 by ``category_of``, so
+saves without a category write the N cells as they always did. Additional layouts, e.g. for a
+new template version, can be declared in a JSON file (same field names as
+Layout; list of objects, each with optional "templates") and loaded with
+``load_file``.
+"""
+import hashlib
+import json
+from dataclasses import dataclass, field, asdict
+
+from openpyxl.utils.cell import (
+    column_index_from_string, coordinate_from_string, get_column_letter,
+)
+
+# Sheet-name tokens (matched as a substring of the stripped sheet name)
+SECRETARY, EXAMINER, FINDINGS, HELPER = "מזכיר", "בוחן", "ממצאים", "עזר"
+
+
+def parse_ref(ref) -> tuple:
+    """'D16' -> (16, 4)."""
+    col, row = coordinate_from_string(ref)
+    return row, column_index_from_string(col)
+
+
+def make_ref(row, col) -> str:
+    return f"{get_column_letter(col)}{row}"
+
+
+@dataclass(frozen=True)
+class RowBlock:
+    """A numbered table: rows first_row..last_row, one field per column."""
+    first_row: int
+    last_row: int
+    columns: dict                 # field -> column letter
+    number_format: str = ""       # e.g. "10.{n}"; "" numbers rows 1, 2, ...
+    first_number: int = 1
+
+
+@dataclass(frozen=True)
+class Layout:
+    name: str
+    categories: tuple
+    secretary: dict = field(default_factory=dict)       # field -> ref on מזכירה
+    examiner: dict = field(default_factory=dict)        # field -> ref on בוחן
+    findings_meta: dict = field(default_factory=dict)   # field -> ref on פ. ממצאים מסכם
+    findings: dict = field(default_factory=dict)        # "pre"/"post" -> RowBlock
+    notes: RowBlock = None                              # on בוחן
+    classification: tuple = ()                          # refs on בוחן; the first is read
+
+    @classmethod
+    def from_dict(cls, data) -> "Layout":
+        data = dict(data)
+        data.pop("templates", None)
+        data["categories"] = tuple(data["categories"])
+        data["classification"] = tuple(data.get("classification", ()))
+        data["findings"] = {k: RowBlock(**v) for k, v in data.get("findings", {}).items()}
+        if data.get("notes"):
+            data["notes"] = RowBlock(**data["notes"])
+        return cls(**data)
+
+
+def _block_rows(block):
+    for i, row in enumerate(range(block.first_row, block.last_row + 1)):
+        n = block.first_number + i
+        yield row, block.number_format.format(n=n) if block.number_format else n
+
+
+class CompiledLayout:
+    """A Layout resolved to (row, col) cells, grouped by sheet token."""
+
+    def __init__(self, layout: Layout):
+        self.layout = layout
+        self.name = layout.name
+        self.secretary = {f: parse_ref(r) for f, r in layout.secretary.items()}
+        self.secretary_refs = {f: make_ref(*rc) for f, rc in self.secretary.items()}
+        self.examiner = {f: parse_ref(r) for f, r in layout.examiner.items()}
+        self.findings_meta = {f: parse_ref(r) for f, r in layout.findings_meta.items()}
+        # section -> [(display number, {field: (row, col)})]
+        self.findings = {
+            section: [(num, {f: (row, column_index_from_string(c))
+                             for f, c in block.columns.items()})
+                      for row, num in _block_rows(block)]
+            for section, block in layout.findings.items()
+        }
+        self.notes = [] if layout.notes is None else [
+            (num, {f: (row, column_index_from_string(c)) for f, c in layout.notes.columns.items()})
+            for row, num in _block_rows(layout.notes)
+        ]
+        self.classification = [parse_ref(r) for r in layout.classification]
+
+        cells = {SECRETARY: set(self.secretary.values()),
+                 EXAMINER: set(self.examiner.values()) | set(self.classification),
+                 FINDINGS: set(self.findings_meta.values())}
+        for rows in self.findings.values():
+            for _, fields in rows:
+                cells[FINDINGS].update(fields.values())
+        for _, fields in self.notes:
+            cells[EXAMINER].update(fields.values())
+        # sheet token -> [(row, col)] sorted by row: the reader's plan
+        self.plan = {token: sorted(c) for token, c in cells.items() if c}
+
+    # -- reading (ws: anything with .cell(row=, column=).value) -----------
+
+    def secretary_values(self, cells: dict) -> dict:
+        """Secretary fields from {ref: value} of the מזכירה sheet."""
+        return {f: cells.get(ref, "") for f, ref in self.secretary_refs.items()}
+
+    def examiner_values(self, ws) -> dict:
+        return {f: cell_text(ws, rc) for f, rc in self.examiner.items()}
+
+    def findings_values(self, ws) -> dict:
+        result = {section: [dict({"num": num}, **{f: cell_text(ws, rc) for f, rc in fields.items()})
+                            for num, fields in rows]
+                  for section, rows in self.findings.items()}
+        result["meta"] = {f: cell_text(ws, rc) for f, rc in self.findings_meta.items()}
+        return result
+
+    def note_values(self, ws) -> list:
+        return [dict({"num": num}, **{f: cell_text(ws, rc) for f, rc in fields.items()})
+                for num, fields in self.notes]
+
+    def classification_value(self, ws) -> str:
+        return cell_text(ws, self.classification[0]) if self.classification else ""
+
+    # -- writing: {ref: value} for the בוחן sheet ---------------------------
+    # Full saves skip empty values (never clear a cell); patches (clear=True)
+    # write every field they carry, "" clearing the cell.
+
+    def examiner_updates(self, data: dict, clear=False) -> dict:
+        return {make_ref(*rc): data[f] for f, rc in self.examiner.items()
+                if f in data and (clear or data[f])}
+
+    def note_updates(self, notes, clear=False) -> dict:
+        """notes: a list in row order, or {index: note} for a patch."""
+        items = notes.items() if isinstance(notes, dict) else enumerate(notes)
+        updates = {}
+        for i, note in items:
+            i = int(i)
+            if not 0 <= i < len(self.notes):
+                continue
+            for f, rc in self.notes[i][1].items():
+                if f in note and (clear or note[f]):
+                    updates[make_ref(*rc)] = note[f]
+        return updates
+
+    def classification_updates(self, value) -> dict:
+        return {make_ref(*rc): value for rc in self.classification}
+
+    def refs(self, section) -> list:
+        """Refs a save section ("examiner", "notes", "classification") writes."""
+        if section == "examiner":
+            cells = self.examiner.values()
+        elif section == "notes":
+            cells = [rc for _, fields in self.notes for rc in fields.values()]
+        else:
+            cells = self.classification
+        return sorted(make_ref(*rc) for rc in cells)
+
+
+def cell_text(ws, rc) -> str:
+    """Stripped string value of the cell at (row, col), "" when empty."""
+    val = ws.cell(row=rc[0], column=rc[1]).value
+    return "" if val is None else str(val).strip()
+
+
+class LayoutRegistry:
+    """Layouts by name, category defaults and per-template assignments."""
+
+    def __init__(self, fallback="M", baseline="N2"):
+        self.fallback = fallback  # layout name for categories nothing covers
+        self.baseline = baseline  # category of workbooks that name none
+        self._layouts = {}     # name -> CompiledLayout
+        self._defaults = {}    # category -> name
+        self._templates = {}   # (template fingerprint, category) -> name
+        self._plans = {}       # template fingerprint -> merged plan
+
+    def register(self, layout: Layout, default=False, templates=()):
+        self._layouts[layout.name] = CompiledLayout(layout)
+        for category in layout.categories:
+            if default or category not in self._defaults:
+                self._defaults[category] = layout.name
+            for template in templates:
+                self._templates[(template, category)] = layout.name
+        self._plans.clear()
+
+    def load_file(self, path):
+        """Register the layouts declared in a JSON file."""
+        with open(path, encoding="utf-8") as f:
+            for data in json.load(f):
+                self.register(Layout.from_dict(data), templates=data.get("templates", ()))
+
+    def select(self, category, template=None) -> CompiledLayout:
+        """Layout for category in the given template; the fallback if unknown."""
+        name = (self._templates.get((template, category))
+                or self._defaults.get(category) or self.fallback)
+        return self._layouts[name]
+
+    def category_of(self, value, template=None) -> str:
+        """value if a layout covers that category, else the baseline category."""
+        known = value in self._defaults or (template, value) in self._templates
+        return value if value and known else self.baseline
+
+    def layouts(self, template=None) -> list:
+        """Every layout that may apply to a workbook of template."""
+        categories = sorted(set(self._defaults) | {c for _, c in self._templates})
+        found = {}
+        for category in categories:
+            layout = self.select(category, template)
+            found.setdefault(layout.name, layout)
+        return list(found.values())
+
+    def plan(self, template=None) -> dict:
+        """Union of the cells of every layout that may apply to template."""
+        plan = self._plans.get(template)
+        if plan is None:
+            merged = {}
+            for layout in self.layouts(template):
+                for token, cells in layout.plan.items():
+                    merged.setdefault(token, set()).update(cells)
+            plan = self._plans[template] = {t: sorted(c) for t, c in merged.items()}
+        return plan
+
+    def signature(self) -> str:
+        """Hash of every layout and assignment (changes invalidate caches)."""
+        raw = json.dumps([[asdict(c.layout) for c in self._layouts.values()],
+                          sorted(self._defaults.items()),
+                          sorted([t, c, n] for (t, c), n in self._templates.items())],
+                         ensure_ascii=False, sort_keys=True, default=list)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+# ---------------------------------------------------------------------------
+# Current template
+# ---------------------------------------------------------------------------
+
+# מזכירה reference data (source of truth), N2/N3 form
+SECRETARY_N = {
+    "license":       "D16",
+    "category":      "D17",
+    "tire_front":    "D22",
+    "tire_rear":     "D23",
+    "total_weight":  "D24",
+    "vin":           "D25",
+    "num_wheels":    "D29",
+    "color":         "D30",
+    "axle_distance": "D32",
+    "manufacturer":  "D33",
+    "num_axles":     "D42",
+    "tire_front_hr": "D44",
+    "tire_rear_hr":  "D47",
+    "wvta":          "D50",
+    "weight_total":  "D51",
+    "weight_front":  "D52",
+    "weight_rear":   "D53",
+    "axle_dist_hr":  "D55",
+    # Device 1 secretary reference
+    "sec_dev1_name":         "D102",
+    "sec_dev1_installer":    "D100",
+    "sec_dev1_manufacturer": "D108",
+    "sec_dev1_model":        "D109",
+    "sec_dev1_serial":       "D110",
+    # Device 2 secretary reference
+    "sec_dev2_name":         "D128",
+    "sec_dev2_installer":    "D126",
+    "sec_dev2_manufacturer": "D141",
+    "sec_dev2_model":        "D142",
+    "sec_dev2_serial":       "D143",
+    # Device 3 secretary reference
+    "sec_dev3_name":         "D154",
+    "sec_dev3_installer":    "D152",
+    "sec_dev3_manufacturer": "D167",
+    "sec_dev3_model":        "D168",
+    "sec_dev3_serial":       "D169",
+}
+
+# מזכירה, M1/M2/M3
+SECRETARY_M = {
+    "license":       "D16",
+    "category":      "D17",
+    "tire_front":    "D22",
+    "tire_rear":     "D23",
+    "total_weight":  "D24",
+    "vin":           "D25",
+    "color":         "D30",
+    "axle_distance": "D32",
+    "manufacturer":  "D33",
+}
+
+# בוחן sheet (where the examiner writes), N2/N3 form
+EXAMINER_N = {
+    "license":        "E42",
+    "color":          "E43",
+    "seats_beside":   "E44",
+    "seats_behind":   "E45",
+    "sleeping":       "E46",
+    "num_axles":      "E48",
+    "num_wheels":     "E49",
+    "tire1":          "E50",
+    "tire2":          "E51",
+    "tire3":          "E52",
+    "tire4":          "E53",
+    "vin":            "E63",
+    "category":       "E65",
+    "manufacturer":   "E69",
+    "wvta":           "E70",
+    "weight_total":   "E72",
+    "weight_coupled": "E73",
+    "weight_axle1":   "E74",
+    "weight_axle2":   "E75",
+    "weight_axle3":   "E76",
+    "weight_axle4":   "E77",
+    "weight_front":   "E80",
+    "weight_rear":    "E81",
+    "axle_distance":  "E135",
+    "total_length":   "E134",
+    "body_length":    "E138",
+    "front_axle_to_edge": "E139",
+    "rear_axle_to_edge":  "E141",
+    "rear_overhang":  "E145",
+    # Weighing - bridge
+    "bridge_front_axles": "E163",
+    "bridge_rear_axles":  "E164",
+    "bridge_total":       "E165",
+    # Weighing - examiner
+    "exam_axle1_right":   "E158",
+    "exam_axle1_left":    "E159",
+    "exam_axle2_right":   "E161",
+    "exam_axle2_left":    "E162",
+    # Device 1
+    "dev1_name":         "E105",
+    "dev1_installer":    "E107",
+    "dev1_manufacturer": "E108",
+    "dev1_model":        "E109",
+    "dev1_serial":       "E110",
+    # Device 2
+    "dev2_name":         "E112",
+    "dev2_installer":    "E114",
+    "dev2_manufacturer": "E115",
+    "dev2_model":        "E116",
+    "dev2_serial":       "E117",
+    # Device 3
+    "dev3_name":         "E119",
+    "dev3_installer":    "E121",
+    "dev3_manufacturer": "E122",
+    "dev3_model":        "E123",
+    "dev3_serial":       "E124",
+}
+
+# פ. ממצאים מסכם: report header and the two deficiency tables (items 1-6
+# before the inspection, 7-12 after it)
+_FINDING_COLUMNS = {"finding": "B", "doc_required": "H", "photo_required": "I", "reinspect": "J"}
+_FINDINGS_META = {"report_num": "A13", "manufacturer": "E13", "license": "H13", "vin": "J13"}
+_FINDINGS = {
+    "pre": RowBlock(22, 27, _FINDING_COLUMNS, first_number=1),
+    "post": RowBlock(29, 34, _FINDING_COLUMNS, first_number=7),
+}
+# בוחן section 10: examiner notes 10.1-10.8
+_NOTES = RowBlock(312, 319, {"finding": "D", "doc_required": "G", "photo_required": "H"},
+                  number_format="10.{n}")
+_CLASSIFICATION = ("E87", "E88")
+
+LAYOUT_N = Layout("N", ("N2", "N3"), SECRETARY_N, EXAMINER_N, _FINDINGS_META, _FINDINGS,
+                  _NOTES, _CLASSIFICATION)
+# No M examiner form yet: the report sheets are shared with N
+LAYOUT_M = Layout("M", ("M1", "M2", "M3"), SECRETARY_M, {}, _FINDINGS_META, _FINDINGS,
+                  _NOTES, _CLASSIFICATION)
+
+
+def default_registry() -> LayoutRegistry:
+    registry = LayoutRegistry()
+    registry.register(LAYOUT_N, default=True)
+    registry.register(LAYOUT_M, default=True)
+    return registry
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""In-memory index of the manufacturer / date / vehicle folder tree.
+
+BASE_DIR lives on a synced network drive with thousands of vehicle folders,
+so walking it with iterdir + is_file on every page view is slow. The index
+lists directories with os.scandir (using the dirent type, no per-entry stat)
+and remembers each directory's mtime. A lookup re-stats only the directory
+it reads, and only when the cached listing is older than ``ttl`` seconds;
+the listing is rescanned only when that mtime changed.
+
+Whether a vehicle folder contains its ``<vehicle>.xlsx`` is cached per
+vehicle folder mtime. A background refresher thread re-validates every
+known directory every ``refresh_interval`` seconds so changes made by the
+sync client show up without a page view paying for them; it is started by
+the first lookup (or ``start``).
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class _Node:
+    __slots__ = ("mtime_ns", "dirs", "checked")
+
+    def __init__(self, mtime_ns, dirs, checked):
+        self.mtime_ns = mtime_ns
+        self.dirs = dirs  # sorted subdirectory names
+        self.checked = checked
+
+
+class TreeIndex:
+    """Cached listings of BASE_DIR / manufacturer / date / vehicle."""
+
+    def __init__(self, base_dir, ttl=2.0, refresh_interval=30.0):
+        self.base_dir = Path(base_dir)
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._nodes = {}  # dir path str -> _Node
+        self._excel = {}  # vehicle dir str -> (mtime_ns, has_excel)
+        self._thread = None
+        self._stop = threading.Event()
+        self.hits = 0
+        self.rescans = 0
+
+    # -- scanning ----------------------------------------------------------
+
+    @staticmethod
+    def _scan(path):
+        """Return a fresh _Node for path, or None if it is not a directory."""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            with os.scandir(path) as it:
+                dirs = sorted(e.name for e in it if e.is_dir())
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return None
+        return _Node(mtime_ns, dirs, time.monotonic())
+
+    def _get(self, path, force=False):
+        if self._thread is None and not self._stop.is_set():
+            self.start()
+        key = str(path)
+        now = time.monotonic()
+        with self._lock:
+            node = self._nodes.get(key)
+        if node is not None and not force and now - node.checked < self.ttl:
+            with self._lock:
+                self.hits += 1
+            return node
+        if node is not None:
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            if mtime_ns == node.mtime_ns:
+                node.checked = now
+                with self._lock:
+                    self.hits += 1
+                return node
+        fresh = self._scan(path)
+        with self._lock:
+            self.rescans += 1
+            if fresh is None:
+                self._nodes.pop(key, None)
+            else:
+                self._nodes[key] = fresh
+        return fresh
+
+    def _has_excel(self, vehicle_dir, force=False):
+        key = str(vehicle_dir)
+        with self._lock:
+            cached = self._excel.get(key)
+        if cached is not None and not force:
+            return cached[1]
+        try:
+            mtime_ns = os.stat(vehicle_dir).st_mtime_ns
+        except OSError:
+            return False
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        has = (vehicle_dir / f"{vehicle_dir.name}.xlsx").is_file()
+        with self._lock:
+            self._excel[key] = (mtime_ns, has)
+        return has
+
+    # -- lookups -----------------------------------------------------------
+
+    def exists(self, *parts) -> bool:
+        """True if BASE_DIR/parts... is a directory."""
+        return self._get(self.base_dir.joinpath(*parts)) is not None
+
+    def list_manufacturers(self) -> list:
+        node = self._get(self.base_dir)
+        return list(node.dirs) if node else []
+
+    def list_dates(self, manufacturer) -> list:
+        node = self._get(self.base_dir / manufacturer)
+        return sorted(node.dirs, reverse=True) if node else []
+
+    def list_vehicles(self, manufacturer, date_folder) -> list:
+        date_dir = self.base_dir / manufacturer / date_folder
+        node = self._get(date_dir)
+        if node is None:
+            return []
+        return [{"name": name, "has_excel": self._has_excel(date_dir / name)}
+                for name in node.dirs]
+
+    def invalidate(self, path=None):
+        """Forget cached listings under path (everything when None)."""
+        with self._lock:
+            if path is None:
+                self._nodes.clear()
+                self._excel.clear()
+                return
+            prefix = str(path)
+            for d in (self._nodes, self._excel):
+                for key in [k for k in d if k == prefix or k.startswith(prefix + os.sep)]:
+                    del d[key]
+
+    # -- background refresh ------------------------------------------------
+
+    def refresh(self):
+        """Re-validate every known directory (called by the refresher)."""
+        with self._lock:
+            nodes = list(self._nodes)
+            vehicles = list(self._excel)
+        for key in nodes:
+            self._get(Path(key), force=True)
+        for key in vehicles:
+            self._has_excel(Path(key), force=True)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="tree-index",
+                                            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def _run(self):
+        # Warm the top two levels, then keep everything known fresh
+        for mfr in self.list_manufacturers():
+            self.list_dates(mfr)
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "directories": len(self._nodes),
+                "vehicles": len(self._excel),
+                "hits": self.hits,
+                "rescans": self.rescans,
+            }
@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+"""In-process background jobs with a persistent job table.
+
+Handlers are registered per kind; ``submit(kind, params, priority)`` records
+the job in SQLite and queues it. A fixed set of worker threads always takes
+the most urgent job first (lower priority number = more urgent). Batch
+priority jobs may occupy at most ``workers - 1`` threads, so an interactive
+job never waits behind a long batch.
+
+A handler is called as ``fn(ctx, **params)`` and returns a JSON-serialisable
+result. Through the JobContext it reports progress (``ctx.progress(done,
+total, message)``) and notices cancellation (``ctx.cancelled`` /
+``ctx.check()``, which raises JobCancelled). Exceptions listed in the
+kind's ``retry_on`` re-queue the job with exponential backoff, up to
+``retries`` extra attempts.
+
+Every change bumps the job's ``version`` and wakes waiters; ``wait(job_id,
+version, timeout)`` is what the Server-Sent Events endpoint blocks on. For a
+job another process owns, ``wait`` polls the table every ``poll_seconds``
+(the stored version advances with every write of the job).
+Progress is written to the table at most every ``progress_interval``
+seconds, state changes immediately. Finished jobs older than
+``keep_seconds`` are deleted.
+
+Every unfinished job records the pid of the process that owns it, and that
+process refreshes the job's heartbeat every ``heartbeat_seconds``. Several
+server processes can share the table: a process adopts (queues again) only
+unfinished jobs whose owner is gone or whose heartbeat is older than
+``stale_seconds``, on start and then on every heartbeat, so a job is
+re-run only after its worker died (handlers must be idempotent).
+``cancel`` of a job another process owns is written to the table (a
+queued job is cancelled there, a running one gets ``cancel_requested``);
+the owner picks it up with its next heartbeat.
+"""
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BATCH = 0, 5, 10
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+TERMINAL = (DONE, FAILED, CANCELLED)
+
+_COLUMNS = ("id", "kind", "priority", "params", "state", "attempts", "done", "total",
+            "message", "result", "error", "created_at", "started_at", "finished_at",
+            "owner_pid", "heartbeat", "version")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    priority    INTEGER NOT NULL,
+    params      TEXT NOT NULL,
+    state       TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    done        INTEGER NOT NULL DEFAULT 0,
+    total       INTEGER,
+    message     TEXT,
+    result      TEXT,
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL,
+    owner_pid   INTEGER,
+    heartbeat   REAL,
+    version     INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+# Columns added after the first release: (name, declaration)
+_ADDED_COLUMNS = (("owner_pid", "INTEGER"), ("heartbeat", "REAL"),
+                  ("version", "INTEGER NOT NULL DEFAULT 0"),
+                  ("cancel_requested", "INTEGER NOT NULL DEFAULT 0"))
+
+
+def _pid_alive(pid) -> bool:
+    """Whether a process with pid exists on this host."""
+    if not pid:
+        return False
+    if os.name == "nt":
+        return True  # os.kill would terminate it; the heartbeat decides
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobCancelled(Exception):
+    """Raised by JobContext.check() once the job was cancelled."""
+
+
+class JobContext:
+    """Handle passed to a running handler."""
+
+    def __init__(self, queue, job_id):
+        self._queue = queue
+        self.job_id = job_id
+
+    @property
+    def cancelled(self) -> bool:
+        return self._queue._is_cancelled(self.job_id)
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled(self.job_id)
+
+    def progress(self, done=None, total=None, message=None):
+        fields = {k: v for k, v in (("done", done), ("total", total), ("message", message))
+                  if v is not None}
+        self._queue._update(self.job_id, progress=True, **fields)
+
+
+class JobQueue:
+    """Priority queue of jobs run by a bounded pool of worker threads."""
+
+    def __init__(self, db_path, workers=2, keep_seconds=7 * 86400, keep_in_memory=200,
+                 progress_interval=0.5, heartbeat_seconds=10.0, stale_seconds=60.0,
+                 poll_seconds=0.5):
+        self.db_path = Path(db_path)
+        self.workers = workers
+        self.keep_seconds = keep_seconds
+        self.keep_in_memory = keep_in_memory
+        self.progress_interval = progress_interval
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.poll_seconds = poll_seconds
+        self._cond = threading.Condition()
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._handlers = {}     # kind -> (fn, retries, retry_on, retry_seconds)
+        self._jobs = {}         # job id -> job dict, oldest first
+        self._heap = []         # (priority, seq, job id)
+        self._seq = itertools.count()
+        self._not_before = {}   # job id -> earliest start (retry backoff)
+        self._cancel = set()    # running job ids asked to stop
+        self._saved_at = {}     # job id -> last progress write
+        self._running_batch = 0
+        self._threads = []
+        self._stopping = False
+        self._halt = threading.Event()
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.cancelled = 0
+        self.adopted = 0
+
+    # -- table -------------------------------------------------------------
+
+    def _db(self):
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), timeout=30,
+                                         check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            have = {r["name"] for r in self._conn.execute("PRAGMA table_info(jobs)")}
+            for name, decl in _ADDED_COLUMNS:
+                if name not in have:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+            self._conn.commit()
+        return self._conn
+
+    def _save(self, job):
+        # Writing a job is also a sign of life of its owner
+        row = dict(job, params=json.dumps(job["params"], ensure_ascii=False),
+                   result=json.dumps(job["result"], ensure_ascii=False),
+                   owner_pid=os.getpid(), heartbeat=time.time())
+        with self._db_lock:
+            conn = self._db()
+            # Upsert: cancel_requested, set by other processes, is kept
+            conn.execute(f"INSERT INTO jobs ({', '.join(_COLUMNS)}) "
+                         f"VALUES ({', '.join('?' * len(_COLUMNS))}) ON CONFLICT(id) DO UPDATE SET "
+                         + ", ".join(f"{c} = excluded.{c}" for c in _COLUMNS[1:]),
+                         [row[c] for c in _COLUMNS])
+            conn.commit()
+
+    @staticmethod
+    def _from_row(row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["version"] = job["version"] or 0
+        job.pop("cancel_requested", None)
+        return job
+
+    def _load(self, job_id):
+        with self._db_lock:
+            row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._from_row(row) if row else None
+
+    # -- public ------------------------------------------------------------
+
+    def register(self, kind, fn, retries=0, retry_on=(), retry_seconds=1.0):
+        """Run fn(ctx, **params) for jobs of kind."""
+        self._handlers[kind] = (fn, retries, tuple(retry_on), retry_seconds)
+
+    def submit(self, kind, params=None, priority=PRIORITY_NORMAL) -> str:
+        """Queue a job; returns its id immediately."""
+        if kind not in self._handlers:
+            raise KeyError(f"unknown job kind {kind!r}")
+        if not self._threads and not self._stopping:
+            self.start()  # workers start with the first job
+        job = {c: None for c in _COLUMNS}
+        job.update(id=uuid.uuid4().hex[:16], kind=kind, priority=priority,
+                   params=dict(params or {}), state=QUEUED, attempts=0, done=0,
+                   created_at=time.time(), version=0)
+        self._save(job)
+        with self._cond:
+            self._jobs[job["id"]] = job
+            heapq.heappush(self._heap, (priority, next(self._seq), job["id"]))
+            self._cond.notify_all()
+        return job["id"]
+
+    def get(self, job_id):
+        """Copy of the job (from memory, else from the table) or None."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        return self._load(job_id)
+
+    def list(self, limit=50) -> list:
+        """Most recent jobs, newest first."""
+        with self._db_lock:
+            rows = self._db().execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?",
+                                      (limit,)).fetchall()
+        with self._cond:
+            return [dict(self._jobs[r["id"]]) if r["id"] in self._jobs else self._from_row(r)
+                    for r in rows]
+
+    def cancel(self, job_id) -> bool:
+        """Cancel a queued job now, or ask a running one to stop."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return self._cancel_foreign(job_id)
+            if job["state"] in TERMINAL:
+                return True
+            if job["state"] == RUNNING:
+                self._cancel.add(job_id)
+                return True
+            job["state"] = CANCELLED  # workers skip it from now on
+        self._finish(job_id, CANCELLED)
+        return True
+
+    def _cancel_foreign(self, job_id) -> bool:
+        """Record the cancel in the table for the process that owns the job."""
+        with self._db_lock:
+            conn = self._db()
+            changed = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, version = version + 1, "
+                "finished_at = CASE WHEN state = ? THEN ? ELSE finished_at END, "
+                "state = CASE WHEN state = ? THEN ? ELSE state END "
+                "WHERE id = ? AND state IN (?, ?)",
+                (QUEUED, time.time(), QUEUED, CANCELLED, job_id, QUEUED, RUNNING)).rowcount
+            conn.commit()
+            if changed:
+                return True
+            return conn.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone() is not None
+
+    def wait(self, job_id, version, timeout):
+        """The job once its version differs from version (or after timeout)."""
+        with self._cond:
+            if job_id not in self._jobs:
+                return self._poll(job_id, version, timeout)
+            self._cond.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id]["version"] != version,
+                timeout)
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        return self._load(job_id)
+
+    def _poll(self, job_id, version, timeout):
+        """wait() for a job of another process: re-read its row until it changes."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._load(job_id)
+            left = deadline - time.monotonic()
+            if job is None or job["version"] != version or left <= 0:
+                return job
+            time.sleep(min(self.poll_seconds, left))
+
+    # -- state -------------------------------------------------------------
+
+    def _is_cancelled(self, job_id) -> bool:
+        with self._cond:
+            return job_id in self._cancel
+
+    def _update(self, job_id, progress=False, **fields):
+        now = time.monotonic()
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job["version"] += 1
+            self._cond.notify_all()
+            if progress:
+                finished = job["total"] is not None and job["done"] >= job["total"]
+                if not finished and now - self._saved_at.get(job_id, 0) < self.progress_interval:
+                    return
+                self._saved_at[job_id] = now
+            job = dict(job)
+        self._save(job)
+
+    def _finish(self, job_id, state, **fields):
+        self._update(job_id, state=state, finished_at=time.time(), **fields)
+        with self._cond:
+            self._cancel.discard(job_id)
+            self._saved_at.pop(job_id, None)
+            if state == DONE:
+                self.completed += 1
+            elif state == FAILED:
+                self.failed += 1
+            else:
+                self.cancelled += 1
+            # Keep only the most recent finished jobs in memory
+            finished = [k for k, j in self._jobs.items() if j["state"] in TERMINAL]
+            for k in finished[:max(0, len(finished) - self.keep_in_memory)]:
+                del self._jobs[k]
+
+    # -- workers -----------------------------------------------------------
+
+    def _pick(self):
+        """Pop the most urgent runnable job (called with _cond held)."""
+        now = time.monotonic()
+        wait = None
+        skipped = []
+        picked = None
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            job = self._jobs.get(item[2])
+            if job is None or job["state"] != QUEUED:
+                continue  # cancelled or pruned while queued
+            not_before = self._not_before.get(item[2], 0)
+            if not_before > now:
+                wait = not_before - now if wait is None else min(wait, not_before - now)
+                skipped.append(item)
+                continue
+            if (item[0] >= PRIORITY_BATCH and self.workers > 1
+                    and self._running_batch >= self.workers - 1):
+                skipped.append(item)
+                continue
+            picked = item
+            break
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        return picked, wait
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    item, wait = self._pick()
+                    if item is not None:
+                        break
+                    self._cond.wait(wait)
+                priority, _, job_id = item
+                self._not_before.pop(job_id, None)
+                batch = priority >= PRIORITY_BATCH
+                if batch:
+                    self._running_batch += 1
+                job = self._jobs[job_id]
+                job["state"] = RUNNING  # claimed: cancel() now only flags it
+                attempts = job["attempts"] + 1
+            try:
+                self._run(job_id, attempts)
+            finally:
+                if batch:
+                    with self._cond:
+                        self._running_batch -= 1
+                        self._cond.notify_all()
+
+    def _run(self, job_id, attempts):
+        self._update(job_id, state=RUNNING, attempts=attempts, started_at=time.time(),
+                     error=None)
+        job = self.get(job_id)
+        fn, retries, retry_on, retry_seconds = self._handlers[job["kind"]]
+        try:
+            result = fn(JobContext(self, job_id), **job["params"])
+        except JobCancelled:
+            self._finish(job_id, CANCELLED)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if isinstance(e, retry_on) and attempts <= retries and not self._is_cancelled(job_id):
+                self._update(job_id, state=QUEUED, error=error)
+                with self._cond:
+                    self.retried += 1
+                    self._not_before[job_id] = time.monotonic() + retry_seconds * 2 ** (attempts - 1)
+                    heapq.heappush(self._heap, (job["priority"], next(self._seq), job_id))
+                    self._cond.notify_all()
+            else:
+                self._finish(job_id, FAILED, error=error)
+        else:
+            self._finish(job_id, CANCELLED if self._is_cancelled(job_id) else DONE,
+                         result=result)
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def _recover(self):
+        """Prune old finished jobs, then adopt unfinished ones of dead owners."""
+        with self._db_lock:
+            conn = self._db()
+            conn.execute("DELETE FROM jobs WHERE state IN (?, ?, ?) AND finished_at < ?",
+                         (*TERMINAL, time.time() - self.keep_seconds))
+            conn.commit()
+        self._adopt()
+
+    def _orphaned(self, row, now) -> bool:
+        if row["id"] in self._jobs:
+            return False  # ours
+        if row["owner_pid"] == os.getpid():
+            return True   # an earlier process that had our pid
+        return (not _pid_alive(row["owner_pid"]) or row["heartbeat"] is None
+                or now - row["heartbeat"] > self.stale_seconds)
+
+    def _adopt(self):
+        """Queue again the unfinished jobs whose owner died or went silent."""
+        now = time.time()
+        with self._db_lock:
+            rows = self._db().execute(
+                "SELECT * FROM jobs WHERE state IN (?, ?) ORDER BY created_at",
+                (QUEUED, RUNNING)).fetchall()
+        with self._cond:
+            rows = [r for r in rows if self._orphaned(r, now)]
+        for row in rows:
+            # Claim it only if no other process did since it was read
+            with self._db_lock:
+                conn = self._db()
+                claimed = conn.execute(
+                    "UPDATE jobs SET owner_pid = ?, heartbeat = ? "
+                    "WHERE id = ? AND owner_pid IS ? AND heartbeat IS ?",
+                    (os.getpid(), now, row["id"], row["owner_pid"], row["heartbeat"])).rowcount
+                conn.commit()
+            if not claimed:
+                continue
+            job = self._from_row(row)
+            job["version"] += 1
+            if row["cancel_requested"]:
+                job.update(state=CANCELLED, finished_at=time.time())
+                self._save(job)
+                continue
+            if job["kind"] not in self._handlers:
+                job.update(state=FAILED, error="interrupted", finished_at=time.time())
+                self._save(job)
+                continue
+            job["state"] = QUEUED
+            self._save(job)
+            with self._cond:
+                self.adopted += 1
+                self._jobs[job["id"]] = job
+                heapq.heappush(self._heap, (job["priority"], next(self._seq), job["id"]))
+                self._cond.notify_all()
+
+    def _heartbeat(self):
+        """Refresh the heartbeat of this process's jobs, apply cancels other
+        processes recorded for them; adopt orphans."""
+        while not self._halt.wait(self.heartbeat_seconds):
+            try:
+                with self._db_lock:
+                    conn = self._db()
+                    conn.execute("UPDATE jobs SET heartbeat = ? WHERE owner_pid = ? "
+                                 "AND state IN (?, ?)", (time.time(), os.getpid(), QUEUED, RUNNING))
+                    conn.commit()
+                    asked = [r["id"] for r in conn.execute(
+                        "SELECT id FROM jobs WHERE owner_pid = ? AND cancel_requested = 1 "
+                        "AND state IN (?, ?, ?)", (os.getpid(), QUEUED, RUNNING, CANCELLED))]
+                with self._cond:
+                    asked = [k for k in asked
+                             if k in self._jobs and self._jobs[k]["state"] not in TERMINAL
+                             and k not in self._cancel]
+                for job_id in asked:
+                    self.cancel(job_id)
+                self._adopt()
+            except sqlite3.Error:
+                pass  # busy database: try again on the next beat
+
+    def start(self):
+        """Recover the table and start the workers (idempotent)."""
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            self._halt.clear()
+            self._threads = [threading.Thread(target=self._worker, name=f"jobs-{i}", daemon=True)
+                             for i in range(self.workers)]
+            self._threads.append(threading.Thread(target=self._heartbeat, name="jobs-heartbeat",
+                                                  daemon=True))
+        self._recover()
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._halt.set()
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            states = {}
+            for job in self._jobs.values():
+                states[job["state"]] = states.get(job["state"], 0) + 1
+            return {
+                "workers": self.workers,
+                "kinds": sorted(self._handlers),
+                "queued": states.get(QUEUED, 0),
+                "running": states.get(RUNNING, 0),
+                "running_batch": self._running_batch,
+                "completed": self.completed,
+                "failed": self.failed,
+                "retried": self.retried,
+                "cancelled": self.cancelled,
+                "adopted": self.adopted,
+            }
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""Find where the template's labels live across many workbooks.
+
+Walks a directory tree for vehicle workbooks and, in a process pool, reads
+every text cell of the layout sheets (מזכירה, בוחן, פ. ממצאים מסכם) with
+the streaming reader, giving a label -> coordinates index per sheet.
+
+Workbooks are grouped by template fingerprint (the עזר option texts, see
+template_options.py). A group's layout is its template labels: texts found at
+the same cell in most of its workbooks, so per-vehicle values drop out.
+Groups with identical labels form one layout cluster.
+
+Every cell of the current layouts is anchored to the nearest label on its
+row in the reference cluster (the largest one, or the one holding
+--reference). Each other cluster is checked for the same labels: a field
+whose label moved is reported with its new cell, shifted like its label.
+--emit writes the moved layouts as JSON that the app loads from
+layouts.json, assigned to the cluster's template fingerprints.
+
+    python layout_discovery.py BASE_DIR [--workers 4] [--emit layouts.json]
+    python layout_discovery.py BASE_DIR --find חוסרים --find הערות
+    python layout_discovery.py FILE.xlsx --dump ממצאים --rows 50
+"""
+import json
+import math
+import multiprocessing
+import os
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from openpyxl.utils.cell import get_column_letter
+
+from cell_layouts import (
+    default_registry, make_ref, parse_ref, EXAMINER, FINDINGS, SECRETARY,
+)
+from template_options import read_template
+from xlsx_reader import StreamingWorkbook, find_sheet_name
+
+SHEET_TOKENS = (SECRETARY, EXAMINER, FINDINGS)
+INFER_ROWS = 3
+_LETTER_RE = re.compile("[A-Za-z\u0590-\u05FF]")
+
+
+def _label(value):
+    """Normalised label text, or None for values that are not labels."""
+    if not isinstance(value, str):
+        return None
+    text = " ".join(value.split())
+    return text if _LETTER_RE.search(text) and len(text) <= 200 else None
+
+
+def index_workbook(path, tokens=SHEET_TOKENS, max_row=600, max_col=30) -> dict:
+    """{"path", "template", "labels": {token: {label: [refs]}}, "error"} of one workbook."""
+    result = {"path": str(path), "template": "", "labels": {}, "error": None}
+    try:
+        with StreamingWorkbook(path) as wb:
+            result["template"] = read_template(wb)[0]
+            for token in tokens:
+                name = find_sheet_name(wb.sheetnames, token)
+                if name is None:
+                    continue
+                labels = {}
+                for (row, col), value in sorted(wb.scan_sheet(name, max_row, max_col)
+                                                .values().items()):
+                    text = _label(value)
+                    if text is not None:
+                        labels.setdefault(text, []).append(make_ref(row, col))
+                result["labels"][token] = labels
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def iter_workbook_paths(root):
+    root = Path(root)
+    if root.is_file():
+        yield root
+        return
+    for path in sorted(root.rglob("*.xlsx")):
+        if not path.name.startswith("~$"):  # Excel lock files
+            yield path
+
+
+def index_tree(root, workers=None, progress=None, **kwargs) -> list:
+    """index_workbook over every workbook under root, in a process pool."""
+    paths = list(iter_workbook_paths(root))
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    indexes = []
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(index_workbook, path, **kwargs) for path in paths]
+        for done, future in enumerate(futures, 1):
+            indexes.append(future.result())
+            if progress:
+                progress(done, len(paths))
+    return indexes
+
+
+# ---------------------------------------------------------------------------
+# Clustering
+# ---------------------------------------------------------------------------
+
+def template_labels(indexes, support=0.8) -> dict:
+    """{token: {label: ref}} of unique labels at the same cell in >= support of indexes."""
+    counts = Counter()
+    for idx in indexes:
+        for token, labels in idx["labels"].items():
+            for label, refs in labels.items():
+                if len(refs) == 1:
+                    counts[(token, label, refs[0])] += 1
+    need = max(1, math.ceil(support * len(indexes)))
+    found = {}  # (token, label) -> [refs]
+    for (token, label, ref), n in counts.items():
+        if n >= need:
+            found.setdefault((token, label), []).append(ref)
+    result = {}
+    for (token, label), refs in found.items():
+        if len(refs) == 1:  # a label that settled at two cells is ambiguous
+            result.setdefault(token, {})[label] = refs[0]
+    return result
+
+
+def cluster(indexes, support=0.8) -> list:
+    """Layout clusters, largest first: {"id", "templates", "workbooks", "labels"}."""
+    groups = {}
+    for idx in indexes:
+        if idx["error"] is None:
+            groups.setdefault(idx["template"], []).append(idx)
+    clusters = {}
+    for template, members in groups.items():
+        labels = template_labels(members, support)
+        key = json.dumps(labels, ensure_ascii=False, sort_keys=True)
+        entry = clusters.setdefault(key, {"templates": [], "workbooks": [], "labels": labels})
+        entry["templates"].append(template)
+        entry["workbooks"].extend(idx["path"] for idx in members)
+    result = sorted(clusters.values(), key=lambda c: -len(c["workbooks"]))
+    for i, entry in enumerate(result, 1):
+        entry["id"] = f"L{i}"
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Comparing with the current layouts
+# ---------------------------------------------------------------------------
+
+def layout_cells(layout):
+    """(field key, sheet token, ref) of every cell a Layout reads or writes."""
+    for field, ref in layout.secretary.items():
+        yield f"secretary.{field}", SECRETARY, ref
+    for field, ref in layout.examiner.items():
+        yield f"examiner.{field}", EXAMINER, ref
+    for field, ref in layout.findings_meta.items():
+        yield f"findings_meta.{field}", FINDINGS, ref
+    blocks = [(f"findings.{section}", FINDINGS, block) for section, block in layout.findings.items()]
+    if layout.notes is not None:
+        blocks.append(("notes", EXAMINER, layout.notes))
+    for key, token, block in blocks:
+        for field, column in block.columns.items():
+            yield f"{key}.{field}", token, f"{column}{block.first_row}"
+    for i, ref in enumerate(layout.classification):
+        yield f"classification.{i}", EXAMINER, ref
+
+
+def _anchor(labels, ref, exclude):
+    """(label, label ref) nearest to ref on its row, or None."""
+    row, col = parse_ref(ref)
+    best = None
+    for label, label_ref in labels.items():
+        label_row, label_col = parse_ref(label_ref)
+        if label_row == row and label_ref not in exclude:
+            distance = (abs(label_col - col), label_col > col)  # ties: the lower column
+            if best is None or distance < best[0]:
+                best = (distance, label, label_ref)
+    return None if best is None else best[1:]
+
+
+def _shift(ref, d_row, d_col):
+    row, col = parse_ref(ref)
+    return make_ref(row + d_row, col + d_col)
+
+
+def compare(layouts, reference, other) -> list:
+    """Where each layout cell moved in other, anchored on reference's labels.
+
+    Returns [{"fields", "token", "ref", "label", "status", "new_ref"}] with
+    status "same", "moved", "missing" (label not found), "inferred" (moved
+    like a labelled cell up to INFER_ROWS away) or "unanchored".
+    """
+    cells = {}  # (token, ref) -> [field keys]
+    for layout in layouts:
+        for key, token, ref in layout_cells(layout):
+            cells.setdefault((token, ref), []).append(f"{layout.name}.{key}")
+    exclude = {token: {ref for t, ref in cells if t == token} for token in SHEET_TOKENS}
+    report = []
+    for (token, ref), fields in sorted(cells.items(), key=lambda kv: (kv[0][0], parse_ref(kv[0][1]))):
+        entry = {"fields": fields, "token": token, "ref": ref, "label": None,
+                 "status": "unanchored", "new_ref": None}
+        anchor = _anchor(reference["labels"].get(token, {}), ref, exclude[token])
+        if anchor is not None:
+            label, label_ref = anchor
+            entry["label"] = label
+            moved_ref = other["labels"].get(token, {}).get(label)
+            if moved_ref is None:
+                entry["status"] = "missing"
+            else:
+                (r0, c0), (r1, c1) = parse_ref(label_ref), parse_ref(moved_ref)
+                entry["new_ref"] = _shift(ref, r1 - r0, c1 - c0)
+                entry["status"] = "moved" if entry["new_ref"] != ref else "same"
+        report.append(entry)
+    # Cells without a label of their own (e.g. E88 under E87) follow the
+    # nearest anchored cell a few rows away on the same sheet
+    anchored = [e for e in report if e["new_ref"] is not None]
+    for entry in report:
+        if entry["status"] != "unanchored":
+            continue
+        row, col = parse_ref(entry["ref"])
+        near = [(abs(parse_ref(e["ref"])[0] - row), e) for e in anchored
+                if e["token"] == entry["token"]
+                and abs(parse_ref(e["ref"])[0] - row) <= INFER_ROWS]
+        if near:
+            e = min(near, key=lambda pair: pair[0])[1]
+            (r0, c0), (r1, c1) = parse_ref(e["ref"]), parse_ref(e["new_ref"])
+            entry["status"] = "inferred"
+            entry["label"] = e["label"]
+            entry["new_ref"] = _shift(entry["ref"], r1 - r0, c1 - c0)
+    return report
+
+
+def moved_layout(layout, report, templates) -> dict:
+    """layouts.json entry: layout with the moved cells of report applied."""
+    moves = {(e["token"], e["ref"]): e["new_ref"] for e in report if e["new_ref"]}
+
+    def move(token, ref):
+        return moves.get((token, ref), ref)
+
+    data = asdict(layout)
+    data["name"] = f"{layout.name}-{templates[0] or 'untemplated'}"
+    data["categories"] = list(layout.categories)
+    data["templates"] = list(templates)
+    data["secretary"] = {f: move(SECRETARY, r) for f, r in layout.secretary.items()}
+    data["examiner"] = {f: move(EXAMINER, r) for f, r in layout.examiner.items()}
+    data["findings_meta"] = {f: move(FINDINGS, r) for f, r in layout.findings_meta.items()}
+    data["classification"] = [move(EXAMINER, r) for r in layout.classification]
+    blocks = [(data["findings"][s], FINDINGS, b) for s, b in layout.findings.items()]
+    if layout.notes is not None:
+        blocks.append((data["notes"], EXAMINER, layout.notes))
+    for out, token, block in blocks:
+        d_row = 0
+        for field, column in block.columns.items():
+            row, col = parse_ref(move(token, f"{column}{block.first_row}"))
+            out["columns"][field] = get_column_letter(col)
+            d_row = d_row or row - block.first_row
+        out["first_row"] = block.first_row + d_row
+        out["last_row"] = block.last_row + d_row
+    return data
+
+
+def discover(indexes, layouts, reference=None, support=0.8) -> dict:
+    """Cluster indexes and compare every cluster with the reference one."""
+    clusters = cluster(indexes, support)
+    if not clusters:
+        return {"clusters": [], "reference": None, "emit": [],
+                "errors": [i for i in indexes if i["error"]]}
+    ref_cluster = clusters[0]
+    if reference is not None:
+        ref_cluster = next((c for c in clusters if str(reference) in c["workbooks"]), ref_cluster)
+    emit = []
+    for c in clusters:
+        c["report"] = compare(layouts, ref_cluster, c) if c is not ref_cluster else []
+        for layout in layouts:
+            mine = [e for e in c["report"]
+                    if any(f.startswith(f"{layout.name}.") for f in e["fields"])]
+            if any(e["new_ref"] not in (None, e["ref"]) for e in mine):
+                emit.append(moved_layout(layout, mine, c["templates"]))
+    return {"clusters": clusters, "reference": ref_cluster["id"], "emit": emit,
+            "errors": [{"path": i["path"], "error": i["error"]} for i in indexes if i["error"]]}
+
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+
+def _print_report(result):
+    print(f"{len(result['clusters'])} layout cluster(s); reference {result['reference']}")
+    for c in result["clusters"]:
+        print()
+        print(f"== {c['id']}: {len(c['workbooks'])} workbook(s), "
+              f"template(s) {', '.join(t or '-' for t in c['templates'])}")
+        print(f"   e.g. {c['workbooks'][0]}")
+        if c["id"] == result["reference"]:
+            anchored = sum(len(v) for v in c["labels"].values())
+            print(f"   reference layout ({anchored} template labels)")
+            continue
+        counts = Counter(e["status"] for e in c["report"])
+        print("   " + ", ".join(f"{k}: {v}" for k, v in sorted(counts.items())))
+        for e in c["report"]:
+            if e["status"] == "missing" or e["new_ref"] not in (None, e["ref"]):
+                target = e["new_ref"] or "?"
+                print(f"   {e['status']:8s} {e['token']} {e['ref']:>5s} -> {target:>5s}  "
+                      f"[{e['label']}]  {', '.join(e['fields'])}")
+    for err in result["errors"]:
+        print(f"!! {err['path']}: {err['error']}")
+
+
+def _dump(path, token, rows, cols):
+    with StreamingWorkbook(path) as wb:
+        name = find_sheet_name(wb.sheetnames, token)
+        if name is None:
+            print(f"no sheet matching {token!r} in {path}")
+            return
+        print(f"== {path} :: {name}")
+        for (row, col), value in sorted(wb.scan_sheet(name, rows, cols).values().items()):
+            print(f"  {make_ref(row, col)}: {value}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Index label cells and find layout changes")
+    parser.add_argument("root", help="directory tree of workbooks, or one .xlsx")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rows", type=int, default=600, help="rows scanned per sheet")
+    parser.add_argument("--cols", type=int, default=30, help="columns scanned per sheet")
+    parser.add_argument("--support", type=float, default=0.8,
+                        help="share of a template's workbooks a label must appear in")
+    parser.add_argument("--reference", help="a workbook whose cluster is the reference layout")
+    parser.add_argument("--find", action="append", help="print cells containing this text")
+    parser.add_argument("--dump", metavar="SHEET", help="print every cell of a sheet and exit")
+    parser.add_argument("--emit", metavar="PATH", help="write moved layouts as layouts.json")
+    parser.add_argument("--json", action="store_true", help="print the full result as JSON")
+    args = parser.parse_args()
+
+    if args.dump:
+        for path in iter_workbook_paths(args.root):
+            _dump(path, args.dump, args.rows, args.cols)
+            break
+        sys.exit(0)
+
+    indexes = index_tree(args.root, args.workers, max_row=args.rows, max_col=args.cols,
+                         progress=lambda done, total: print(f"\rindexed {done}/{total}", end="",
+                                                            file=sys.stderr))
+    print(file=sys.stderr)
+
+    if args.find:
+        for idx in indexes:
+            for token, labels in idx["labels"].items():
+                for label, refs in labels.items():
+                    if any(text in label for text in args.find):
+                        print(f"{idx['path']} :: {token} {', '.join(refs)}: {label}")
+        sys.exit(0)
+
+    layouts = [c.layout for c in default_registry().layouts()]
+    result = discover(indexes, layouts, args.reference, args.support)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=1))
+    else:
+        _print_report(result)
+    if args.emit:
+        Path(args.emit).write_text(json.dumps(result["emit"], ensure_ascii=False, indent=1),
+                                   encoding="utf-8")
+        print(f"{len(result['emit'])} layout(s) written to {args.emit}")
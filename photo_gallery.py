@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Photo listing and cached thumbnails for a vehicle's תמונות folder.
+
+Listing uses one os.scandir pass (the stat comes with the dirent on Windows
+and is a single call elsewhere) and sorts by capture time, newest first.
+Capture times (EXIF DateTimeOriginal) are not read here: the caller passes
+the ones the photo manifest recorded at ingest or seeding, and photos
+without one (PNG captures, cameras that set none) sort by their mtime.
+
+Thumbnails are rendered with Pillow's JPEG draft mode, which lets the
+decoder scale down by 1/2../1/8 while decoding, then reduced to the final
+size. They are written to ``תמונות/.thumbs`` under a name built from the
+source's mtime and size, so a replaced photo gets a new thumbnail and the
+same name doubles as a strong ETag. Rendering runs in a worker pool;
+concurrent requests for the same thumbnail wait for a single render.
+"""
+import glob
+import os
+import threading
+import time
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+THUMBS_DIRNAME = ".thumbs"
+PHOTO_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+THUMB_SIZES = (128, 256, 512)
+THUMB_FORMATS = {"jpeg": "jpg", "webp": "webp"}
+
+_EXIF_IFD, _DATETIME_ORIGINAL = 0x8769, 0x9003
+
+
+def capture_time(img):
+    """EXIF DateTimeOriginal of an open image as a local timestamp, or None."""
+    try:
+        raw = img.getexif().get_ifd(_EXIF_IFD).get(_DATETIME_ORIGINAL)
+        if not raw:
+            return None
+        return time.mktime(time.strptime(str(raw).strip("\x00 ")[:19], "%Y:%m:%d %H:%M:%S"))
+    except Exception:
+        return None  # malformed EXIF: fall back to the mtime
+
+
+def list_photos(photos_dir, captured=None) -> list:
+    """[{name, size, mtime, captured}] for the photos in photos_dir, newest first.
+
+    captured maps file name -> capture timestamp (see PhotoManifests.captured).
+    """
+    captured = captured or {}
+    photos = []
+    try:
+        with os.scandir(photos_dir) as it:
+            for e in it:
+                if e.name.startswith(".") or Path(e.name).suffix.lower() not in PHOTO_SUFFIXES:
+                    continue
+                try:
+                    if not e.is_file():
+                        continue
+                    st = e.stat()
+                except OSError:
+                    continue
+                photos.append({"name": e.name, "size": st.st_size,
+                               "mtime": st.st_mtime, "mtime_ns": st.st_mtime_ns,
+                               "captured": captured.get(e.name)})
+    except FileNotFoundError:
+        return []
+    photos.sort(key=lambda p: (p["captured"] or p["mtime"], p["mtime_ns"], p["name"]),
+                reverse=True)
+    return photos
+
+
+def render_thumbnail(src, dst, px, fmt):
+    """Write a px-bounded thumbnail of src to dst (runs in worker processes)."""
+    with Image.open(src) as img:
+        img.draft("RGB", (px, px))  # JPEG only: decode at a reduced scale
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((px, px), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        img.save(tmp, format=fmt.upper(), quality=80)
+    os.replace(tmp, dst)
+
+
+class ThumbnailCache:
+    """On-disk thumbnail cache; run(fn, *args) executes the render."""
+
+    def __init__(self, run):
+        self.run = run
+        self._guard = threading.Lock()
+        self._inflight = {}  # thumb path str -> threading.Event
+        self.hits = 0
+        self.renders = 0
+
+    @staticmethod
+    def etag(st, px, fmt) -> str:
+        return f"{st.st_mtime_ns:x}-{st.st_size:x}-{px}-{fmt}"
+
+    def get(self, photos_dir, name, px=256, fmt="jpeg"):
+        """(thumbnail path, etag) for photo name; renders it on a miss."""
+        src = Path(photos_dir) / name
+        st = src.stat()
+        tag = self.etag(st, px, fmt)
+        thumbs = Path(photos_dir) / THUMBS_DIRNAME
+        dst = thumbs / f"{name}.{tag}.{THUMB_FORMATS[fmt]}"
+        if dst.is_file():
+            with self._guard:
+                self.hits += 1
+            return dst, tag
+
+        with self._guard:
+            event = self._inflight.get(str(dst))
+            owner = event is None
+            if owner:
+                event = self._inflight[str(dst)] = threading.Event()
+        if not owner:
+            event.wait()
+            # The other render may have failed; then try once more ourselves
+            return (dst, tag) if dst.is_file() else self.get(photos_dir, name, px, fmt)
+        try:
+            thumbs.mkdir(exist_ok=True)
+            self.run(render_thumbnail, str(src), str(dst), px, fmt)
+            self._prune(thumbs, name, f"{st.st_mtime_ns:x}-{st.st_size:x}-")
+            with self._guard:
+                self.renders += 1
+        finally:
+            with self._guard:
+                self._inflight.pop(str(dst), None)
+            event.set()
+        return dst, tag
+
+    @staticmethod
+    def _prune(thumbs, name, version):
+        """Drop thumbnails of earlier versions of the same photo."""
+        for p in thumbs.glob(glob.escape(name) + ".*"):
+            rest = p.name[len(name) + 1:]  # "<tag>.<ext>" for this photo's thumbs
+            if rest.count(".") == 1 and not rest.startswith(version):
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._guard:
+            return {"hits": self.hits, "renders": self.renders,
+                    "in_flight": len(self._inflight)}
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Background ingest of uploaded photos: downscale, re-encode, strip.
+
+Photos arrive as full-resolution canvas JPEGs or as PNG captures. After an
+upload is acknowledged it is queued here. A worker process, per the
+IngestPolicy:
+
+* applies the EXIF orientation to the pixels,
+* downsizes so the longer side is at most ``max_dimension``,
+* re-encodes PNG captures (without transparency) as JPEG,
+* drops EXIF/metadata (GPS, device info),
+
+and writes the result to a temp file next to the photo. The EXIF capture
+time is read first and handed to ``commit`` for the photo manifest, also
+for photos that need no processing. The swap into
+place happens back in this process through a callback (``commit``), so
+the caller can do it under its own lock and keep indexes in sync. A photo
+that needs none of the above is left untouched; JPEGs are never
+re-encoded just for the sake of it.
+
+Originals can be kept in an archive subfolder (``keep_original``).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from photo_gallery import capture_time
+from render_pool import PoolSaturated
+
+
+@dataclass
+class IngestPolicy:
+    max_dimension: int = 2560
+    jpeg_quality: int = 85
+    png_to_jpeg: bool = True
+    strip_metadata: bool = True
+    keep_original: bool = False
+    archive_dirname: str = "מקוריים"
+
+
+def process_photo(path, policy: IngestPolicy):
+    """Write the ingested version of path to a temp file (worker process).
+
+    Returns a dict with the capture time ("captured", or None) and, unless
+    nothing needs to change ("tmp" None), the temp file, the final suffix
+    and the before/after sizes.
+    """
+    path = Path(path)
+    with Image.open(path) as img:
+        captured = capture_time(img)
+        fmt = img.format
+        orientation = img.getexif().get(0x0112, 1)
+        has_meta = bool(img.info.get("exif") or img.info.get("xmp"))
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        too_big = max(img.size) > policy.max_dimension
+        to_jpeg = fmt == "PNG" and policy.png_to_jpeg and not has_alpha
+        rotate = orientation not in (None, 1)
+        strip = policy.strip_metadata and has_meta
+        if not (too_big or to_jpeg or rotate or strip):
+            return {"tmp": None, "captured": captured}
+
+        out_fmt = "JPEG" if (fmt == "JPEG" or to_jpeg) else fmt
+        if too_big and fmt == "JPEG":
+            img.draft("RGB", (policy.max_dimension, policy.max_dimension))
+        out = ImageOps.exif_transpose(img)
+        if too_big:
+            out.thumbnail((policy.max_dimension, policy.max_dimension),
+                          Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if out_fmt == "JPEG" and out.mode not in ("RGB", "L"):
+            out = out.convert("RGB")
+
+        suffix = ".jpg" if out_fmt == "JPEG" else path.suffix.lower()
+        tmp = path.with_name(f".~ingest.{os.getpid()}.{path.name}{suffix}")
+        params = {"quality": policy.jpeg_quality, "optimize": True} if out_fmt == "JPEG" else {}
+        if not policy.strip_metadata and img.info.get("exif"):
+            exif = img.getexif()
+            exif[0x0112] = 1
+            params["exif"] = exif.tobytes()
+        out.save(tmp, format=out_fmt, **params)
+    return {"tmp": str(tmp), "suffix": suffix, "captured": captured,
+            "bytes_before": path.stat().st_size, "bytes_after": tmp.stat().st_size}
+
+
+class PhotoIngest:
+    """Queue of photos to ingest; run(fn, *args) executes the CPU part."""
+
+    def __init__(self, run, commit, policy=None, threads=2, retry_seconds=2.0):
+        self.run = run
+        self.commit = commit  # commit(photos_dir, path, result) -> final path; tmp may be None
+        self.policy = policy or IngestPolicy()
+        self.retry_seconds = retry_seconds
+        self._executor = ThreadPoolExecutor(max_workers=threads,
+                                            thread_name_prefix="photo-ingest")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.processed = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.last_error = None
+
+    def submit(self, photos_dir, path):
+        """Queue path for ingest; returns immediately."""
+        with self._lock:
+            self.queued += 1
+        self._executor.submit(self._ingest, Path(photos_dir), Path(path))
+
+    def _ingest(self, photos_dir, path):
+        try:
+            for _ in range(30):
+                try:
+                    result = self.run(process_photo, str(path), self.policy)
+                    break
+                except PoolSaturated:
+                    time.sleep(self.retry_seconds)
+            else:
+                raise PoolSaturated("image pool stayed saturated")
+            try:
+                self.commit(photos_dir, path, result)
+            except BaseException:
+                try:
+                    if result["tmp"] is not None:
+                        os.unlink(result["tmp"])
+                except FileNotFoundError:
+                    pass
+                raise
+            with self._lock:
+                if result["tmp"] is None:
+                    self.unchanged += 1
+                    return
+                self.processed += 1
+                self.bytes_before += result["bytes_before"]
+                self.bytes_after += result["bytes_after"]
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+                self.last_error = f"{path.name}: {type(e).__name__}: {e}"
+        finally:
+            with self._lock:
+                self.queued -= 1
+
+    def archive_path(self, photos_dir, path) -> Path:
+        """Where the original of path goes when keep_original is set."""
+        archive = Path(photos_dir) / self.policy.archive_dirname
+        archive.mkdir(exist_ok=True)
+        return archive / Path(path).name
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "policy": asdict(self.policy),
+                "queued": self.queued,
+                "processed": self.processed,
+                "unchanged": self.unchanged,
+                "failed": self.failed,
+                "bytes_before": self.bytes_before,
+                "bytes_after": self.bytes_after,
+                "bytes_saved": self.bytes_before - self.bytes_after,
+                "last_error": self.last_error,
+            }
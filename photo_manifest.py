@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Per-vehicle content-hash manifest of uploaded photos.
+
+Every photo stored in a vehicle's תמונות folder is recorded in
+``תמונות/.photo_manifest.json`` as sha256 -> {file, key, size, added,
+captured}; captured is the EXIF capture time, recorded by the ingest (or
+the seed) and used to sort the gallery.
+Uploads are hashed while they stream to disk; when the hash is already in
+the manifest (and its file still exists) the new copy is dropped and the
+existing file is returned, so retries and resubmits never duplicate images.
+Clients that can hash locally ask ``missing()`` first and only send what
+the server does not have.
+
+The first time a folder is seen without a manifest, the photos already in
+it are hashed once, in a background thread, to seed it. Until the seed is
+done, lookups only know the photos uploaded since (requests never wait for
+the hashing); those uploads are merged into the seeded manifest when it is
+written. Manifests are cached in memory per folder and re-read when the
+file's mtime changes.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from photo_gallery import capture_time
+
+MANIFEST_NAME = ".photo_manifest.json"
+PHOTO_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def _file_capture_time(path):
+    try:
+        with Image.open(path) as img:  # reads the header only
+            return capture_time(img)
+    except Exception:
+        return None
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PhotoManifests:
+    """Hash manifests for vehicle photo folders, one lock per folder."""
+
+    def __init__(self, seed_workers=2):
+        self._guard = threading.Lock()
+        self._locks = {}    # photos dir str -> threading.Lock
+        self._cache = {}    # photos dir str -> (mtime_ns, entries)
+        self._seeding = {}  # photos dir str -> entries added while its seed runs
+        self._seeder = ThreadPoolExecutor(max_workers=seed_workers,
+                                          thread_name_prefix="photo-seed")
+        self.duplicates = 0
+        self.stored = 0
+        self.seeded = 0
+
+    def _lock(self, photos_dir):
+        with self._guard:
+            return self._locks.setdefault(str(photos_dir), threading.Lock())
+
+    @staticmethod
+    def _seed(photos_dir) -> dict:
+        entries = {}
+        with os.scandir(photos_dir) as it:
+            for e in it:
+                if e.name.startswith(".") or not e.is_file():
+                    continue
+                if Path(e.name).suffix.lower() not in PHOTO_SUFFIXES:
+                    continue
+                try:
+                    entries.setdefault(file_sha256(e.path), {
+                        "file": e.name, "key": e.name.rsplit("_", 3)[0],
+                        "size": e.stat().st_size, "added": e.stat().st_mtime,
+                        "captured": _file_capture_time(e.path),
+                    })
+                except OSError:
+                    continue
+        return entries
+
+    def _start_seed(self, photos_dir) -> dict:
+        """Hash the folder in the background; caller holds the folder lock."""
+        entries = self._seeding[str(photos_dir)] = {}
+        self._seeder.submit(self._finish_seed, photos_dir)
+        return entries
+
+    def _finish_seed(self, photos_dir):
+        try:
+            seeded = self._seed(photos_dir)
+        except OSError:
+            seeded = {}
+        with self._lock(photos_dir):
+            # Photos stored or replaced while hashing win over the scan
+            seeded.update(self._seeding.pop(str(photos_dir)))
+            try:
+                self._save(photos_dir, seeded)
+            except OSError:
+                pass  # folder gone; seeded again on next use
+        with self._guard:
+            self.seeded += 1
+
+    def _load(self, photos_dir) -> dict:
+        """Entries for photos_dir; caller holds the folder lock."""
+        seeding = self._seeding.get(str(photos_dir))
+        if seeding is not None:
+            return seeding
+        path = Path(photos_dir) / MANIFEST_NAME
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return self._start_seed(photos_dir)
+        cached = self._cache.get(str(photos_dir))
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        try:
+            entries = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return self._start_seed(photos_dir)
+        self._cache[str(photos_dir)] = (mtime_ns, entries)
+        return entries
+
+    def _save(self, photos_dir, entries):
+        if str(photos_dir) in self._seeding:
+            return  # kept in memory; written together with the seed
+        path = Path(photos_dir) / MANIFEST_NAME
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(entries, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+        self._cache[str(photos_dir)] = (path.stat().st_mtime_ns, entries)
+
+    @staticmethod
+    def _alive(photos_dir, entry) -> bool:
+        return (Path(photos_dir) / entry["file"]).is_file()
+
+    def lookup(self, photos_dir, sha256):
+        """Existing photo Path for sha256, or None."""
+        with self._lock(photos_dir):
+            entry = self._load(photos_dir).get(sha256)
+            if entry is not None and self._alive(photos_dir, entry):
+                return Path(photos_dir) / entry["file"]
+        return None
+
+    def captured(self, photos_dir) -> dict:
+        """file name -> capture timestamp of the photos that have one."""
+        with self._lock(photos_dir):
+            return {e["file"]: e["captured"] for e in self._load(photos_dir).values()
+                    if e.get("captured")}
+
+    def missing(self, photos_dir, hashes) -> list:
+        """The subset of hashes that photos_dir does not hold yet."""
+        with self._lock(photos_dir):
+            entries = self._load(photos_dir)
+            return [h for h in hashes
+                    if h not in entries or not self._alive(photos_dir, entries[h])]
+
+    def commit(self, photos_dir, tmp_path, sha256, target, key=""):
+        """Move tmp_path to target unless sha256 is already stored.
+
+        Returns (path, duplicate). A duplicate's tmp_path is deleted.
+        """
+        with self._lock(photos_dir):
+            entries = self._load(photos_dir)
+            entry = entries.get(sha256)
+            if entry is not None and self._alive(photos_dir, entry):
+                os.unlink(tmp_path)
+                self.duplicates += 1
+                return Path(photos_dir) / entry["file"], True
+            os.replace(tmp_path, target)
+            entries[sha256] = {
+                "file": Path(target).name, "key": key,
+                "size": Path(target).stat().st_size, "added": time.time(),
+            }
+            self._save(photos_dir, entries)
+            self.stored += 1
+            return Path(target), False
+
+    def replace_file(self, photos_dir, old, tmp, new, archive=None, captured=None):
+        """Swap photo old for the processed tmp, saved as new.
+
+        The original is moved to archive when given, else deleted. Entries
+        pointing at old are repointed at new (and get captured, the capture
+        time read before processing). Returns the new path, or None if old
+        disappeared in the meantime (tmp is then discarded). tmp=None keeps
+        the file as is and only records captured.
+        """
+        old, new = Path(old), Path(new)
+        with self._lock(photos_dir):
+            if not old.is_file():
+                if tmp is not None:
+                    os.unlink(tmp)
+                return None
+            if tmp is None:
+                new = old
+            else:
+                if archive is not None:
+                    os.replace(old, archive)
+                os.replace(tmp, new)
+                if archive is None and old != new:
+                    os.unlink(old)
+            entries = self._load(photos_dir)
+            for entry in entries.values():
+                if entry["file"] == old.name:
+                    entry["file"] = new.name
+                    entry["size"] = new.stat().st_size
+                    if captured is not None:
+                        entry["captured"] = captured
+            self._save(photos_dir, entries)
+            return new
+
+    def stats(self) -> dict:
+        with self._guard:
+            return {"folders": len(self._cache), "stored": self.stored,
+                    "duplicates": self.duplicates, "seeding": len(self._seeding),
+                    "seeded": self.seeded}
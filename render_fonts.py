@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""Process-wide fonts for the deficiency PDF (fpdf2) and PNG (Pillow).
+
+Fonts are looked up once in a cross-platform search path (extra dirs first,
+then the usual Windows / macOS / Linux font folders) with fallbacks from
+Arial to other Hebrew-capable families, instead of a hard-coded
+``C:\\Windows\\Fonts``.
+
+fpdf2's ``add_font`` re-reads the TTF and rebuilds its glyph width tables
+for every document, and on output subsets the whole font again. Here each
+font is first cut down to the characters the reports use (RENDER_UNICODES:
+Latin, Hebrew, punctuation), which makes the per-document subsetting about
+five times cheaper; the cut-down file is kept in ``cache_dir`` so worker
+processes share it. It is then parsed into a template once per process;
+``add_pdf_fonts`` gives every new document a shallow copy that shares the
+read-only tables and only gets a fresh fontTools object (from bytes held
+in memory) and subset map, because fpdf2 subsets that object in place on
+output. That copy touches private TTFFont fields, so it is only used with
+the fpdf2 release it was checked against (CLONE_FPDF_VERSIONS, pinned in
+requirements.txt); any other version, or any error while cloning, falls
+back to the public ``add_font`` on the cached cut-down file. A document
+whose text has characters outside RENDER_UNICODES (Arabic, Cyrillic, CJK,
+...) gets the full font files through ``add_font`` instead, so nothing the
+font can show is dropped; ``add_pdf_fonts`` is told the texts for that.
+
+Pillow FreeTypeFont objects are cached per (style, size).
+
+Renders run in worker processes, so ``warm_up`` is meant to be used as the
+pool initializer as well as in the main process.
+"""
+import copy
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# style -> candidate file names, best first (all cover Hebrew)
+FONT_CANDIDATES = {
+    "": ["arial.ttf", "Arial.ttf", "DejaVuSans.ttf", "LiberationSans-Regular.ttf",
+         "FreeSans.ttf", "NotoSansHebrew-Regular.ttf"],
+    "B": ["arialbd.ttf", "Arial Bold.ttf", "DejaVuSans-Bold.ttf", "LiberationSans-Bold.ttf",
+          "FreeSansBold.ttf", "NotoSansHebrew-Bold.ttf"],
+}
+
+
+# fpdf2 releases (major.minor) whose TTFFont fields _clone was checked against
+CLONE_FPDF_VERSIONS = ("2.8",)
+
+
+# Characters kept in the PDF fonts: Latin + Latin-1, Hebrew (incl.
+# presentation forms), general punctuation, currency, letterlike symbols
+RENDER_UNICODES = [*range(0x20, 0x7F), *range(0xA0, 0x180), *range(0x590, 0x600),
+                   *range(0x2000, 0x2070), *range(0x20A0, 0x20C0), *range(0x2100, 0x2150),
+                   *range(0xFB1D, 0xFB50)]
+_RENDER_SET = frozenset(RENDER_UNICODES)
+
+
+def needs_full_font(texts) -> bool:
+    """Whether any of texts has a printable character outside RENDER_UNICODES."""
+    return any(ord(ch) >= 0x20 and ord(ch) not in _RENDER_SET
+               for text in texts for ch in str(text or ""))
+
+
+def subset_font(src, dst):
+    """Write src cut down to RENDER_UNICODES to dst (atomically)."""
+    from fontTools import subset, ttLib
+
+    options = subset.Options()
+    options.layout_features = ["*"]
+    options.name_IDs = ["*"]
+    options.notdef_outline = True
+    options.glyph_names = True
+    font = ttLib.TTFont(str(src))
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=RENDER_UNICODES)
+    subsetter.subset(font)
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    font.save(tmp)
+    os.replace(tmp, dst)
+
+
+def default_font_dirs() -> list:
+    if sys.platform == "win32":
+        return [Path(os.environ.get("WINDIR", r"C:\Windows")) / "Fonts"]
+    if sys.platform == "darwin":
+        return [Path("/Library/Fonts"), Path("/System/Library/Fonts/Supplemental"),
+                Path.home() / "Library/Fonts"]
+    return [Path("/usr/share/fonts"), Path("/usr/local/share/fonts"),
+            Path.home() / ".local/share/fonts", Path.home() / ".fonts"]
+
+
+class FontRegistry:
+    """Finds, parses and caches the fonts used by PDF/PNG rendering."""
+
+    def __init__(self, extra_dirs=(), family="Arial", cache_dir=None):
+        self.dirs = [Path(d) for d in extra_dirs] + default_font_dirs()
+        self.family = family
+        self.cache_dir = Path(cache_dir or Path(tempfile.gettempdir()) / "inspection-fonts")
+        self._lock = threading.Lock()
+        self._paths = {}      # style -> Path
+        self._bytes = {}      # style -> font file bytes
+        self._templates = {}  # style -> parsed fpdf TTFFont
+        self._pil = {}        # (style, size) -> ImageFont.FreeTypeFont
+        self.load_ms = {}
+        self.pdf_reused = 0
+        self.pdf_fallbacks = 0
+        self.pdf_full = 0
+        self.clone_errors = 0
+        self._can_clone = None
+
+    # -- lookup ------------------------------------------------------------
+
+    def _find(self, name):
+        for d in self.dirs:
+            p = d / name
+            if p.is_file():
+                return p
+        # Linux keeps fonts in per-package subfolders
+        for d in self.dirs:
+            if d.is_dir():
+                for p in d.rglob(name):
+                    return p
+        return None
+
+    def path(self, style="") -> Path:
+        """Font file for style ("" or "B"); raises FileNotFoundError."""
+        with self._lock:
+            if style in self._paths:
+                return self._paths[style]
+        for name in FONT_CANDIDATES[style]:
+            p = self._find(name)
+            if p is not None:
+                with self._lock:
+                    self._paths[style] = p
+                return p
+        raise FileNotFoundError(
+            f"no Hebrew-capable font for style {style!r} in {[str(d) for d in self.dirs]}")
+
+    # -- fpdf2 -------------------------------------------------------------
+
+    def _template(self, style):
+        with self._lock:
+            tpl = self._templates.get(style)
+        if tpl is not None:
+            return tpl
+        from fpdf import FPDF
+
+        start = time.perf_counter()
+        path = self._subset_path(style)
+        data = path.read_bytes()
+        scratch = FPDF()
+        scratch.add_font(self.family, style, str(path))
+        tpl = scratch.fonts[f"{self.family.lower()}{style}"]
+        with self._lock:
+            self._bytes[style] = data
+            self._templates[style] = tpl
+            self.load_ms[f"pdf{style}"] = round((time.perf_counter() - start) * 1000, 1)
+        return tpl
+
+    def _subset_path(self, style) -> Path:
+        """The cut-down copy of the style's font, created on first use."""
+        src = self.path(style)
+        st = src.stat()
+        tag = hashlib.sha1(f"{src}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8")).hexdigest()[:12]
+        dst = self.cache_dir / f"{src.stem}-{tag}.ttf"
+        if not dst.is_file():
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            subset_font(src, dst)
+        return dst
+
+    def can_clone(self) -> bool:
+        """Whether the installed fpdf2 is one _clone was checked against."""
+        if self._can_clone is None:
+            try:
+                import fpdf
+                version = ".".join(fpdf.__version__.split(".")[:2])
+            except (ImportError, AttributeError):
+                version = None
+            self._can_clone = version in CLONE_FPDF_VERSIONS
+        return self._can_clone
+
+    def _clone(self, pdf, style):
+        from fontTools import ttLib
+        from fpdf.fonts import SubsetMap
+
+        tpl = self._template(style)
+        font = copy.copy(tpl)
+        font.i = len(pdf.fonts) + 1
+        font.ttfont = ttLib.TTFont(io.BytesIO(self._bytes[style]), recalcTimestamp=False,
+                                   lazy=True)
+        font._hbfont = None
+        font.biggest_size_pt = 0
+        font.missing_glyphs = []
+        font.subset = SubsetMap(font)
+        if font.color_font is not None:
+            raise TypeError("color fonts are not cloned")
+        return font
+
+    def add_pdf_fonts(self, pdf, texts=()):
+        """Register the regular and bold font on pdf under self.family.
+
+        texts are the strings the document will show; any character outside
+        RENDER_UNICODES selects the full font files.
+        """
+        full = needs_full_font(texts)
+        for style in ("", "B"):
+            fontkey = f"{self.family.lower()}{style}"
+            if full:
+                pdf.add_font(self.family, style, str(self.path(style)))
+                with self._lock:
+                    self.pdf_full += 1
+                continue
+            if self.can_clone():
+                try:
+                    font = self._clone(pdf, style)
+                except FileNotFoundError:
+                    raise
+                except Exception:
+                    # fpdf2 internals differ from what _clone expects
+                    with self._lock:
+                        self.clone_errors += 1
+                else:
+                    pdf.fonts[fontkey] = font
+                    with self._lock:
+                        self.pdf_reused += 1
+                    continue
+            pdf.add_font(self.family, style, str(self._subset_path(style)))
+            with self._lock:
+                self.pdf_fallbacks += 1
+
+    # -- Pillow ------------------------------------------------------------
+
+    def pil(self, size, style=""):
+        """Cached ImageFont for (style, size); Pillow's default if none found."""
+        key = (style, size)
+        with self._lock:
+            font = self._pil.get(key)
+        if font is not None:
+            return font
+        from PIL import ImageFont
+
+        start = time.perf_counter()
+        try:
+            font = ImageFont.truetype(str(self.path(style)), size)
+        except OSError:
+            font = ImageFont.load_default(size)
+        with self._lock:
+            self._pil[key] = font
+            self.load_ms[f"pil{style}{size}"] = round((time.perf_counter() - start) * 1000, 1)
+        return font
+
+    # -- hooks -------------------------------------------------------------
+
+    def warm_up(self, pil_sizes=()) -> dict:
+        """Parse the PDF fonts and the given (style, size) Pillow fonts now."""
+        for style in ("", "B"):
+            try:
+                self._template(style)
+            except FileNotFoundError:
+                pass
+        for style, size in pil_sizes:
+            self.pil(size, style)
+        return dict(self.load_ms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "fonts": {s: str(p) for s, p in self._paths.items()},
+                "load_ms": dict(self.load_ms),
+                "pdf_reused": self.pdf_reused,
+                "pdf_fallbacks": self.pdf_fallbacks,
+                "pdf_full": self.pdf_full,
+                "clone_errors": self.clone_errors,
+                "pil_cached": len(self._pil),
+            }
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Worker-process pool for CPU-bound workbook parsing and PDF/PNG rendering.
+
+openpyxl, fpdf2 and Pillow drawing are pure Python and hold the GIL, so under
+the threaded Flask server one heavy workbook stalls every other request.
+Tasks submitted here run in separate processes; request threads only wait on
+a future.
+
+Submitted callables and their arguments/results must be picklable (top-level
+functions, plain data / dataclasses). Queue depth is bounded: when it is full
+``run`` raises PoolSaturated immediately so the route can answer 503 instead
+of piling up work. A task that exceeds its timeout raises TaskTimeout; if it
+had not started yet it is cancelled.
+
+With max_workers=0 tasks run inline in the calling thread. ``initializer``
+runs once in every worker process (e.g. to load fonts).
+
+Workers are started with the "spawn" method by default. The executor is
+created lazily, after the server's request and background threads exist,
+and forking a multi-threaded process can copy a lock some other thread held
+at that moment into the child, deadlocking it. Spawned workers start from a
+fresh interpreter and import the callable's module instead.
+"""
+import atexit
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+
+class PoolSaturated(RuntimeError):
+    """Too many tasks are queued or running."""
+
+
+class TaskTimeout(TimeoutError):
+    """A task did not finish within its timeout."""
+
+
+class RenderPool:
+    """Bounded, lazily started ProcessPoolExecutor with per-task timeouts."""
+
+    def __init__(self, max_workers=2, max_queue=16, default_timeout=60.0,
+                 initializer=None, start_method="spawn"):
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.start_method = start_method
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self._executor = None
+        self._atexit_registered = False
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(max_queue, 1))
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, initializer=self.initializer,
+                    mp_context=multiprocessing.get_context(self.start_method))
+                if not self._atexit_registered:
+                    atexit.register(self.shutdown)
+                    self._atexit_registered = True
+            return self._executor
+
+    def _reset_executor(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, args, kwargs):
+        executor = self._get_executor()
+        try:
+            return executor, executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool once
+            self._reset_executor(executor)
+            executor = self._get_executor()
+            return executor, executor.submit(fn, *args, **kwargs)
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """Run fn(*args, **kwargs) in a worker process and return its result."""
+        if self.max_workers <= 0:
+            return fn(*args, **kwargs)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolSaturated("render pool queue is full")
+
+        timeout = self.default_timeout if timeout is None else timeout
+        start = time.monotonic()
+        try:
+            executor, future = self._submit(fn, args, kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.submitted += 1
+        # The slot is released when the task really ends, even after a timeout
+        future.add_done_callback(lambda f: self._finished(f, start))
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            # cancel() runs the done callback synchronously; keep it unlocked
+            cancelled = future.cancel()
+            with self._lock:
+                self.timeouts += 1
+                if cancelled:
+                    self.cancelled += 1
+            raise TaskTimeout(f"{getattr(fn, '__name__', fn)} exceeded {timeout}s")
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            raise
+
+    def _finished(self, future, start):
+        self._slots.release()
+        with self._lock:
+            self.busy_seconds += time.monotonic() - start
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self.failures += 1
+            else:
+                self.completed += 1
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.submitted - self.completed - self.failures - self.cancelled,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "cancelled": self.cancelled,
+                "busy_seconds": round(self.busy_seconds, 2),
+            }
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""Durable write-behind journal for examiner edits.
+
+Save endpoints append {cell_ref: value} updates to a per-workbook journal
+file (fsync'd before the request is acknowledged) instead of rewriting the
+xlsx. A background flusher merges everything pending for a workbook and
+applies it with a single write once the workbook has been idle for a while,
+has waited too long, or has collected many cells. Journals left over from a
+crash are replayed on start, and everything is flushed on shutdown. The
+flusher starts with the first append unless ``start`` was called earlier;
+once it has been stopped, appends are flushed synchronously so no edit is
+left only in the journal.
+
+The journal files are the single source of truth, shared by every worker
+process: ``pending(path)`` reads them from disk, so an edit journaled by
+one worker is visible to all, and a flush writes the records found on disk
+rather than what one process remembers. Each workbook has two cross-process
+locks (workbook_locks.py): the journal lock, held briefly to append, rotate
+or delete, and the flush lock, held by whichever process is writing that
+workbook. A journal no live process flushes (its worker died) is picked up
+by the periodic scan of the others.
+
+Journal layout: one ``<sha1 of path>.jsonl`` per workbook in journal_dir,
+one JSON record per line: {"path": ..., "updates": {...}, "ts": ...}. While a
+flush is running the file is renamed to ``.flushing.jsonl`` and new edits
+start a fresh journal; the renamed file is removed only after the write
+succeeded.
+"""
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from workbook_locks import LockTimeout
+
+
+class SaveJournal:
+    """Append-only per-workbook journal with a coalescing background flusher."""
+
+    def __init__(self, journal_dir, write_fn, locks, idle_seconds=2.0,
+                 max_delay=30.0, max_cells=200, retry_seconds=5.0):
+        self.journal_dir = Path(journal_dir)
+        self.write_fn = write_fn  # write_fn(path, updates) -> bool
+        self.locks = locks        # WorkbookLocks: cross-process journal/flush locks
+        self.idle_seconds = idle_seconds
+        self.max_delay = max_delay
+        self.max_cells = max_cells
+        self.retry_seconds = retry_seconds
+
+        # In-memory state only schedules this process's flushes; the data
+        # always comes from the journal files
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._cells = {}     # path str -> refs appended here since the last flush
+        self._first = {}     # path str -> time of oldest pending edit
+        self._last = {}      # path str -> time of newest pending edit
+        self._retry_at = {}  # path str -> earliest retry after a failed or busy flush
+        self._thread = None
+        self._stopping = False
+        self._scanned_at = 0.0
+
+        self.appends = 0
+        self.flushes = 0
+        self.cells_written = 0
+        self.failures = 0
+        self.adopted = 0
+
+    # -- journal files -----------------------------------------------------
+
+    def _journal_file(self, path, suffix=".jsonl"):
+        digest = hashlib.sha1(path.encode("utf-8")).hexdigest()
+        return self.journal_dir / f"{digest}{suffix}"
+
+    @contextmanager
+    def _journal_lock(self, key):
+        with self.locks.lock(self._journal_file(key, ".journal")):
+            yield
+
+    @staticmethod
+    def _append_record(file, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with open(file, "a", encoding="utf-8") as fh:
+            fh.write(line)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    @staticmethod
+    def _read_records(file):
+        records = []
+        try:
+            with open(file, encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break  # torn last line from a crash mid-append
+        except FileNotFoundError:
+            pass
+        return records
+
+    def _read_pending(self, key) -> dict:
+        # Live journal first: a rotation in between moves its records to
+        # the flushing file, so they are read there instead of lost
+        newer = self._read_records(self._journal_file(key))
+        older = self._read_records(self._journal_file(key, ".flushing.jsonl"))
+        merged = {}
+        for record in older + newer:
+            merged.update(record.get("updates", {}))
+        return merged
+
+    # -- public API --------------------------------------------------------
+
+    def append(self, path, updates: dict):
+        """Durably record updates for the workbook at path."""
+        with self._journal_lock(str(path)):
+            self._append(str(path), updates)
+        if updates and self._thread is None:
+            self.flush(path)  # no flusher (shut down): write it now
+
+    def _append(self, key, updates):
+        """Append with the journal lock held (the fsync runs outside _lock)."""
+        if not updates:
+            return
+        if self._thread is None and not self._stopping:
+            self.start()
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self._append_record(self._journal_file(key),
+                            {"path": key, "updates": updates, "ts": time.time()})
+        now = time.monotonic()
+        with self._lock:
+            cells = self._cells.setdefault(key, set())
+            cells.update(updates)
+            self._first.setdefault(key, now)
+            self._last[key] = now
+            self.appends += 1
+            full = len(cells) >= self.max_cells
+        if full:
+            self._wake.set()
+
+    def pending(self, path) -> dict:
+        """Unflushed updates for path from every process (newer edits win)."""
+        return self._read_pending(str(path))
+
+    @contextmanager
+    def locked(self, path):
+        """Hold path's journal lock: pending() then append() on the yielded
+        view are atomic across threads and processes, and no flush finishes
+        (drops its records) in between."""
+        key = str(path)
+        view = _LockedJournal(self, key)
+        with self._journal_lock(key):
+            yield view
+        if view.appended and self._thread is None:
+            self.flush(key)  # no flusher (shut down): write it now
+
+    def flush(self, path=None, wait=30.0):
+        """Synchronously flush one workbook, or all this process knows of.
+
+        Waits up to wait seconds for another process's flush of the same
+        workbook, then writes whatever it left behind.
+        """
+        with self._lock:
+            keys = [str(path)] if path is not None else list(self._cells)
+        for key in keys:
+            if path is not None and not self.has_pending(key):
+                continue  # nothing journaled: skip the lock round-trip
+            self._flush_one(key, wait)
+
+    def has_pending(self, path) -> bool:
+        """Whether a journal (live or mid-flush) exists for path."""
+        key = str(path)
+        return (self._journal_file(key).exists()
+                or self._journal_file(key, ".flushing.jsonl").exists())
+
+    def start(self):
+        """Replay leftover journals and start the flusher thread (idempotent)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="save-journal",
+                                            daemon=True)
+        self.replay()
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher and flush everything still pending."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+        self._wake.set()
+        if thread is not None:
+            thread.join(timeout=30)
+        self.flush()
+
+    def replay(self, older_than=0.0):
+        """Schedule journals found on disk (e.g. after a crash) for flushing.
+
+        With older_than, only journals untouched for that many seconds: ones
+        a live worker is still collecting are left to it.
+        """
+        if not self.journal_dir.is_dir():
+            return
+        now, wall = time.monotonic(), time.time()
+        for file in self.journal_dir.glob("*.jsonl"):
+            try:
+                if older_than and wall - file.stat().st_mtime < older_than:
+                    continue
+            except FileNotFoundError:
+                continue
+            records = self._read_records(file)
+            key = records[0].get("path") if records else None
+            if not key:
+                continue
+            with self._lock:
+                if key not in self._cells:
+                    self.adopted += 1
+                cells = self._cells.setdefault(key, set())
+                for record in records:
+                    cells.update(record.get("updates", {}))
+                self._first.setdefault(key, now - self.max_delay)
+                self._last.setdefault(key, now - self.idle_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending_workbooks": len(self._cells),
+                "pending_cells": sum(len(c) for c in self._cells.values()),
+                "appends": self.appends,
+                "flushes": self.flushes,
+                "cells_written": self.cells_written,
+                "failures": self.failures,
+                "adopted": self.adopted,
+            }
+
+    # -- flushing ----------------------------------------------------------
+
+    def _due(self, key, now):
+        if now < self._retry_at.get(key, 0):
+            return False
+        return (self._stopping
+                or now - self._last[key] >= self.idle_seconds
+                or now - self._first[key] >= self.max_delay
+                or len(self._cells[key]) >= self.max_cells)
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=min(0.5, self.idle_seconds))
+            self._wake.clear()
+            if self._stopping:
+                return
+            if time.monotonic() - self._scanned_at >= self.max_delay:
+                # Journals of workers that died before flushing
+                self._scanned_at = time.monotonic()
+                try:
+                    self.replay(older_than=self.max_delay)
+                except OSError:
+                    pass
+            now = time.monotonic()
+            with self._lock:
+                due = [k for k in self._cells if self._due(k, now)]
+            for key in due:
+                self._flush_one(key)
+
+    def _reschedule(self, key, delay):
+        now = time.monotonic()
+        with self._lock:
+            self._cells.setdefault(key, set())
+            self._first.setdefault(key, now)
+            self._last.setdefault(key, now)
+            self._retry_at[key] = now + delay
+
+    def _flush_one(self, key, wait=0.0):
+        journal = self._journal_file(key)
+        flushing = self._journal_file(key, ".flushing.jsonl")
+        try:
+            with self.locks.lock(self._journal_file(key, ".flush"), timeout=wait):
+                with self._lock:
+                    self._cells.pop(key, None)
+                    self._first.pop(key, None)
+                    self._last.pop(key, None)
+                with self._journal_lock(key):
+                    # New appends go to a fresh journal; keep this batch's records
+                    if journal.exists():
+                        if flushing.exists():
+                            # An earlier failed flush: fold its records in first
+                            for record in self._read_records(journal):
+                                self._append_record(flushing, record)
+                            journal.unlink()
+                        else:
+                            os.replace(journal, flushing)
+                updates = {}
+                for record in self._read_records(flushing):
+                    updates.update(record.get("updates", {}))
+                if not updates:
+                    return
+
+                try:
+                    ok = self.write_fn(Path(key), updates)
+                    error = None
+                except Exception as e:
+                    ok, error = False, e
+
+                if error is None:
+                    # Applied (or the workbook no longer has the sheet): done
+                    with self._journal_lock(key):
+                        try:
+                            flushing.unlink()
+                        except FileNotFoundError:
+                            pass
+                    with self._lock:
+                        self.flushes += 1
+                        if ok:
+                            self.cells_written += len(updates)
+                        self._retry_at.pop(key, None)
+                else:
+                    # Keep the flushing file; the retry folds newer edits in after it
+                    with self._lock:
+                        self.failures += 1
+                    self._reschedule(key, self.retry_seconds)
+        except LockTimeout:
+            # Another process is flushing this workbook; look again later
+            self._reschedule(key, self.idle_seconds)
+
+
+class _LockedJournal:
+    """pending/append for one workbook while SaveJournal.locked() is held."""
+
+    def __init__(self, journal, key):
+        self._journal = journal
+        self._key = key
+        self.appended = False
+
+    def pending(self) -> dict:
+        return self._journal._read_pending(self._key)
+
+    def append(self, updates: dict):
+        self._journal._append(self._key, updates)
+        self.appended = self.appended or bool(updates)
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""SQLite search index over license, VIN and report number of every vehicle.
+
+A crawl walks BASE_DIR/<manufacturer>/<date>/<vehicle>/<vehicle>.xlsx,
+compares each workbook's (mtime_ns, size) with what is stored, and
+re-extracts only new or changed files, plus those whose extraction failed
+last time (e.g. a workbook read while it was still being copied).
+Extraction reads a handful of cells with the streaming reader
+(xlsx_reader.py) in a process pool; the cells come from the workbook's
+layout in the LayoutRegistry (cell_layouts.py), so per-template layouts
+apply to search as well, and a change to the layouts re-extracts every
+workbook on the next crawl. Results are committed in small batches, so an
+interrupted crawl resumes where it stopped. Rows for workbooks that
+disappeared are removed at the end of a complete crawl.
+
+Searches match the normalised value (upper-case, letters and digits only)
+of license and VIN from both מזכירה and פ. ממצאים מסכם: prefix matches
+first, then substring matches.
+"""
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from cell_layouts import default_registry, FINDINGS, SECRETARY
+from template_options import read_template
+from xlsx_reader import StreamingWorkbook, find_sheet_name
+
+# Indexed columns -> (sheet token, layout field); the cell of each field is
+# looked up in the layout of the workbook's category and template
+INDEX_FIELDS = {
+    "license":      (SECRETARY, "license"),
+    "category":     (SECRETARY, "category"),
+    "vin":          (SECRETARY, "vin"),
+    "manufacturer": (SECRETARY, "manufacturer"),
+    "report_num":   (FINDINGS, "report_num"),
+    "def_license":  (FINDINGS, "license"),
+    "def_vin":      (FINDINGS, "vin"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vehicles (
+    path          TEXT PRIMARY KEY,
+    mfr_dir       TEXT NOT NULL,
+    date_dir      TEXT NOT NULL,
+    vehicle       TEXT NOT NULL,
+    mtime_ns      INTEGER NOT NULL,
+    size          INTEGER NOT NULL,
+    license       TEXT, category TEXT, vin TEXT, manufacturer TEXT,
+    report_num    TEXT, def_license TEXT, def_vin TEXT,
+    license_norm  TEXT, vin_norm TEXT, def_license_norm TEXT, def_vin_norm TEXT,
+    error         TEXT,
+    indexed_at    REAL
+);
+CREATE INDEX IF NOT EXISTS ix_license ON vehicles(license_norm);
+CREATE INDEX IF NOT EXISTS ix_vin ON vehicles(vin_norm);
+CREATE INDEX IF NOT EXISTS ix_def_license ON vehicles(def_license_norm);
+CREATE INDEX IF NOT EXISTS ix_def_vin ON vehicles(def_vin_norm);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_NORM_RE = re.compile("[^0-9A-Z\u0590-\u05FF]")
+_SEARCH_COLUMNS = ("license_norm", "vin_norm", "def_license_norm", "def_vin_norm")
+
+
+def normalize(value) -> str:
+    """'12-345 67' -> '1234567'; used for both stored values and queries."""
+    return _NORM_RE.sub("", str(value or "").upper())
+
+
+def _index_refs(layout) -> dict:
+    """field -> (sheet token, (row, col)) of INDEX_FIELDS in one layout."""
+    cells = {SECRETARY: layout.secretary, FINDINGS: layout.findings_meta}
+    return {f: (token, cells[token][name]) for f, (token, name) in INDEX_FIELDS.items()
+            if name in cells[token]}
+
+
+def extract_index_fields(path, registry) -> dict:
+    """Read INDEX_FIELDS from one workbook (runs in worker processes)."""
+    with StreamingWorkbook(path) as wb:
+        template = read_template(wb)[0]
+        # The category cell of the template's N2 layout decides the rest,
+        # as in the app's snapshots
+        layouts = [registry.select("N2", template)] + registry.layouts(template)
+        plan = {}
+        for layout in layouts:
+            for token, rc in _index_refs(layout).values():
+                plan.setdefault(token, set()).add(rc)
+        sheets = {}
+        for token, cells in plan.items():
+            name = find_sheet_name(wb.sheetnames, token)
+            sheets[token] = wb.read_sheet(name, cells) if name is not None else None
+
+    def value(token, rc):
+        ws = sheets.get(token)
+        val = ws.cell(*rc).value if ws is not None else None
+        return "" if val is None else str(val).strip()
+
+    category_cell = _index_refs(layouts[0]).get("category")
+    category = value(*category_cell) if category_cell else ""
+    refs = _index_refs(registry.select(category or "N2", template))
+    return {f: value(*refs[f]) if f in refs else "" for f in INDEX_FIELDS}
+
+
+def _extract_safe(path, registry):
+    try:
+        return path, extract_index_fields(path, registry), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+class SearchIndex:
+    """Incrementally maintained SQLite (WAL) index of vehicle workbooks."""
+
+    def __init__(self, db_path, base_dir, workers=None, batch_size=50,
+                 interval=600.0, registry=None):
+        self.db_path = Path(db_path)
+        self.base_dir = Path(base_dir)
+        self.registry = registry or default_registry()
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.batch_size = batch_size
+        self.interval = interval
+        self._crawl_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.last_crawl = {}
+        self.crawling = False
+
+    def _connect(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    # -- crawling ----------------------------------------------------------
+
+    def _walk_manufacturer(self, mfr):
+        """(xlsx path, mfr, date, vehicle, mtime_ns, size) for one manufacturer."""
+        found = []
+        try:
+            dates = [e for e in os.scandir(mfr.path) if e.is_dir()]
+        except OSError:
+            return found
+        for date in dates:
+            try:
+                vehicles = [e for e in os.scandir(date.path) if e.is_dir()]
+            except OSError:
+                continue
+            for veh in vehicles:
+                xlsx = os.path.join(veh.path, f"{veh.name}.xlsx")
+                try:
+                    st = os.stat(xlsx)
+                except OSError:
+                    continue
+                found.append((xlsx, mfr.name, date.name, veh.name,
+                              st.st_mtime_ns, st.st_size))
+        return found
+
+    def _walk(self):
+        try:
+            mfrs = [e for e in os.scandir(self.base_dir) if e.is_dir()]
+        except OSError:
+            return None
+        # Listing is I/O bound on the network drive: one thread per manufacturer
+        found = []
+        with ThreadPoolExecutor(max_workers=min(8, max(len(mfrs), 1))) as pool:
+            for part in pool.map(self._walk_manufacturer, mfrs):
+                found.extend(part)
+        return found
+
+    def crawl(self) -> dict:
+        """Index new/changed workbooks and drop vanished ones. Returns counters."""
+        if not self._crawl_lock.acquire(blocking=False):
+            return {"skipped": "crawl already running"}
+        self.crawling = True
+        start = time.monotonic()
+        try:
+            found = self._walk()
+            if found is None:
+                return {"error": f"base dir not readable: {self.base_dir}"}
+            conn = self._connect()
+            try:
+                # Rows whose extraction failed never match, so they are retried
+                known = {row["path"]: (row["mtime_ns"], row["size"]) if row["error"] is None
+                         else None
+                         for row in conn.execute("SELECT path, mtime_ns, size, error FROM vehicles")}
+                signature = self.registry.signature()
+                stored = conn.execute("SELECT value FROM meta WHERE key = 'layouts'").fetchone()
+                # Other cell addresses: every stored row may be wrong
+                stale = stored is None or stored[0] != signature
+                todo = {f[0]: f for f in found if stale or known.get(f[0]) != (f[4], f[5])}
+                indexed, errors = self._index(conn, todo)
+                if stale and not self._stop.is_set():
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('layouts', ?)",
+                                 (signature,))
+
+                seen = {f[0] for f in found}
+                gone = [p for p in known if p not in seen]
+                conn.executemany("DELETE FROM vehicles WHERE path = ?", [(p,) for p in gone])
+                conn.commit()
+            finally:
+                conn.close()
+            self.last_crawl = {
+                "files": len(found),
+                "indexed": indexed,
+                "errors": errors,
+                "removed": len(gone),
+                "seconds": round(time.monotonic() - start, 2),
+                "finished_at": time.time(),
+            }
+            return self.last_crawl
+        finally:
+            self.crawling = False
+            self._crawl_lock.release()
+
+    def _index(self, conn, todo):
+        if not todo:
+            return 0, 0
+        indexed = errors = 0
+        batch = []
+
+        def store(path, fields, error):
+            _, mfr, date, vehicle, mtime_ns, size = todo[path]
+            fields = fields or {}
+            batch.append((
+                path, mfr, date, vehicle, mtime_ns, size,
+                *(fields.get(f, "") for f in INDEX_FIELDS),
+                normalize(fields.get("license")), normalize(fields.get("vin")),
+                normalize(fields.get("def_license")), normalize(fields.get("def_vin")),
+                error, time.time(),
+            ))
+            if len(batch) >= self.batch_size:
+                flush()
+
+        def flush():
+            placeholders = ",".join("?" * (6 + len(INDEX_FIELDS) + 4 + 2))
+            conn.executemany(
+                "INSERT OR REPLACE INTO vehicles (path, mfr_dir, date_dir, vehicle, mtime_ns, size, "
+                + ", ".join(INDEX_FIELDS)
+                + ", license_norm, vin_norm, def_license_norm, def_vin_norm, error, indexed_at)"
+                + f" VALUES ({placeholders})", batch)
+            conn.commit()  # each batch is durable: an interrupted crawl resumes here
+            batch.clear()
+
+        if self.workers <= 1 or len(todo) < 4:
+            results = (_extract_safe(p, self.registry) for p in todo)
+            for path, fields, error in results:
+                store(path, fields, error)
+                indexed += error is None
+                errors += error is not None
+        else:
+            # spawn, not fork: the crawl runs beside the server's threads
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [pool.submit(_extract_safe, p, self.registry) for p in todo]
+                for fut in as_completed(futures):
+                    if self._stop.is_set():
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        break
+                    path, fields, error = fut.result()
+                    store(path, fields, error)
+                    indexed += error is None
+                    errors += error is not None
+        if batch:
+            flush()
+        return indexed, errors
+
+    # -- searching ---------------------------------------------------------
+
+    def search(self, query, limit=20) -> list:
+        """Prefix matches first, then substring matches, on license/VIN."""
+        if self._thread is None and not self._stop.is_set():
+            self.start()  # first lookup starts the crawler
+        q = normalize(query)
+        if not q:
+            return []
+        escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conn = self._connect()
+        try:
+            results = []
+            seen = set()
+            for pattern in (f"{escaped}%", f"%{escaped}%"):
+                where = " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in _SEARCH_COLUMNS)
+                rows = conn.execute(
+                    f"SELECT * FROM vehicles WHERE {where} ORDER BY date_dir DESC LIMIT ?",
+                    (*([pattern] * len(_SEARCH_COLUMNS)), limit)).fetchall()
+                for row in rows:
+                    if row["path"] in seen:
+                        continue
+                    seen.add(row["path"])
+                    results.append({
+                        "manufacturer_dir": row["mfr_dir"],
+                        "date": row["date_dir"],
+                        "vehicle": row["vehicle"],
+                        "license": row["license"] or row["def_license"],
+                        "vin": row["vin"] or row["def_vin"],
+                        "category": row["category"],
+                        "manufacturer": row["manufacturer"],
+                        "report_num": row["report_num"],
+                    })
+                    if len(results) >= limit:
+                        return results
+            return results
+        finally:
+            conn.close()
+
+    # -- background --------------------------------------------------------
+
+    def start(self):
+        """Start the background crawler (idempotent, thread-safe)."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="search-index", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.crawl()
+            except Exception as e:
+                self.last_crawl = {"error": str(e), "finished_at": time.time()}
+            if self._stop.wait(self.interval):
+                return
+
+    def stats(self) -> dict:
+        try:
+            conn = self._connect()
+            try:
+                count = conn.execute("SELECT COUNT(*) FROM vehicles").fetchone()[0]
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            count = None
+        return {"vehicles": count, "crawling": self.crawling, "last_crawl": self.last_crawl}
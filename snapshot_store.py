@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Persistent per-vehicle snapshot sidecars.
+
+Everything the UI reads from a vehicle workbook (secretary, deficiencies,
+notes, examiner fields, classification) is kept as a small JSON sidecar
+so a restarted server, or a page nobody opened for a while, does not parse
+the xlsx again. Sidecars are mirrored under ``cache_dir`` as
+``<sha1 of path>.json`` (local disk, nothing added to the shared vehicle
+folders) and hold::
+
+    {"path": ..., "schema": ..., "mtime_ns": ..., "size": ..., "snapshot": {...}}
+
+A sidecar is fresh while the workbook's (mtime_ns, size) and the schema tag
+match; ``schema`` changes whenever the extracted cells change, so a new
+cell map invalidates every sidecar at once. Stale or missing sidecars are
+rebuilt on access by ``extract(path)`` and written back atomically. The
+JSON text is also kept in a bounded in-memory LRU; each ``get`` decodes a
+fresh object, so callers can never modify a shared snapshot.
+
+``start`` runs a background pre-parser that walks ``list_workbooks()`` and
+rebuilds stale sidecars through ``warm_extract`` (e.g. the render pool),
+so the first view after a restart or an external edit is already warm;
+the first ``get`` starts it when ``start`` was not called.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from render_pool import PoolSaturated
+from workbook_cache import file_fingerprint
+from workbook_locks import atomic_write_bytes
+
+
+class SnapshotStore:
+    """Sidecar-backed cache of workbook snapshots."""
+
+    def __init__(self, cache_dir, extract, dump, load, schema, warm_extract=None,
+                 list_workbooks=None, max_memory=256, interval=300.0):
+        self.cache_dir = Path(cache_dir)
+        self.extract = extract            # extract(path) -> snapshot (parses the xlsx)
+        self.dump = dump                  # snapshot -> JSON-serialisable dict
+        self.load = load                  # dict -> snapshot
+        self.schema = schema
+        self.warm_extract = warm_extract or extract
+        self.list_workbooks = list_workbooks
+        self.max_memory = max_memory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._mem = OrderedDict()  # path str -> ((mtime_ns, size), json text)
+        self._thread = None
+        self._stop = threading.Event()
+        self.memory_hits = 0
+        self.sidecar_hits = 0
+        self.parses = 0
+        self.warmed = 0
+        self.last_warm = {}
+
+    def _sidecar(self, path) -> Path:
+        return self.cache_dir / f"{hashlib.sha1(str(path).encode('utf-8')).hexdigest()}.json"
+
+    def _remember(self, key, fingerprint, text):
+        with self._lock:
+            self._mem[key] = (fingerprint, text)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_memory:
+                self._mem.popitem(last=False)
+
+    def _read_sidecar(self, path, fingerprint):
+        try:
+            record = json.loads(self._sidecar(path).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if (record.get("schema"), record.get("mtime_ns"), record.get("size")) != \
+                (self.schema, *fingerprint):
+            return None
+        return json.dumps(record["snapshot"], ensure_ascii=False)
+
+    def _build(self, path, fingerprint, extract):
+        snap = extract(path)
+        data = self.dump(snap)
+        record = {"path": str(path), "schema": self.schema, "mtime_ns": fingerprint[0],
+                  "size": fingerprint[1], "built_at": time.time(), "snapshot": data}
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            atomic_write_bytes(self._sidecar(path),
+                               json.dumps(record, ensure_ascii=False).encode("utf-8"))
+        except OSError:
+            pass  # the sidecar is only an optimisation
+        # Re-stat: a write that raced the parse must not be cached as fresh
+        if file_fingerprint(path) == fingerprint:
+            self._remember(str(path), fingerprint, json.dumps(data, ensure_ascii=False))
+        with self._lock:
+            self.parses += 1
+        return snap
+
+    def get(self, path):
+        """The snapshot of path, from memory, its sidecar, or a fresh parse."""
+        if self._thread is None and not self._stop.is_set():
+            self.start()
+        path = Path(path)
+        key = str(path)
+        fingerprint = file_fingerprint(path)
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._mem.move_to_end(key)
+                self.memory_hits += 1
+                return self.load(json.loads(entry[1]))
+        text = self._read_sidecar(path, fingerprint)
+        if text is not None:
+            self._remember(key, fingerprint, text)
+            with self._lock:
+                self.sidecar_hits += 1
+            return self.load(json.loads(text))
+        return self._build(path, fingerprint, self.extract)
+
+    def is_fresh(self, path) -> bool:
+        path = Path(path)
+        fingerprint = file_fingerprint(path)
+        with self._lock:
+            entry = self._mem.get(str(path))
+        if entry is not None and entry[0] == fingerprint:
+            return True
+        return self._read_sidecar(path, fingerprint) is not None
+
+    def invalidate(self, path):
+        """Forget path (call after writing the workbook)."""
+        with self._lock:
+            self._mem.pop(str(path), None)
+        try:
+            os.unlink(self._sidecar(path))
+        except OSError:
+            pass
+
+    # -- background pre-parser ---------------------------------------------
+
+    def warm(self) -> dict:
+        """Rebuild every stale sidecar once. Returns counters."""
+        start = time.monotonic()
+        checked = built = errors = 0
+        for path in self.list_workbooks():
+            if self._stop.is_set():
+                break
+            checked += 1
+            try:
+                if self.is_fresh(path):
+                    continue
+                for _ in range(30):
+                    try:
+                        self._build(Path(path), file_fingerprint(path), self.warm_extract)
+                        break
+                    except PoolSaturated:
+                        time.sleep(1.0)  # interactive work first
+                else:
+                    raise PoolSaturated("render pool stayed saturated")
+                built += 1
+            except Exception:
+                errors += 1
+        with self._lock:
+            self.warmed += built
+        self.last_warm = {"checked": checked, "built": built, "errors": errors,
+                          "seconds": round(time.monotonic() - start, 2),
+                          "finished_at": time.time()}
+        return self.last_warm
+
+    def start(self):
+        """Start the background pre-parser (idempotent, thread-safe)."""
+        if self.list_workbooks is None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="snapshot-warm",
+                                            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.warm()
+            except Exception as e:
+                self.last_warm = {"error": str(e), "finished_at": time.time()}
+            if self._stop.wait(self.interval):
+                return
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_entries": len(self._mem),
+                "memory_hits": self.memory_hits,
+                "sidecar_hits": self.sidecar_hits,
+                "parses": self.parses,
+                "warmed": self.warmed,
+                "last_warm": self.last_warm,
+            }
+
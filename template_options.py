@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Template fingerprints and the classification options (T_13) per template.
+
+Every vehicle workbook is stamped from one of a handful of template
+versions, and the עזר sheet is never edited per vehicle. A template is
+identified by the option texts in column D of that sheet (``HELPER_REFS``):
+``helper_fingerprint`` hashes the resolved strings, not the sheet XML,
+which only holds shared-string indices. So an edited option text gives a
+new fingerprint, while the same options stored in another sharedStrings
+order keep the same one. Layouts (cell_layouts.py) are keyed on it too.
+
+The T_13 options found in that range are kept per fingerprint and shared
+by all vehicles of the template.
+
+Entries are persisted in one small JSON file, so restarts and the render
+worker processes share them. Each process re-reads the file when another
+process has changed it, and merges before writing.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from cell_layouts import HELPER
+from workbook_locks import atomic_write_bytes
+from xlsx_reader import find_sheet_name
+
+# Column D of גיליון עזר: the template's option lists, T_13 among them
+HELPER_REFS = [f"D{r}" for r in range(1, 300)]
+
+
+def helper_fingerprint(ws) -> str:
+    """Hash of the option texts in HELPER_REFS of the עזר sheet ("" if none)."""
+    if ws is None:
+        return ""
+    texts = []
+    for ref in HELPER_REFS:
+        value = ws[ref].value
+        texts.append("" if value is None else str(value).strip())
+    raw = "\n".join(texts).rstrip("\n")
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def read_template(wb):
+    """(fingerprint, עזר sheet or None) of a StreamingWorkbook."""
+    name = find_sheet_name(wb.sheetnames, HELPER)
+    if name is None:
+        return "", None
+    ws = wb.read_sheet(name, HELPER_REFS)
+    return helper_fingerprint(ws), ws
+
+
+class TemplateOptionsCache:
+    """fingerprint -> option list, in memory and in a JSON file."""
+
+    def __init__(self, path, max_entries=64):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}  # fingerprint -> {"options", "used_at"}
+        self._file_mtime = None
+        self.hits = 0
+        self.scans = 0
+
+    def _reload(self):
+        """Pick up entries written by other processes (called with _lock held)."""
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._file_mtime:
+            return
+        try:
+            stored = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        self._file_mtime = mtime
+        for key, entry in stored.items():
+            self._entries.setdefault(key, entry)
+
+    def get(self, fingerprint):
+        """The cached options for fingerprint, or None."""
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                self._reload()
+                entry = self._entries.get(fingerprint)
+            if entry is None:
+                return None
+            self.hits += 1
+            return list(entry["options"])
+
+    def put(self, fingerprint, options, source=""):
+        with self._lock:
+            self._reload()
+            self.scans += 1
+            self._entries[fingerprint] = {"options": list(options), "source": str(source),
+                                          "used_at": time.time()}
+            # Templates are few; drop the least recently scanned beyond the cap
+            while len(self._entries) > self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k].get("used_at", 0))
+                del self._entries[oldest]
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                atomic_write_bytes(self.path, json.dumps(
+                    self._entries, ensure_ascii=False, indent=1).encode("utf-8"))
+                self._file_mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                pass  # still cached in memory
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"templates": len(self._entries), "hits": self.hits, "scans": self.scans}
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import sys
+from pathlib import Path
+
+# The app modules live flat in the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""ArtifactCache: the sidecar index keeps every file, render locks do not pile up."""
+import threading
+
+from artifact_cache import ArtifactCache
+from workbook_locks import WorkbookLocks
+
+
+def test_parallel_writes_keep_every_index_entry(tmp_path):
+    cache = ArtifactCache(WorkbookLocks(tmp_path / "locks"))
+    folder = tmp_path / "v"
+    folder.mkdir()
+    names = [f"a{i}.{kind}" for i in range(20) for kind in ("pdf", "png")]
+    barrier = threading.Barrier(len(names))
+
+    def render(name):
+        barrier.wait()
+        return name.encode()
+
+    threads = [threading.Thread(target=cache.get, args=(folder / n, "d1", lambda n=n: render(n)))
+               for n in names]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert all(cache.is_current(folder / n, "d1") for n in names)
+    assert cache._path_locks == {}
+
+
+def test_disk_hit_then_changed_digest(tmp_path):
+    cache = ArtifactCache(WorkbookLocks(tmp_path / "locks"))
+    path = tmp_path / "v.pdf"
+    assert cache.get(path, "d1", lambda: b"one", remember=False) == b"one"
+    assert cache.get(path, "d1", lambda: b"never", remember=False) == b"one"
+    assert cache.disk_hits == 1
+    assert cache.get(path, "d2", lambda: b"two") == b"two"
+    assert not cache.is_current(path, "d1") and path.read_bytes() == b"two"
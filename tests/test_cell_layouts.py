@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""LayoutRegistry: selection by category and template, layouts.json, N/M fallback."""
+import json
+from dataclasses import asdict
+
+import pytest
+
+from cell_layouts import (
+    EXAMINER, LAYOUT_N, FINDINGS, SECRETARY, Layout, RowBlock, default_registry,
+)
+
+
+def _moved_n(name="N-t1", templates=("t1",)):
+    """layouts.json entry: LAYOUT_N with the license field and notes one row down."""
+    data = asdict(LAYOUT_N)
+    data.update(name=name, categories=list(LAYOUT_N.categories), templates=list(templates))
+    data["examiner"] = dict(data["examiner"], license="E43")
+    data["notes"] = dict(data["notes"], first_row=313, last_row=320)
+    return data
+
+
+@pytest.fixture
+def registry(tmp_path):
+    path = tmp_path / "layouts.json"
+    path.write_text(json.dumps([_moved_n()], ensure_ascii=False), encoding="utf-8")
+    registry = default_registry()
+    registry.load_file(path)
+    return registry
+
+
+def test_defaults_and_fallback():
+    registry = default_registry()
+    assert registry.select("N2").name == registry.select("N3").name == "N"
+    assert registry.select("M1").name == "M"
+    # A category nothing covers reads with the M layout, as the original mapping did
+    assert registry.select("T1").name == "M"
+    assert registry.select("M2").refs("examiner") == []
+
+
+def test_category_of_falls_back_to_baseline_n():
+    registry = default_registry()
+    assert registry.category_of("M1") == "M1"
+    assert registry.category_of("") == "N2"
+    assert registry.category_of(None) == "N2"
+    assert registry.category_of("T1") == "N2"
+    assert registry.select(registry.category_of("T1")).refs("examiner")
+
+
+def test_template_layout_from_file(registry):
+    assert registry.select("N2", "t1").name == "N-t1"
+    assert registry.select("N3", "t1").examiner["license"] == (43, 5)
+    assert registry.select("N2", "other").name == "N"
+    assert registry.select("M1", "t1").name == "M"
+    assert registry.category_of("N2", "t1") == "N2"
+
+
+def test_plan_merges_every_layout_of_the_template(registry):
+    plain, moved = registry.plan(), registry.plan("t1")
+    assert (42, 5) in plain[EXAMINER] and (43, 5) in moved[EXAMINER]
+    assert (320, 4) in moved[EXAMINER] and (320, 4) not in plain[EXAMINER]
+    assert set(plain) == {SECRETARY, EXAMINER, FINDINGS}
+
+
+def test_signature_changes_with_layouts(registry):
+    assert registry.signature() != default_registry().signature()
+    assert default_registry().signature() == default_registry().signature()
+
+
+def test_note_updates_patch_and_bounds():
+    layout = default_registry().select("N2")
+    assert layout.note_updates({"1": {"finding": "x", "doc_required": ""}}, clear=True) == {
+        "D313": "x", "G313": ""}
+    assert layout.note_updates([{"finding": "a"}, {"finding": ""}]) == {"D312": "a"}
+    assert layout.note_updates({"8": {"finding": "out of range"}}) == {}
+
+
+def test_from_dict_round_trip():
+    layout = Layout.from_dict(_moved_n())
+    assert layout.notes == RowBlock(313, 320, LAYOUT_N.notes.columns, "10.{n}")
+    assert layout.categories == ("N2", "N3") and layout.classification == ("E87", "E88")
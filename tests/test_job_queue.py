@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""JobQueue: priority workers, cancel, orphan adoption and waiting across processes."""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from job_queue import CANCELLED, DONE, QUEUED, RUNNING, JobQueue
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db", workers=2, heartbeat_seconds=0.05,
+                     stale_seconds=5.0, poll_seconds=0.02, progress_interval=0)
+    yield queue
+    queue.stop()
+
+
+def _until(job_queue, job_id, states, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    job = job_queue.get(job_id)
+    while job["state"] not in states:
+        assert time.monotonic() < deadline, job
+        job = job_queue.wait(job_id, job["version"], timeout=0.5)
+    return job
+
+
+def _dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def _insert(db_path, job_id, state, owner_pid, heartbeat, cancel_requested=0):
+    with sqlite3.connect(str(db_path)) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, priority, params, state, attempts, done, created_at, "
+            "owner_pid, heartbeat, cancel_requested) VALUES (?, 'add', 5, ?, ?, 0, 0, ?, ?, ?, ?)",
+            (job_id, json.dumps({"a": 1, "b": 2}), state, time.time(), owner_pid, heartbeat,
+             cancel_requested))
+
+
+def _add(ctx, a, b):
+    ctx.progress(1, 1, "adding")
+    return a + b
+
+
+def _spin(ctx, started):
+    started.set()
+    while True:
+        ctx.check()
+        time.sleep(0.01)
+
+
+def test_submit_runs_and_reports(jobs):
+    jobs.register("add", _add)
+    job_id = jobs.submit("add", {"a": 2, "b": 3})
+    job = _until(jobs, job_id, (DONE,))
+    assert job["result"] == 5 and job["done"] == job["total"] == 1
+    stored = jobs._load(job_id)
+    assert stored["state"] == DONE and stored["version"] == job["version"]
+
+
+def test_cancel_queued_and_running(jobs):
+    started = threading.Event()
+    jobs.workers = 1
+    jobs.register("spin", lambda ctx: _spin(ctx, started))
+    running = jobs.submit("spin")
+    queued = jobs.submit("spin")
+    assert started.wait(5)
+    assert jobs.cancel(queued)
+    assert jobs.get(queued)["state"] == CANCELLED
+    assert jobs.cancel(running)
+    assert _until(jobs, running, (CANCELLED,))["state"] == CANCELLED
+    assert not jobs.cancel("missing")
+
+
+def test_retry_then_succeed(jobs):
+    calls = []
+
+    def flaky(ctx):
+        calls.append(1)
+        if len(calls) < 2:
+            raise OSError("busy")
+        return "ok"
+
+    jobs.register("flaky", flaky, retries=1, retry_on=(OSError,), retry_seconds=0.01)
+    job = _until(jobs, jobs.submit("flaky"), (DONE,))
+    assert job["result"] == "ok" and job["attempts"] == 2 and jobs.retried == 1
+
+
+def test_adopts_only_orphans(jobs):
+    jobs._db()
+    now = time.time()
+    dead = _dead_pid()
+    _insert(jobs.db_path, "dead-owner", RUNNING, dead, now)
+    _insert(jobs.db_path, "stale", QUEUED, os.getppid(), now - 60)
+    _insert(jobs.db_path, "alive", RUNNING, os.getppid(), now)
+    _insert(jobs.db_path, "cancelled", RUNNING, dead, now, cancel_requested=1)
+    jobs.register("add", _add)
+    jobs.start()
+
+    assert _until(jobs, "dead-owner", (DONE,))["result"] == 3
+    _until(jobs, "stale", (DONE,))
+    assert jobs._load("stale")["owner_pid"] == os.getpid()
+    assert jobs._load("cancelled")["state"] == CANCELLED
+    time.sleep(0.2)  # a few heartbeats
+    alive = jobs._load("alive")
+    assert alive["state"] == RUNNING and alive["owner_pid"] == os.getppid()
+    assert jobs.adopted == 2
+
+
+_OWNER = textwrap.dedent("""
+    import sys, time
+    sys.path.insert(0, sys.argv[2])
+    from job_queue import JobQueue
+
+    def spin(ctx):
+        n = 0
+        while True:
+            ctx.check()
+            n += 1
+            ctx.progress(n, None)
+            time.sleep(0.02)
+
+    jobs = JobQueue(sys.argv[1], workers=1, heartbeat_seconds=0.05, progress_interval=0)
+    jobs.register("spin", spin)
+    job_id = jobs.submit("spin")
+    print(job_id, flush=True)
+    while jobs.get(job_id)["state"] != "cancelled":
+        time.sleep(0.02)
+    time.sleep(0.2)
+""")
+
+
+def test_wait_and_cancel_across_processes(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    owner = subprocess.Popen([sys.executable, "-c", _OWNER, str(db_path), str(ROOT)],
+                             stdout=subprocess.PIPE, text=True)
+    try:
+        job_id = owner.stdout.readline().strip()
+        jobs = JobQueue(db_path, poll_seconds=0.02)  # never started: nothing is ours
+
+        first = jobs.get(job_id)
+        t0 = time.monotonic()
+        changed = jobs.wait(job_id, first["version"], timeout=5)
+        assert changed["version"] != first["version"]
+        assert time.monotonic() - t0 < 2
+
+        assert jobs.cancel(job_id)
+        job = _until(jobs, job_id, (CANCELLED,))
+        assert job["state"] == CANCELLED
+        assert owner.wait(10) == 0
+
+        t0 = time.monotonic()
+        assert jobs.wait(job_id, job["version"], timeout=0.3)["state"] == CANCELLED
+        assert time.monotonic() - t0 >= 0.3  # finished: no change, waits the timeout out
+    finally:
+        owner.kill()
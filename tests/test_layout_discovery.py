@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""layout_discovery: clustering and moved layouts from synthetic label indexes."""
+from cell_layouts import EXAMINER, SECRETARY, Layout, RowBlock
+from layout_discovery import cluster, compare, moved_layout
+
+LAYOUT = Layout("X", ("N2",), secretary={"license": "D16", "vin": "D25"},
+                examiner={"license": "E42", "vin": "E63"},
+                notes=RowBlock(312, 313, {"finding": "D"}), classification=("E87", "E88"))
+
+# Cluster labels ({token: {label: ref}}), as cluster() returns them
+REFERENCE = {"labels": {
+    SECRETARY: {"מספר רישוי": "B16", "מספר שלדה": "B25"},
+    EXAMINER: {"מספר רישוי": "B42", "מספר שלדה": "B63", "הערות": "B312", "סיווג": "B87"},
+}}
+# The same template with the examiner form three rows further down and the
+# VIN label gone from מזכירה
+OTHER = {"labels": {
+    SECRETARY: {"מספר רישוי": "B16"},
+    EXAMINER: {"מספר רישוי": "B45", "מספר שלדה": "B66", "הערות": "B315", "סיווג": "B90"},
+}}
+
+
+def _index(path, template, labels, error=None):
+    """index_workbook() result for labels given as {token: {label: ref}}."""
+    return {"path": path, "template": template, "error": error,
+            "labels": {t: {label: [ref] for label, ref in found.items()}
+                       for t, found in labels["labels"].items()}}
+
+
+def _by_ref(report):
+    return {(e["token"], e["ref"]): e for e in report}
+
+
+def test_compare_statuses():
+    report = _by_ref(compare([LAYOUT], REFERENCE, OTHER))
+    assert report[(SECRETARY, "D16")]["status"] == "same"
+    assert report[(SECRETARY, "D25")]["status"] == "missing"
+    moved = report[(EXAMINER, "E42")]
+    assert (moved["status"], moved["new_ref"], moved["label"]) == ("moved", "E45", "מספר רישוי")
+    assert report[(EXAMINER, "D312")]["new_ref"] == "D315"
+    # E88 has no label of its own: it follows E87 one row above
+    inferred = report[(EXAMINER, "E88")]
+    assert (inferred["status"], inferred["new_ref"]) == ("inferred", "E91")
+    assert report[(EXAMINER, "E42")]["fields"] == ["X.examiner.license"]
+
+
+def test_moved_layout_applies_moves():
+    data = moved_layout(LAYOUT, compare([LAYOUT], REFERENCE, OTHER), ["t1", "t2"])
+    assert data["name"] == "X-t1" and data["templates"] == ["t1", "t2"]
+    assert data["examiner"] == {"license": "E45", "vin": "E66"}
+    assert data["secretary"] == {"license": "D16", "vin": "D25"}
+    assert (data["notes"]["first_row"], data["notes"]["last_row"]) == (315, 316)
+    assert data["classification"] == ["E90", "E91"]
+    assert Layout.from_dict(data).examiner["license"] == "E45"
+
+
+def test_cluster_groups_templates_with_the_same_labels():
+    indexes = [_index("a.xlsx", "t0", REFERENCE), _index("b.xlsx", "t1", OTHER),
+               _index("c.xlsx", "t2", REFERENCE),
+               _index("d.xlsx", "t1", REFERENCE, error="BadZipFile: x")]
+    clusters = cluster(indexes, support=1.0)
+    assert [c["id"] for c in clusters] == ["L1", "L2"]
+    assert sorted(clusters[0]["templates"]) == ["t0", "t2"]
+    assert clusters[0]["labels"] == REFERENCE["labels"]
+    assert clusters[1]["workbooks"] == ["b.xlsx"]
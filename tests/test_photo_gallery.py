@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Gallery order: EXIF capture time recorded at ingest, mtime as the fallback."""
+import os
+import time
+
+from PIL import Image
+
+from photo_gallery import list_photos
+from photo_ingest import IngestPolicy, process_photo
+from photo_manifest import PhotoManifests, file_sha256
+
+
+def _jpeg(path, taken=None, mtime=None):
+    exif = Image.Exif()
+    if taken:
+        exif.get_ifd(0x8769)[0x9003] = taken
+    Image.new("RGB", (40, 30), "red").save(path, exif=exif.tobytes())
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def _seeded(folder):
+    """PhotoManifests whose manifest for folder has been seeded."""
+    manifests = PhotoManifests()
+    manifests.missing(folder, [])  # starts the background seed
+    deadline = time.monotonic() + 5
+    while manifests.stats()["seeding"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return manifests
+
+
+def test_capture_time_survives_stripping(tmp_path):
+    path = _jpeg(tmp_path / "a.jpg", "2021:05:06 07:08:09")
+    kept = process_photo(path, IngestPolicy(strip_metadata=False))
+    assert kept["tmp"] is None and kept["captured"]
+    stripped = process_photo(path, IngestPolicy())
+    assert stripped["captured"] == kept["captured"]
+    with Image.open(stripped["tmp"]) as img:
+        assert not img.getexif().get_ifd(0x8769)
+
+
+def test_sorted_by_capture_time_then_mtime(tmp_path):
+    _jpeg(tmp_path / "old_capture.jpg", "2020:01:01 10:00:00", mtime=2_000_000_000)
+    _jpeg(tmp_path / "new_capture.jpg", "2022:01:01 10:00:00", mtime=1_000_000_000)
+    _jpeg(tmp_path / "no_exif.jpg", mtime=1_600_000_000)  # 2020-09
+    manifests = _seeded(tmp_path)
+    captured = manifests.captured(tmp_path)
+    assert set(captured) == {"old_capture.jpg", "new_capture.jpg"}
+    names = [p["name"] for p in list_photos(tmp_path, captured)]
+    assert names == ["new_capture.jpg", "no_exif.jpg", "old_capture.jpg"]
+    # Without capture times the mtime decides
+    assert [p["name"] for p in list_photos(tmp_path)][0] == "old_capture.jpg"
+
+
+def test_ingest_records_capture_time_in_manifest(tmp_path):
+    manifests = _seeded(tmp_path)
+    upload = _jpeg(tmp_path / ".upload.jpg", "2023:03:04 05:06:07")
+    sha = file_sha256(upload)
+    path, _ = manifests.commit(tmp_path, upload, sha, tmp_path / "p.jpg", "p")
+    result = process_photo(path, IngestPolicy())
+    new = manifests.replace_file(tmp_path, path, result["tmp"], path.with_suffix(result["suffix"]),
+                                 captured=result["captured"])
+    assert manifests.captured(tmp_path) == {new.name: result["captured"]}
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""render_fonts: PDFs built on cloned fonts must carry the right text."""
+import io
+
+import pytest
+from fpdf import FPDF
+
+from render_fonts import FontRegistry
+
+pypdf = pytest.importorskip("pypdf")
+
+HEBREW = "חוסרים בבדיקה 12"
+
+
+def _build_font(path):
+    """A minimal TrueType font with box glyphs for Hebrew, digits and space."""
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    chars = [0x20, *range(0x30, 0x3A), *range(0x5D0, 0x5EB), *range(0x410, 0x450)]
+    names = [".notdef"] + [f"uni{c:04X}" for c in chars]
+
+    def box():
+        pen = TTGlyphPen(None)
+        pen.moveTo((50, 0))
+        pen.lineTo((50, 600))
+        pen.lineTo((450, 600))
+        pen.lineTo((450, 0))
+        pen.closePath()
+        return pen.glyph()
+
+    fb = FontBuilder(1000, isTTF=True)
+    fb.setupGlyphOrder(names)
+    fb.setupCharacterMap({c: f"uni{c:04X}" for c in chars})
+    fb.setupGlyf({n: box() for n in names})
+    fb.setupHorizontalMetrics({n: (500, 50) for n in names})
+    fb.setupHorizontalHeader(ascent=800, descent=-200)
+    fb.setupNameTable({"familyName": "Test Hebrew", "styleName": "Regular"})
+    fb.setupOS2(sTypoAscender=800, usWinAscent=800, usWinDescent=200)
+    fb.setupPost()
+    fb.save(str(path))
+
+
+@pytest.fixture
+def registry(tmp_path):
+    fonts = tmp_path / "fonts"
+    fonts.mkdir()
+    _build_font(fonts / "DejaVuSans.ttf")
+    _build_font(fonts / "DejaVuSans-Bold.ttf")
+    return FontRegistry([fonts], cache_dir=tmp_path / "cache")
+
+
+def _render(registry, text):
+    pdf = FPDF()
+    registry.add_pdf_fonts(pdf)
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(0, 10, text)
+    pdf.ln()
+    pdf.set_font("Arial", "", 12)
+    pdf.cell(0, 10, text)
+    reader = pypdf.PdfReader(io.BytesIO(bytes(pdf.output())))
+    return reader.pages[0].extract_text()
+
+
+def _plain(registry, text):
+    pdf = FPDF()
+    for style in ("", "B"):
+        pdf.add_font("Arial", style, str(registry._subset_path(style)))
+    pdf.add_page()
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(0, 10, text)
+    pdf.ln()
+    pdf.set_font("Arial", "", 12)
+    pdf.cell(0, 10, text)
+    reader = pypdf.PdfReader(io.BytesIO(bytes(pdf.output())))
+    return reader.pages[0].extract_text()
+
+
+def test_cloned_font_renders_hebrew(registry):
+    assert registry.can_clone()
+    first = _render(registry, HEBREW)
+    # A second document must not inherit the first one's subset state
+    second = _render(registry, "שלום 34")
+    assert registry.stats()["pdf_reused"] == 4
+    assert registry.stats()["pdf_fallbacks"] == 0
+
+    assert first == _plain(registry, HEBREW)
+    assert second == _plain(registry, "שלום 34")
+    for word in HEBREW.split():
+        assert word in first or word[::-1] in first
+
+
+def test_unknown_fpdf_version_uses_add_font(registry):
+    registry._can_clone = False
+    text = _render(registry, HEBREW)
+    assert registry.stats()["pdf_fallbacks"] == 2
+    assert text == _plain(registry, HEBREW)
+
+
+def test_text_outside_render_set_uses_full_font(registry):
+    text = "Жук 12"  # Cyrillic: cut from the render subset, present in the font
+    # Without the texts the cut-down font is used and the glyphs are lost
+    assert "Жук" not in _render(registry, text)
+    pdf = FPDF()
+    registry.add_pdf_fonts(pdf, [HEBREW, text])
+    pdf.add_page()
+    pdf.set_font("Arial", "", 12)
+    pdf.cell(0, 10, text)
+    extracted = pypdf.PdfReader(io.BytesIO(bytes(pdf.output()))).pages[0].extract_text()
+    assert "Жук" in extracted
+    assert registry.stats()["pdf_full"] == 2
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""SaveJournal: journaled edits must end up in the xlsx, exactly once."""
+import json
+import zipfile
+
+import openpyxl
+import pytest
+
+import xlsx_writer
+from save_journal import SaveJournal
+from workbook_locks import WorkbookLocks
+
+SHEET = "בוחן"
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = tmp_path / "v" / "v.xlsx"
+    path.parent.mkdir()
+    wb = openpyxl.Workbook()
+    wb.active.title = SHEET
+    wb.active["E42"] = "old"
+    wb.save(path)
+    return path
+
+
+class Writer:
+    """write_fn recording every call."""
+
+    def __init__(self, fail=0):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, path, updates):
+        self.calls.append(dict(updates))
+        if self.fail:
+            self.fail -= 1
+            raise OSError("share unavailable")
+        return xlsx_writer.write_cells(path, SHEET, updates)
+
+
+def _journal(tmp_path, writer, **kwargs):
+    return SaveJournal(tmp_path / "journal", writer, WorkbookLocks(tmp_path / "locks"),
+                       **kwargs)
+
+
+def _idle(journal):
+    """Act as if the flusher thread runs but never fires: appends stay journaled."""
+    journal._thread = object()
+    return journal
+
+
+def _sheet_xml(path) -> bytes:
+    with zipfile.ZipFile(path) as zf:
+        return zf.read("xl/worksheets/sheet1.xml")
+
+
+def _value(path, ref):
+    return openpyxl.load_workbook(path)[SHEET][ref].value
+
+
+def test_pending_merges_newer_over_older(tmp_path, workbook):
+    journal = _idle(_journal(tmp_path, Writer()))
+    journal.append(workbook, {"E42": "a", "E43": "x"})
+    journal.append(workbook, {"E42": "b"})
+    assert journal.pending(workbook) == {"E42": "b", "E43": "x"}
+    # Another process sees the same edits through the files
+    other = _journal(tmp_path, Writer())
+    assert other.pending(workbook) == {"E42": "b", "E43": "x"}
+    assert _value(workbook, "E42") == "old"
+
+
+def test_coalesced_flush_writes_once(tmp_path, workbook):
+    writer = Writer()
+    journal = _idle(_journal(tmp_path, writer))
+    for i in range(5):
+        journal.append(workbook, {"E42": f"v{i}", f"E{50 + i}": i})
+    journal.flush(workbook)
+    assert len(writer.calls) == 1
+    assert writer.calls[0]["E42"] == "v4"
+    assert b'<c r="E42" t="inlineStr"><is><t xml:space="preserve">v4</t></is></c>' \
+        in _sheet_xml(workbook)
+    assert _value(workbook, "E54") == 4
+    assert journal.pending(workbook) == {}
+    assert not list((tmp_path / "journal").glob("*.jsonl"))
+
+
+def test_replay_after_crash(tmp_path, workbook):
+    crashed = _idle(_journal(tmp_path, Writer()))  # dies before its flusher fires
+    crashed.append(workbook, {"E42": "saved before crash"})
+    assert _value(workbook, "E42") == "old"
+
+    writer = Writer()
+    restarted = _journal(tmp_path, writer, idle_seconds=0.05)
+    restarted.start()
+    restarted.stop()
+    assert writer.calls == [{"E42": "saved before crash"}]
+    assert b"saved before crash" in _sheet_xml(workbook)
+    assert restarted.stats()["adopted"] == 1
+
+
+def test_torn_last_line_is_ignored(tmp_path, workbook):
+    journal = _idle(_journal(tmp_path, Writer()))
+    journal.append(workbook, {"E42": "kept"})
+    file = next((tmp_path / "journal").glob("*.jsonl"))
+    with open(file, "a", encoding="utf-8") as fh:
+        fh.write('{"path": "x", "updates": {"E42": "to')
+    assert journal.pending(workbook) == {"E42": "kept"}
+    journal.flush(workbook)
+    assert _value(workbook, "E42") == "kept"
+
+
+def test_flush_waits_for_other_process_lock(tmp_path, workbook):
+    writer = Writer()
+    journal = _idle(_journal(tmp_path, writer))
+    journal.append(workbook, {"E42": "mine"})
+    # A second WorkbookLocks opens its own lock file handle, as another
+    # worker process would, so the OS file lock conflicts
+    other = WorkbookLocks(tmp_path / "locks")
+    flush_lock = journal._journal_file(str(workbook), ".flush")
+    with other.lock(flush_lock):
+        journal.flush(workbook, wait=0)
+        assert writer.calls == []
+        assert journal.pending(workbook) == {"E42": "mine"}
+        # Appends still go through while the other process flushes
+        journal.append(workbook, {"E43": "later"})
+    journal.flush(workbook, wait=0)
+    assert writer.calls == [{"E42": "mine", "E43": "later"}]
+    assert _value(workbook, "E42") == "mine"
+    assert _value(workbook, "E43") == "later"
+
+
+def test_failed_write_keeps_records_for_retry(tmp_path, workbook):
+    writer = Writer(fail=1)
+    journal = _idle(_journal(tmp_path, writer))
+    journal.append(workbook, {"E42": "first"})
+    journal.flush(workbook)
+    assert journal.stats()["failures"] == 1
+    journal.append(workbook, {"E43": "second"})
+    assert journal.pending(workbook) == {"E42": "first", "E43": "second"}
+    journal.flush(workbook)
+    assert writer.calls[-1] == {"E42": "first", "E43": "second"}
+    assert _value(workbook, "E42") == "first"
+    assert journal.pending(workbook) == {}
+
+
+def test_append_after_stop_writes_synchronously(tmp_path, workbook):
+    journal = _journal(tmp_path, Writer())
+    journal.start()
+    journal.stop()
+    journal.append(workbook, {"E42": "at shutdown"})
+    assert _value(workbook, "E42") == "at shutdown"
+    with journal.locked(workbook) as view:
+        view.append({"E43": "locked"})
+    assert _value(workbook, "E43") == "locked"
+    assert json.dumps(journal.pending(workbook)) == "{}"
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Template fingerprint: the עזר option texts, not their shared-string indices."""
+import openpyxl
+
+from template_options import read_template
+from xlsx_reader import StreamingWorkbook
+
+OPTIONS = ["T_13", "רכב פרטי", "רכב מסחרי", "אוטובוס", "משאית"]
+
+
+def _workbook(path, options, other_strings=()):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "מזכירה"
+    # Strings seen first get the low shared-string indices
+    for row, text in enumerate(other_strings, start=1):
+        ws.cell(row=row, column=1, value=text)
+    helper = wb.create_sheet("גיליון עזר")
+    for row, text in enumerate(options, start=100):
+        helper.cell(row=row, column=4, value=text)
+    wb.save(path)
+    return path
+
+
+def _fingerprint(path):
+    with StreamingWorkbook(path) as wb:
+        return read_template(wb)[0]
+
+
+def test_same_options_any_string_order(tmp_path):
+    a = _workbook(tmp_path / "a.xlsx", OPTIONS)
+    b = _workbook(tmp_path / "b.xlsx", OPTIONS, other_strings=["12-345-67", "VIN1", "משאית"])
+    assert _fingerprint(a) == _fingerprint(b) != ""
+
+
+def test_edited_option_text_changes_fingerprint(tmp_path):
+    a = _workbook(tmp_path / "a.xlsx", OPTIONS)
+    b = _workbook(tmp_path / "b.xlsx", OPTIONS[:-1] + ["משאית כבדה"])
+    assert _fingerprint(a) != _fingerprint(b)
+
+
+def test_no_helper_sheet(tmp_path):
+    path = tmp_path / "a.xlsx"
+    openpyxl.Workbook().save(path)
+    assert _fingerprint(path) == ""
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Resumable uploads end in one verified photo; duplicates return the existing one."""
+import hashlib
+import io
+import time
+
+import pytest
+
+from photo_manifest import PhotoManifests
+from upload_sessions import UploadError, UploadSessions
+
+CHUNK = 16
+PHOTO = bytes(range(256)) * 2 + b"tail"  # 516 bytes: 32 full chunks and a short one
+
+
+def _sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _chunk(data, i):
+    return io.BytesIO(data[i * CHUNK:(i + 1) * CHUNK])
+
+
+@pytest.fixture
+def sessions():
+    return UploadSessions(chunk_size=CHUNK, max_size=4096)
+
+
+def _seeded(folder):
+    manifests = PhotoManifests()
+    manifests.missing(folder, [])  # starts the background seed of the empty folder
+    deadline = time.monotonic() + 5
+    while manifests.stats()["seeding"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return manifests
+
+
+def test_out_of_order_and_duplicate_chunks(sessions, tmp_path):
+    session = sessions.create(tmp_path, "front", len(PHOTO), "jpg", _sha(PHOTO))
+    total = session["chunks"]
+    assert total == 33 and session["missing"] == list(range(total))
+    order = list(range(total - 2, 0, -2)) + list(range(0, total, 2))  # odd backwards, then even
+    for i in order + [3, 32, 0]:  # and a few duplicates
+        info = sessions.write_chunk(tmp_path, session["id"], i, _chunk(PHOTO, i))
+    assert info["missing"] == [] and info["received"] == [[0, len(PHOTO)]]
+    part, meta = sessions.finalize(tmp_path, session["id"])
+    assert part.read_bytes() == PHOTO and meta["computed_sha256"] == _sha(PHOTO)
+
+
+def test_resume_after_restart(sessions, tmp_path):
+    session = sessions.create(tmp_path, "front", len(PHOTO), "jpg")
+    for i in (0, 1, 5):
+        sessions.write_chunk(tmp_path, session["id"], i, _chunk(PHOTO, i))
+    restarted = UploadSessions(chunk_size=CHUNK)
+    status = restarted.status(tmp_path, session["id"])
+    assert status["received"] == [[0, 2 * CHUNK], [5 * CHUNK, 6 * CHUNK]]
+    assert status["next_offset"] == 2 * CHUNK
+    with pytest.raises(UploadError) as err:
+        restarted.finalize(tmp_path, session["id"])
+    assert err.value.status == 409
+    for i in status["missing"]:
+        restarted.write_chunk(tmp_path, session["id"], i, _chunk(PHOTO, i))
+    assert restarted.finalize(tmp_path, session["id"])[0].read_bytes() == PHOTO
+
+
+def test_bad_chunks_are_rejected(sessions, tmp_path):
+    session = sessions.create(tmp_path, "front", len(PHOTO), "jpg")
+    with pytest.raises(UploadError) as err:
+        sessions.write_chunk(tmp_path, session["id"], 33, io.BytesIO(b"x"))
+    assert err.value.status == 416
+    with pytest.raises(UploadError) as err:
+        sessions.write_chunk(tmp_path, session["id"], 0, io.BytesIO(b"short"))
+    assert err.value.status == 400
+    with pytest.raises(UploadError) as err:
+        sessions.status(tmp_path, "../" + session["id"])
+    assert err.value.status == 400
+
+
+def test_hash_mismatch_starts_over(sessions, tmp_path):
+    session = sessions.create(tmp_path, "front", len(PHOTO), "jpg", _sha(b"something else"))
+    for i in range(session["chunks"]):
+        sessions.write_chunk(tmp_path, session["id"], i, _chunk(PHOTO, i))
+    with pytest.raises(UploadError) as err:
+        sessions.finalize(tmp_path, session["id"])
+    assert err.value.status == 422
+    assert len(sessions.status(tmp_path, session["id"])["missing"]) == session["chunks"]
+
+
+def test_duplicate_upload_returns_existing_photo(sessions, tmp_path):
+    manifests = _seeded(tmp_path)
+    stored = []
+    for attempt in range(2):
+        session = sessions.create(tmp_path, "front", len(PHOTO), "jpg", _sha(PHOTO))
+        for i in range(session["chunks"]):
+            sessions.write_chunk(tmp_path, session["id"], i, _chunk(PHOTO, i))
+        part, meta = sessions.finalize(tmp_path, session["id"])
+        stored.append(manifests.commit(tmp_path, part, meta["computed_sha256"],
+                                       tmp_path / f"front_{attempt}.jpg", "front"))
+        sessions.discard(tmp_path, session["id"])
+
+    (first, first_dup), (second, second_dup) = stored
+    assert not first_dup and second_dup and second == first
+    assert not (tmp_path / "front_1.jpg").exists()
+    assert manifests.lookup(tmp_path, _sha(PHOTO)) == first
+    assert manifests.missing(tmp_path, [_sha(PHOTO), _sha(b"new")]) == [_sha(b"new")]
+    assert manifests.stats()["duplicates"] == 1
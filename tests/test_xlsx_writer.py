@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""xlsx_writer: surgical patches must round-trip through openpyxl."""
+import zipfile
+
+import openpyxl
+import pytest
+
+import xlsx_writer
+from xlsx_writer import UnsupportedWorkbook, patch_sheet_xml, write_cells
+
+SHEET = "בוחן"
+
+
+def _sheet(rows: bytes) -> bytes:
+    return (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            b'<dimension ref="A1:C3"/>' + rows + b'</worksheet>')
+
+
+def _reload(path):
+    wb = openpyxl.load_workbook(path)
+    return wb[SHEET]
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = tmp_path / "wb.xlsx"
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = SHEET
+    ws["B2"] = "old"
+    ws["D2"] = 4
+    ws["A5"] = "keep"
+    other = wb.create_sheet("מזכיר")
+    other["A1"] = "secretary"
+    wb.save(path)
+    return path
+
+
+def test_openpyxl_round_trip(workbook):
+    assert write_cells(workbook, SHEET, {"B2": "חדש", "D2": 7.5, "F9": True})
+    ws = _reload(workbook)
+    assert ws["B2"].value == "חדש"
+    assert ws["D2"].value == 7.5
+    assert ws["F9"].value is True
+    assert ws["A5"].value == "keep"
+    assert openpyxl.load_workbook(workbook)["מזכיר"]["A1"].value == "secretary"
+    with zipfile.ZipFile(workbook) as zf:
+        assert zf.testzip() is None
+
+
+def test_insert_before_and_after_existing_cells(workbook):
+    write_cells(workbook, SHEET, {"A2": "first", "C2": "middle", "E2": "last",
+                                  "A1": "new row before", "A9": "new row after"})
+    ws = _reload(workbook)
+    assert [c.value for c in ws[2]][:5] == ["first", "old", "middle", 4, "last"]
+    assert ws["A1"].value == "new row before"
+    assert ws["A9"].value == "new row after"
+
+
+def test_clear_cell(workbook):
+    write_cells(workbook, SHEET, {"B2": ""})
+    assert _reload(workbook)["B2"].value is None
+
+
+def test_self_closing_row():
+    xml, _ = patch_sheet_xml(_sheet(b'<sheetData><row r="2" spans="1:3"/></sheetData>'),
+                             {"B2": "x"})
+    assert b'<row r="2"><c r="B2" t="inlineStr">' in xml
+
+
+def test_empty_sheet_data():
+    xml, _ = patch_sheet_xml(_sheet(b'<sheetData/>'), {"A1": 1})
+    assert b'<sheetData><row r="1"><c r="A1"><v>1</v></c></row></sheetData>' in xml
+
+
+def test_formula_overwrite_reports_hit():
+    rows = b'<sheetData><row r="1"><c r="A1"><f>B1*2</f><v>4</v></c></row></sheetData>'
+    xml, formula_hit = patch_sheet_xml(_sheet(rows), {"A1": 3})
+    assert formula_hit
+    assert b"<f>" not in xml
+
+
+def test_formula_overwrite_round_trip(workbook):
+    wb = openpyxl.load_workbook(workbook)
+    wb[SHEET]["C3"] = "=D2*2"
+    wb.save(workbook)
+    write_cells(workbook, SHEET, {"C3": 5})
+    assert _reload(workbook)["C3"].value == 5
+    with zipfile.ZipFile(workbook) as zf:
+        assert b'fullCalcOnLoad="1"' in zf.read("xl/workbook.xml")
+
+
+def test_shared_formula_master_is_unsupported():
+    rows = (b'<sheetData><row r="1">'
+            b'<c r="A1"><f t="shared" ref="A1:A2" si="0">B1*2</f><v>2</v></c></row>'
+            b'<row r="2"><c r="A2"><f t="shared" si="0"/><v>4</v></c></row></sheetData>')
+    with pytest.raises(UnsupportedWorkbook):
+        patch_sheet_xml(_sheet(rows), {"A1": 1})
+    # A dependent carries no range and can be overwritten on its own
+    xml, formula_hit = patch_sheet_xml(_sheet(rows), {"A2": 1})
+    assert formula_hit and b'<c r="A2"><v>1</v></c>' in xml
+
+
+def test_cells_without_ref_are_unsupported():
+    rows = b'<sheetData><row r="1"><c><v>1</v></c><c><v>2</v></c></row></sheetData>'
+    with pytest.raises(UnsupportedWorkbook):
+        patch_sheet_xml(_sheet(rows), {"B1": 5})
+    with pytest.raises(UnsupportedWorkbook):
+        patch_sheet_xml(_sheet(b'<sheetData><row><c r="A1"/></row></sheetData>'),
+                        {"A1": 5})
+
+
+def test_missing_sheet(workbook):
+    assert write_cells(workbook, "לא קיים", {"A1": 1}) is False
+    assert xlsx_writer.write_cells(workbook, SHEET, {}) is True
+
+
+def _records(path) -> dict:
+    """name -> local record bytes (header, data, descriptor) as stored in the file."""
+    data = path.read_bytes()
+    end = data.rfind(b"PK\x05\x06")
+    central = int.from_bytes(data[end + 16:end + 20], "little")
+    with zipfile.ZipFile(path) as zf:
+        infos = sorted(zf.infolist(), key=lambda i: i.header_offset)
+    bounds = [i.header_offset for i in infos] + [central]
+    return {info.filename: data[start:stop]
+            for info, start, stop in zip(infos, bounds, bounds[1:])}
+
+
+def _sheet_part(path, token=SHEET):
+    with zipfile.ZipFile(path) as zf:
+        parts, _ = xlsx_writer.read_sheet_parts(zf)
+    return parts[xlsx_writer.find_sheet_name(parts, token)]
+
+
+def test_untouched_members_are_copied_byte_for_byte(workbook):
+    before = _records(workbook)
+    write_cells(workbook, SHEET, {"B2": "new"})
+    after = _records(workbook)
+    sheet = _sheet_part(workbook)
+    assert set(before) == set(after)
+    # openpyxl already sets fullCalcOnLoad: only the sheet is rewritten
+    for name in set(before) - {sheet}:
+        assert after[name] == before[name], name
+    assert after[sheet] != before[sheet]
+
+
+def test_members_with_data_descriptors(workbook, tmp_path):
+    # Written to an unseekable stream, every member gets a data descriptor
+    streamed = tmp_path / "streamed.xlsx"
+
+    class Unseekable:
+        def __init__(self, fh):
+            self.fh = fh
+
+        def write(self, b):
+            return self.fh.write(b)
+
+        def flush(self):
+            self.fh.flush()
+
+    with zipfile.ZipFile(workbook) as zin, open(streamed, "wb") as fh:
+        with zipfile.ZipFile(Unseekable(fh), "w", zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                zout.writestr(info.filename, zin.read(info))
+    with zipfile.ZipFile(streamed) as zf:
+        assert all(i.flag_bits & 0x08 for i in zf.infolist())
+
+    before = _records(streamed)
+    write_cells(streamed, SHEET, {"B2": "new"})
+    after = _records(streamed)
+    assert after["xl/styles.xml"] == before["xl/styles.xml"]
+    with zipfile.ZipFile(streamed) as zf:
+        assert zf.testzip() is None
+    assert _reload(streamed)["B2"].value == "new"
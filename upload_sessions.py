@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Resumable chunked photo uploads.
+
+A session is created with the final size (and, when the client can compute
+it, the SHA-256 of the photo). The client then PUTs numbered chunks of
+``chunk_size`` bytes in any order, can ask which byte ranges have arrived,
+and finalizes once everything is there. Partial data lives under the
+vehicle folder (``תמונות/.uploads/<id>/``) so it survives server restarts;
+a dropped connection only costs the chunk that was in flight.
+
+On finalize the assembled file is hashed, compared with the declared hash
+and handed back to the caller to be moved into תמונות.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+UPLOADS_DIRNAME = ".uploads"
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """Client-visible upload failure; status is the HTTP status to return."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _ranges(chunks, chunk_size, size):
+    """Received chunk indices -> merged [start, end) byte ranges."""
+    ranges = []
+    for i in sorted(chunks):
+        start, end = i * chunk_size, min((i + 1) * chunk_size, size)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+class UploadSessions:
+    """File-backed upload sessions, one directory per session."""
+
+    def __init__(self, chunk_size=256 * 1024, max_size=50 * 1024 * 1024,
+                 max_age=7 * 24 * 3600):
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self._guard = threading.Lock()
+        self._locks = {}  # session id -> threading.Lock
+
+    def _lock(self, session_id):
+        with self._guard:
+            return self._locks.setdefault(session_id, threading.Lock())
+
+    def _session_dir(self, photos_dir, session_id):
+        if not _ID_RE.match(session_id or ""):
+            raise UploadError("מזהה העלאה לא תקין", 400)
+        d = Path(photos_dir) / UPLOADS_DIRNAME / session_id
+        if not d.is_dir():
+            raise UploadError("העלאה לא נמצאה", 404)
+        return d
+
+    @staticmethod
+    def _read_meta(session_dir):
+        return json.loads((session_dir / "meta.json").read_text(encoding="utf-8"))
+
+    @staticmethod
+    def _write_meta(session_dir, meta):
+        tmp = session_dir / "meta.json.tmp"
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, session_dir / "meta.json")
+
+    def _describe(self, session_id, meta) -> dict:
+        total = (meta["size"] + meta["chunk_size"] - 1) // meta["chunk_size"]
+        received = set(meta["chunks"])
+        missing = [i for i in range(total) if i not in received]
+        return {
+            "id": session_id,
+            "size": meta["size"],
+            "chunk_size": meta["chunk_size"],
+            "chunks": total,
+            "received": _ranges(received, meta["chunk_size"], meta["size"]),
+            "missing": missing,
+            "next_offset": missing[0] * meta["chunk_size"] if missing else meta["size"],
+        }
+
+    def cleanup(self, photos_dir):
+        """Delete sessions in photos_dir untouched for longer than max_age."""
+        root = Path(photos_dir) / UPLOADS_DIRNAME
+        if not root.is_dir():
+            return
+        cutoff = time.time() - self.max_age
+        for d in root.iterdir():
+            try:
+                if d.stat().st_mtime < cutoff:
+                    shutil.rmtree(d, ignore_errors=True)
+            except OSError:
+                pass
+
+    def create(self, photos_dir, key, size, ext, sha256=None) -> dict:
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("גודל קובץ לא תקין", 400)
+        if size > self.max_size:
+            raise UploadError("הקובץ גדול מדי", 413)
+        if sha256 is not None and not re.fullmatch(r"[0-9a-f]{64}", sha256):
+            raise UploadError("sha256 לא תקין", 400)
+        self.cleanup(photos_dir)
+        session_id = uuid.uuid4().hex
+        d = Path(photos_dir) / UPLOADS_DIRNAME / session_id
+        d.mkdir(parents=True)
+        with open(d / "data.part", "wb") as fh:
+            fh.truncate(size)
+        meta = {
+            "key": key, "ext": ext, "size": size, "sha256": sha256,
+            "chunk_size": self.chunk_size, "chunks": [], "created": time.time(),
+        }
+        self._write_meta(d, meta)
+        return self._describe(session_id, meta)
+
+    def status(self, photos_dir, session_id) -> dict:
+        d = self._session_dir(photos_dir, session_id)
+        return self._describe(session_id, self._read_meta(d))
+
+    def write_chunk(self, photos_dir, session_id, index, stream) -> dict:
+        """Store chunk number index from stream (must be exactly chunk-sized)."""
+        d = self._session_dir(photos_dir, session_id)
+        with self._lock(session_id):
+            meta = self._read_meta(d)
+            chunk_size, size = meta["chunk_size"], meta["size"]
+            start = index * chunk_size
+            if index < 0 or start >= size:
+                raise UploadError("מספר מקטע מחוץ לטווח", 416)
+            expected = min(chunk_size, size - start)
+            data = stream.read(expected + 1)
+            if len(data) != expected:
+                raise UploadError(f"גודל מקטע שגוי: {len(data)} במקום {expected}", 400)
+            with open(d / "data.part", "r+b") as fh:
+                fh.seek(start)
+                fh.write(data)
+                fh.flush()
+                os.fsync(fh.fileno())
+            if index not in meta["chunks"]:
+                meta["chunks"].append(index)
+                self._write_meta(d, meta)
+            return self._describe(session_id, meta)
+
+    def finalize(self, photos_dir, session_id):
+        """Verify the upload; returns (part path, meta). Caller moves the file."""
+        d = self._session_dir(photos_dir, session_id)
+        with self._lock(session_id):
+            meta = self._read_meta(d)
+            info = self._describe(session_id, meta)
+            if info["missing"]:
+                raise UploadError("ההעלאה לא הושלמה", 409)
+            digest = hashlib.sha256()
+            with open(d / "data.part", "rb") as fh:
+                for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            meta["computed_sha256"] = digest.hexdigest()
+            if meta["sha256"] and meta["sha256"] != meta["computed_sha256"]:
+                # Corrupt assembly: start over rather than keep bad chunks
+                meta["chunks"] = []
+                self._write_meta(d, meta)
+                raise UploadError("אימות hash נכשל, יש לשלוח מחדש", 422)
+            return d / "data.part", meta
+
+    def discard(self, photos_dir, session_id):
+        d = Path(photos_dir) / UPLOADS_DIRNAME / session_id
+        shutil.rmtree(d, ignore_errors=True)
+        with self._guard:
+            self._locks.pop(session_id, None)
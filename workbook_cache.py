@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Process-wide LRU cache of loaded openpyxl workbooks.
+
+Entries are keyed on the resolved path plus the file fingerprint
+(mtime_ns, size), so a workbook changed on disk by anyone is reloaded on the
+next access. Our own writers call ``invalidate`` after saving because mtime
+resolution on network shares can be too coarse to notice a quick rewrite.
+
+Loads on a miss go through the optional ``admit`` hook (the memory budget in
+admission.py); hits never wait.
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from pathlib import Path
+
+import openpyxl
+
+# Rough ratio between the xlsx size on disk and the memory openpyxl needs for
+# the loaded object model. Used to charge entries against the byte budget.
+MEMORY_FACTOR = 20
+
+
+def file_fingerprint(path) -> tuple:
+    """Return (mtime_ns, size) for a file, the cache validity token."""
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+class WorkbookCache:
+    """LRU cache of workbooks bounded by entry count and estimated bytes."""
+
+    def __init__(self, max_entries=32, max_bytes=1024 * 1024 * 1024, admit=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.admit = admit  # admit(file size) -> context manager around a load
+        self._entries = OrderedDict()  # key -> (fingerprint, workbook, cost)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> threading.Event, single-flight loads
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(path, data_only):
+        return (str(Path(path).resolve()), bool(data_only))
+
+    def get(self, path, data_only=True):
+        """Return a loaded workbook for path, loading it on a miss.
+
+        Cached workbooks are shared between requests and must be treated as
+        read-only; never save or close them.
+        """
+        key = self._key(path, data_only)
+        while True:
+            fingerprint = file_fingerprint(path)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == fingerprint:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                pending = self._loading.get(key)
+                if pending is None:
+                    pending = threading.Event()
+                    self._loading[key] = pending
+                    self.misses += 1
+                    break
+            # Another thread is parsing the same file; wait and re-check
+            pending.wait()
+
+        try:
+            with self.admit(fingerprint[1]) if self.admit else nullcontext():
+                wb = openpyxl.load_workbook(str(path), data_only=data_only)
+            # Re-stat so a write racing the load is caught on the next access
+            if file_fingerprint(path) == fingerprint:
+                self._store(key, fingerprint, wb, fingerprint[1] * MEMORY_FACTOR)
+            return wb
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            pending.set()
+
+    def _store(self, key, fingerprint, wb, cost):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if cost > self.max_bytes:
+                return
+            self._entries[key] = (fingerprint, wb, cost)
+            self._bytes += cost
+            while (len(self._entries) > self.max_entries
+                   or self._bytes > self.max_bytes):
+                _, (_, _, evicted_cost) = self._entries.popitem(last=False)
+                self._bytes -= evicted_cost
+                self.evictions += 1
+
+    def invalidate(self, path):
+        """Drop every cached variant of path (call after writing the file)."""
+        resolved = str(Path(path).resolve())
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == resolved]:
+                _, _, cost = self._entries.pop(key)
+                self._bytes -= cost
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Per-vehicle writer locks and atomic file replacement.
+
+Writers to the same vehicle folder are serialised; different vehicles save
+fully in parallel. Each lock is a threading.Lock for the threads of this
+process plus an OS file lock (fcntl / msvcrt) on a lock file in lock_dir, so
+it also holds across worker processes on the same host.
+
+Readers never take these locks: every write goes to a temp file that is
+swapped in with os.replace, so a reader always opens the last committed file.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class LockTimeout(TimeoutError):
+    """A writer lock could not be acquired within the timeout."""
+
+
+def _try_lock_file(fh) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock_file(fh):
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    else:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write_bytes(path, data: bytes):
+    """Write data to a temp file beside path, fsync, then os.replace it in."""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=".~", suffix=path.suffix + ".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        if path.exists():
+            try:
+                os.chmod(tmp, path.stat().st_mode)
+            except OSError:
+                pass
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+class WorkbookLocks:
+    """Registry of per-vehicle writer locks with contention metrics."""
+
+    def __init__(self, lock_dir, poll_interval=0.05):
+        self.lock_dir = Path(lock_dir)
+        self.poll_interval = poll_interval
+        self._guard = threading.Lock()
+        self._entries = {}  # key -> _Entry, dropped when unused
+        self.acquisitions = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @staticmethod
+    def _key(path):
+        return str(Path(path).resolve())
+
+    def _lock_file(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return self.lock_dir / f"{digest}.lock"
+
+    @contextmanager
+    def lock(self, path, timeout=None):
+        """Hold the writer lock for the vehicle folder at path."""
+        key = self._key(path)
+        with self._guard:
+            entry = self._entries.setdefault(key, _Entry())
+            entry.users += 1
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        fh = None
+        try:
+            contended = not entry.lock.acquire(blocking=False)
+            if contended:
+                remaining = -1 if deadline is None else max(0.0, deadline - time.monotonic())
+                if not entry.lock.acquire(timeout=remaining):
+                    self._record(start, contended, timed_out=True)
+                    raise LockTimeout(f"writer lock busy: {path}")
+            try:
+                self.lock_dir.mkdir(parents=True, exist_ok=True)
+                fh = open(self._lock_file(key), "a+b")
+                while not _try_lock_file(fh):
+                    contended = True
+                    if deadline is not None and time.monotonic() >= deadline:
+                        self._record(start, contended, timed_out=True)
+                        raise LockTimeout(f"writer lock busy (other process): {path}")
+                    time.sleep(self.poll_interval)
+                self._record(start, contended)
+                yield
+            finally:
+                if fh is not None:
+                    try:
+                        _unlock_file(fh)
+                    except OSError:
+                        pass
+                    fh.close()
+                entry.lock.release()
+        finally:
+            with self._guard:
+                entry.users -= 1
+                if entry.users == 0:
+                    self._entries.pop(key, None)
+
+    def _record(self, start, contended, timed_out=False):
+        waited = time.monotonic() - start
+        with self._guard:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.acquisitions += 1
+            if contended:
+                self.contended += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def stats(self) -> dict:
+        with self._guard:
+            return {
+                "held_or_waiting": len(self._entries),
+                "acquisitions": self.acquisitions,
+                "contended": self.contended,
+                "timeouts": self.timeouts,
+                "wait_total_ms": round(self.wait_total * 1000, 1),
+                "wait_avg_ms": round(self.wait_total * 1000 / max(self.acquisitions, 1), 2),
+                "wait_max_ms": round(self.wait_max * 1000, 1),
+            }
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""Targeted-cell streaming xlsx reader.
+
+openpyxl builds the object model for every cell of every sheet, while the app
+only needs a few dozen fixed addresses. This reader resolves sheet names via
+workbook.xml, streams just the requested sheet parts out of the zip with
+iterparse, stops once the highest requested row is passed, and resolves only
+the shared strings those cells reference.
+
+Cached values are returned (the equivalent of ``data_only=True``), with the
+same Python types openpyxl produces: int/float, bool, str and datetime for
+date-formatted numbers.
+
+Run as a script to benchmark against openpyxl:
+
+    python xlsx_reader.py <workbook.xlsx> [<workbook.xlsx> ...]
+"""
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils.cell import column_index_from_string, coordinate_from_string
+from openpyxl.utils.datetime import (
+    from_excel, from_ISO8601, CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900,
+)
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_M = "{%s}" % NS_MAIN
+_COL_RE = re.compile(r"^([A-Z]+)")
+
+
+def _split_ref(ref):
+    """'D16' -> (16, 4)."""
+    col, row = coordinate_from_string(ref)
+    return row, column_index_from_string(col)
+
+
+def _text_of(el):
+    """Concatenate <t> text of a string item, skipping phonetic runs."""
+    parts = []
+    for child in el:
+        if child.tag == _M + "t":
+            parts.append(child.text or "")
+        elif child.tag == _M + "r":
+            for t in child.iter(_M + "t"):
+                parts.append(t.text or "")
+    return "".join(parts)
+
+
+def read_sheet_parts(zf):
+    """Return ({sheet name: zip member}, date1904) from workbook.xml + rels."""
+    rels = {}
+    rels_xml = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels_xml.iter("{%s}Relationship" % NS_PKG_REL):
+        target = rel.get("Target")
+        if target.startswith("/"):
+            target = target.lstrip("/")
+        else:
+            target = posixpath.normpath(posixpath.join("xl", target))
+        rels[rel.get("Id")] = target
+
+    wb_xml = ET.fromstring(zf.read("xl/workbook.xml"))
+    pr = wb_xml.find(_M + "workbookPr")
+    date1904 = pr is not None and pr.get("date1904") in ("1", "true")
+    parts = {}
+    for sheet in wb_xml.iter(_M + "sheet"):
+        rid = sheet.get("{%s}id" % NS_REL)
+        if rid in rels:
+            parts[sheet.get("name")] = rels[rid]
+    return parts, date1904
+
+
+def find_sheet_name(sheetnames, token):
+    """First sheet name containing token (after stripping), or None."""
+    return next((sn for sn in sheetnames if token in sn.strip()), None)
+
+
+class _Cell:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+_EMPTY = _Cell(None)
+
+
+class StreamingSheet:
+    """Read-only view over the cells that were requested from one sheet.
+
+    Supports the subset of the openpyxl worksheet API the app uses:
+    ``ws["D16"].value`` and ``ws.cell(row=, column=).value``.
+    """
+
+    def __init__(self, title, values):
+        self.title = title
+        self._values = values  # (row, col) -> value
+
+    def __getitem__(self, ref):
+        return self.cell(*_split_ref(ref))
+
+    def cell(self, row, column):
+        val = self._values.get((row, column))
+        return _EMPTY if val is None else _Cell(val)
+
+    def values(self) -> dict:
+        return dict(self._values)
+
+
+class StreamingWorkbook:
+    """Lazily opened xlsx package; sheets are read on demand by address."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._zip = zipfile.ZipFile(self.path)
+        self._sheet_parts, date1904 = read_sheet_parts(self._zip)
+        self.sheetnames = list(self._sheet_parts)
+        self._epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+        self._date_styles = None
+        self._shared_strings = None
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- package structure -------------------------------------------------
+
+    def _load_date_styles(self) -> set:
+        """Indices of cellXfs entries whose number format is a date."""
+        styles = set()
+        try:
+            root = ET.fromstring(self._zip.read("xl/styles.xml"))
+        except KeyError:
+            return styles
+        custom = {}
+        num_fmts = root.find(_M + "numFmts")
+        if num_fmts is not None:
+            for nf in num_fmts:
+                custom[int(nf.get("numFmtId"))] = nf.get("formatCode", "")
+        xfs = root.find(_M + "cellXfs")
+        if xfs is not None:
+            for i, xf in enumerate(xfs):
+                fmt_id = int(xf.get("numFmtId", 0))
+                fmt = custom.get(fmt_id, BUILTIN_FORMATS.get(fmt_id, "General"))
+                if is_date_format(fmt):
+                    styles.add(i)
+        return styles
+
+    def _resolve_shared_strings(self, wanted: set) -> dict:
+        """Read shared strings only up to the highest wanted index."""
+        if self._shared_strings is None:
+            self._shared_strings = {}
+        missing = {i for i in wanted if i not in self._shared_strings}
+        if not missing:
+            return self._shared_strings
+        try:
+            fh = self._zip.open("xl/sharedStrings.xml")
+        except KeyError:
+            return self._shared_strings
+        last = max(missing)
+        with fh:
+            idx = 0
+            for event, el in ET.iterparse(fh, events=("end",)):
+                if el.tag != _M + "si":
+                    continue
+                if idx in missing:
+                    self._shared_strings[idx] = _text_of(el)
+                el.clear()
+                if idx >= last:
+                    break
+                idx += 1
+        return self._shared_strings
+
+    # -- cell access -------------------------------------------------------
+
+    def read_sheet(self, name, refs) -> StreamingSheet:
+        """Read only the given addresses of a sheet.
+
+        refs are "D16"-style strings or precompiled (row, col) tuples.
+        """
+        wanted = {r if isinstance(r, tuple) else _split_ref(r) for r in refs}
+        if not wanted:
+            return StreamingSheet(name, {})
+        return self._read(name, wanted.__contains__, max(r for r, _ in wanted))
+
+    def scan_sheet(self, name, max_row, max_col) -> StreamingSheet:
+        """Read every non-empty cell of a sheet in A1:<max_col><max_row>."""
+        return self._read(name, lambda key: key[1] <= max_col, max_row)
+
+    def _read(self, name, accept, max_row) -> StreamingSheet:
+        """Stream the sheet part, keeping the cells (row, col) accept()s."""
+        if name not in self._sheet_parts:
+            return StreamingSheet(name, {})
+        raw = {}  # (row, col) -> (type, text, style)
+        row_num = 0
+        with self._zip.open(self._sheet_parts[name]) as fh:
+            col_num = 0
+            for event, el in ET.iterparse(fh, events=("start", "end")):
+                tag = el.tag
+                if event == "start":
+                    if tag == _M + "row":
+                        r = el.get("r")
+                        row_num = int(r) if r else row_num + 1
+                        col_num = 0
+                        if row_num > max_row:
+                            break
+                    continue
+                if tag == _M + "c":
+                    ref = el.get("r")
+                    if ref:
+                        col_num = column_index_from_string(_COL_RE.match(ref).group(1))
+                    else:
+                        col_num += 1
+                    key = (row_num, col_num)
+                    if accept(key):
+                        t = el.get("t", "n")
+                        if t == "inlineStr":
+                            is_el = el.find(_M + "is")
+                            text = _text_of(is_el) if is_el is not None else None
+                        else:
+                            v = el.find(_M + "v")
+                            text = v.text if v is not None else None
+                        if text is not None:
+                            raw[key] = (t, text, el.get("s"))
+                    el.clear()
+                elif tag == _M + "row":
+                    el.clear()
+
+        return StreamingSheet(name, self._convert(raw))
+
+    def _convert(self, raw) -> dict:
+        shared = [int(text) for t, text, _ in raw.values() if t == "s"]
+        strings = self._resolve_shared_strings(set(shared)) if shared else {}
+        values = {}
+        for key, (t, text, style) in raw.items():
+            if t == "s":
+                values[key] = strings.get(int(text))
+            elif t in ("str", "inlineStr", "e"):
+                values[key] = text
+            elif t == "b":
+                values[key] = text in ("1", "true")
+            elif t == "d":
+                values[key] = from_ISO8601(text)
+            else:
+                num = float(text) if any(ch in text for ch in ".eE") else int(text)
+                if style is not None:
+                    if self._date_styles is None:
+                        self._date_styles = self._load_date_styles()
+                    if int(style) in self._date_styles:
+                        num = from_excel(num, self._epoch)
+                values[key] = num
+        return values
+
+
+def read_cells(path, plan: dict) -> dict:
+    """Read several sheets in one pass over the package.
+
+    plan maps a sheet-name token (matched as a substring of the stripped
+    sheet name, first match wins) to the list of addresses needed from it.
+    Returns token -> StreamingSheet, or None when no sheet matches.
+    """
+    with StreamingWorkbook(path) as wb:
+        result = {}
+        for token, refs in plan.items():
+            name = find_sheet_name(wb.sheetnames, token)
+            result[token] = wb.read_sheet(name, refs) if name is not None else None
+        return result
+
+
+def _benchmark(paths):
+    import time
+    import tracemalloc
+    import openpyxl
+
+    # Roughly the plan app.py uses for one inspection page
+    plan = {
+        "מזכיר": [f"D{r}" for r in range(16, 170)],
+        "ממצאים": ["A13", "E13", "H13", "J13"]
+                  + [f"{c}{r}" for c in "BHIJ" for r in range(22, 35)],
+        "בוחן": [f"{c}{r}" for c in "DGH" for r in range(312, 320)],
+    }
+
+    def measure(fn):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed, peak
+
+    def via_openpyxl(path):
+        wb = openpyxl.load_workbook(path, data_only=True)
+        for token, refs in plan.items():
+            ws = next((wb[sn] for sn in wb.sheetnames if token in sn.strip()), None)
+            if ws is not None:
+                for ref in refs:
+                    ws[ref].value
+        wb.close()
+
+    for path in paths:
+        t_op, m_op = measure(lambda: via_openpyxl(path))
+        t_st, m_st = measure(lambda: read_cells(path, plan))
+        print(path)
+        print(f"  openpyxl : {t_op * 1000:8.1f} ms  peak {m_op / 1e6:7.1f} MB")
+        print(f"  streaming: {t_st * 1000:8.1f} ms  peak {m_st / 1e6:7.1f} MB")
+        print(f"  speedup  : {t_op / t_st:8.1f}x   memory {m_op / max(m_st, 1):7.1f}x")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    _benchmark(sys.argv[1:])
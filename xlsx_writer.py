@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""Surgical in-place xlsx cell writer.
+
+Instead of an openpyxl load/save round-trip (which re-serialises every sheet
+and drops features openpyxl does not understand), this patches the XML of a
+single worksheet and copies every other zip member into the new archive
+as stored: its local header, compressed bytes and data descriptor are
+copied byte for byte, and only the patched parts are compressed again.
+The archive is assembled here (local records, central directory, end
+record) rather than through ZipFile, which can only recompress. Packages
+that need zip64 records are left to the openpyxl fallback. The result is
+written to a temp file next to the original and swapped in with
+``os.replace``, so readers never see a half-written workbook.
+
+Strings are written as inline strings, so sharedStrings.xml is never
+rewritten. Existing cell styles are kept. When a formula cell is overwritten
+its calcChain entry would dangle, so calcChain.xml is dropped and Excel
+rebuilds it; ``fullCalcOnLoad`` is set so dependent formulas are recomputed
+the next time the workbook is opened in Excel.
+
+Cells this writer cannot patch without breaking the sheet raise
+UnsupportedWorkbook so the caller falls back to openpyxl: overwriting the
+master of a shared or array formula (its ``ref`` range would be orphaned),
+and rows or cells that carry no ``r`` attribute (their position is implicit,
+so a cell could not be matched by reference).
+"""
+import os
+import re
+import shutil
+import struct
+import tempfile
+import zipfile
+import zlib
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from openpyxl.utils.cell import (
+    column_index_from_string, coordinate_from_string, get_column_letter,
+)
+
+from xlsx_reader import read_sheet_parts, find_sheet_name
+
+_ROW_RE = re.compile(rb'<row\b[^>]*?\br="(\d+)"[^>]*?(?:/>|>.*?</row>)', re.S)
+_CELL_RE = re.compile(rb'<c\b[^>]*?\br="([A-Z]+)(\d+)"[^>]*?(?:/>|>.*?</c>)', re.S)
+_STYLE_RE = re.compile(rb'\bs="(\d+)"')
+_RANGE_FORMULA_RE = re.compile(rb'<f\b[^>]*?\bref="')
+_ROW_NO_REF_RE = re.compile(rb'<row\b(?![^>]*?\br=")')
+_CELL_NO_REF_RE = re.compile(rb'<c\b(?![^>]*?\br=")')
+_SPANS_RE = re.compile(rb'\s+spans="[^"]*"')
+_ILLEGAL_XML_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# Elements that must follow <calcPr> inside <workbook>, per the schema order
+_AFTER_CALCPR = (b"<oleSize", b"<customWorkbookViews", b"<pivotCaches",
+                 b"<smartTagPr", b"<smartTagTypes", b"<webPublishing",
+                 b"<fileRecoveryPr", b"<webPublishObjects", b"<extLst",
+                 b"</workbook>")
+
+
+# Zip records (APPNOTE 4.3): local file header, central directory header,
+# end of central directory
+_LOCAL = struct.Struct("<4s2B4HL2L2H")
+_CENTRAL = struct.Struct("<4s4B4HL2L5H2L")
+_END = struct.Struct("<4s4H2LH")
+_LOCAL_SIG, _CENTRAL_SIG, _END_SIG = b"PK\x03\x04", b"PK\x01\x02", b"PK\x05\x06"
+_DESCRIPTOR_SIG = b"PK\x07\x08"
+_FLAG_DESCRIPTOR, _FLAG_UTF8 = 0x08, 0x800
+_ZIP32_MAX = 0xFFFFFFFF
+_COPY_CHUNK = 1024 * 1024
+
+
+class UnsupportedWorkbook(Exception):
+    """The package layout is not one the surgical writer can patch safely."""
+
+
+def _cell_xml(ref, value, style):
+    """Serialise one <c> element for value, keeping the existing style."""
+    s_attr = b' s="%s"' % style if style else b""
+    ref_b = ref.encode()
+    if value is None or value == "":
+        return b'<c r="%s"%s/>' % (ref_b, s_attr)
+    if isinstance(value, bool):
+        return b'<c r="%s"%s t="b"><v>%d</v></c>' % (ref_b, s_attr, int(value))
+    if isinstance(value, (int, float)):
+        return b'<c r="%s"%s><v>%s</v></c>' % (ref_b, s_attr, repr(value).encode())
+    text = escape(_ILLEGAL_XML_RE.sub("", str(value))).encode("utf-8")
+    return (b'<c r="%s"%s t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>'
+            % (ref_b, s_attr, text))
+
+
+def _patch_row(row_xml, cells):
+    """Replace/insert cells ({col_index: (ref, value)}) inside one <row>."""
+    formula_hit = False
+    if row_xml.endswith(b"/>"):
+        row_xml = row_xml[:-2] + b"></row>"
+    head_end = row_xml.index(b">") + 1
+    head, body = row_xml[:head_end], row_xml[head_end:-len(b"</row>")]
+    if _CELL_NO_REF_RE.search(body):
+        raise UnsupportedWorkbook("row has cells without an r attribute")
+
+    pending = dict(cells)
+    out = []
+    pos = 0
+    for m in _CELL_RE.finditer(body):
+        col = column_index_from_string(m.group(1).decode())
+        # Insert new cells that sort before this existing one
+        for c in sorted(k for k in pending if k < col):
+            ref, value = pending.pop(c)
+            out.append(body[pos:m.start()])
+            out.append(_cell_xml(ref, value, None))
+            pos = m.start()
+        if col in pending:
+            ref, value = pending.pop(col)
+            old = m.group(0)
+            style = _STYLE_RE.search(old[:old.index(b">")])
+            if _RANGE_FORMULA_RE.search(old):
+                # Shared/array formula master: its dependents would be orphaned
+                raise UnsupportedWorkbook(f"{ref} is the master of a shared or array formula")
+            if b"<f" in old:
+                formula_hit = True
+            out.append(body[pos:m.start()])
+            out.append(_cell_xml(ref, value, style.group(1) if style else None))
+            pos = m.end()
+    out.append(body[pos:])
+    for c in sorted(pending):
+        ref, value = pending[c]
+        out.append(_cell_xml(ref, value, None))
+    if cells:
+        # spans is only an optimisation hint; drop it rather than recompute
+        head = _SPANS_RE.sub(b"", head)
+    return head + b"".join(out) + b"</row>", formula_hit
+
+
+def patch_sheet_xml(xml: bytes, updates: dict):
+    """Apply {"E42": value} updates to a worksheet part.
+
+    Returns (new_xml, formula_overwritten).
+    """
+    start = xml.find(b"<sheetData")
+    if start < 0:
+        raise UnsupportedWorkbook("sheetData not found (prefixed namespace?)")
+    if xml.startswith(b"/>", xml.index(b">", start) - 1):
+        # Empty self-closing <sheetData/>
+        tag_end = xml.index(b">", start) + 1
+        xml = xml[:start] + b"<sheetData></sheetData>" + xml[tag_end:]
+    body_start = xml.index(b">", start) + 1
+    body_end = xml.index(b"</sheetData>", body_start)
+    body = xml[body_start:body_end]
+    if _ROW_NO_REF_RE.search(body):
+        raise UnsupportedWorkbook("sheetData has rows without an r attribute")
+
+    by_row = {}
+    for ref, value in updates.items():
+        col, row = coordinate_from_string(ref)
+        by_row.setdefault(row, {})[column_index_from_string(col)] = (f"{col}{row}", value)
+
+    formula_hit = False
+    out = []
+    pos = 0
+    for m in _ROW_RE.finditer(body):
+        row = int(m.group(1))
+        for r in sorted(k for k in by_row if k < row):
+            out.append(body[pos:m.start()])
+            new_row, _ = _patch_row(b'<row r="%d"/>' % r, by_row.pop(r))
+            out.append(new_row)
+            pos = m.start()
+        if row in by_row:
+            out.append(body[pos:m.start()])
+            new_row, hit = _patch_row(m.group(0), by_row.pop(row))
+            formula_hit = formula_hit or hit
+            out.append(new_row)
+            pos = m.end()
+    out.append(body[pos:])
+    for r in sorted(by_row):
+        new_row, _ = _patch_row(b'<row r="%d"/>' % r, by_row[r])
+        out.append(new_row)
+
+    xml = xml[:body_start] + b"".join(out) + xml[body_end:]
+    return _widen_dimension(xml, updates), formula_hit
+
+
+def _widen_dimension(xml, updates):
+    """Grow <dimension ref="A1:X9"> to include the written cells."""
+    m = re.search(rb'<dimension\b[^>]*?\bref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"', xml)
+    if not m:
+        return xml
+    c1 = column_index_from_string(m.group(1).decode())
+    r1 = int(m.group(2))
+    c2 = column_index_from_string((m.group(3) or m.group(1)).decode())
+    r2 = int(m.group(4) or m.group(2))
+    for ref in updates:
+        col, row = coordinate_from_string(ref)
+        col = column_index_from_string(col)
+        c1, r1, c2, r2 = min(c1, col), min(r1, row), max(c2, col), max(r2, row)
+    new_ref = f"{get_column_letter(c1)}{r1}:{get_column_letter(c2)}{r2}".encode()
+    return xml[:m.start(1)] + new_ref + xml[m.end(m.lastindex):]
+
+
+def _set_full_calc_on_load(xml: bytes) -> bytes:
+    m = re.search(rb"<calcPr\b[^>]*?/?>", xml)
+    if m:
+        tag = m.group(0)
+        if b"fullCalcOnLoad=" in tag:
+            new = re.sub(rb'fullCalcOnLoad="[^"]*"', b'fullCalcOnLoad="1"', tag)
+        else:
+            new = b'<calcPr fullCalcOnLoad="1"' + tag[len(b"<calcPr"):]
+        return xml[:m.start()] + new + xml[m.end():]
+    for marker in _AFTER_CALCPR:
+        i = xml.find(marker)
+        if i >= 0:
+            return xml[:i] + b'<calcPr fullCalcOnLoad="1"/>' + xml[i:]
+    return xml
+
+
+def _drop_calc_chain(members: dict):
+    """Remove calcChain.xml references from rels and content types."""
+    rels = members["xl/_rels/workbook.xml.rels"]
+    members["xl/_rels/workbook.xml.rels"] = re.sub(
+        rb'<Relationship\b[^>]*?Target="[^"]*calcChain\.xml"[^>]*?/>', b"", rels)
+    ct = members["[Content_Types].xml"]
+    members["[Content_Types].xml"] = re.sub(
+        rb'<Override\b[^>]*?PartName="/xl/calcChain\.xml"[^>]*?/>', b"", ct)
+
+
+def _dos_time(date_time):
+    y, mo, d, h, mi, s = date_time
+    return (h << 11) | (mi << 5) | (s // 2), ((y - 1980) << 9) | (mo << 5) | d
+
+
+def _extra_ids(extra: bytes):
+    pos = 0
+    while pos + 4 <= len(extra):
+        field_id, size = struct.unpack_from("<2H", extra, pos)
+        yield field_id
+        pos += 4 + size
+
+
+def _check_zip32(info):
+    if (max(info.file_size, info.compress_size, info.header_offset) >= _ZIP32_MAX
+            or 1 in _extra_ids(info.extra)):
+        raise UnsupportedWorkbook(f"{info.filename} needs zip64 records")
+
+
+def _copy_record(src, dst, info):
+    """Copy info's local header, compressed data and data descriptor as stored."""
+    src.seek(info.header_offset)
+    header = src.read(_LOCAL.size)
+    if len(header) < _LOCAL.size or header[:4] != _LOCAL_SIG:
+        raise UnsupportedWorkbook(f"{info.filename}: no local header at its offset")
+    name_len, extra_len = _LOCAL.unpack(header)[-2:]
+    remaining = name_len + extra_len + info.compress_size
+    if info.flag_bits & _FLAG_DESCRIPTOR:
+        src.seek(info.header_offset + _LOCAL.size + remaining)
+        remaining += 16 if src.read(4) == _DESCRIPTOR_SIG else 12
+        src.seek(info.header_offset + _LOCAL.size)
+    dst.write(header)
+    while remaining:
+        chunk = src.read(min(remaining, _COPY_CHUNK))
+        if not chunk:
+            raise UnsupportedWorkbook(f"{info.filename}: truncated member")
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def _write_record(dst, info, data: bytes):
+    """Write data deflated as a new member named like info; returns its central fields."""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    packed = compressor.compress(data) + compressor.flush()
+    name = info.filename.encode("utf-8")
+    flags = 0 if name.isascii() else _FLAG_UTF8
+    crc = zlib.crc32(data)
+    time_, date = _dos_time(info.date_time)
+    dst.write(_LOCAL.pack(_LOCAL_SIG, 20, 0, flags, zipfile.ZIP_DEFLATED, time_, date,
+                          crc, len(packed), len(data), len(name), 0))
+    dst.write(name)
+    dst.write(packed)
+    return (20, info.create_system, 20, 0, flags, zipfile.ZIP_DEFLATED, time_, date,
+            crc, len(packed), len(data), name, b"", b"")
+
+
+def _central_fields(info):
+    """Central directory fields of a member copied as stored."""
+    name = info.orig_filename.encode("utf-8" if info.flag_bits & _FLAG_UTF8 else "cp437")
+    time_, date = _dos_time(info.date_time)
+    return (info.create_version, info.create_system, info.extract_version, info.reserved,
+            info.flag_bits, info.compress_type, time_, date, info.CRC, info.compress_size,
+            info.file_size, name, info.extra, info.comment)
+
+
+def _write_archive(src, dst, infos, changed: dict, comment: bytes):
+    """Members of infos in order: changed ones from bytes, the rest copied as stored."""
+    entries = []
+    for info in infos:
+        _check_zip32(info)
+        offset = dst.tell()
+        if info.filename in changed:
+            fields = _write_record(dst, info, changed[info.filename])
+        else:
+            _copy_record(src, dst, info)
+            fields = _central_fields(info)
+        entries.append((fields, info, offset))
+    start = dst.tell()
+    for (*head, name, extra, member_comment), info, offset in entries:
+        dst.write(_CENTRAL.pack(_CENTRAL_SIG, *head, len(name), len(extra), len(member_comment),
+                                0, info.internal_attr, info.external_attr, offset))
+        dst.write(name + extra + member_comment)
+    end = dst.tell()
+    if end >= _ZIP32_MAX or len(entries) >= 0xFFFF:
+        raise UnsupportedWorkbook("package needs zip64 records")
+    dst.write(_END.pack(_END_SIG, 0, 0, len(entries), len(entries), end - start, start,
+                        len(comment)))
+    dst.write(comment)
+
+
+def write_cells(path, sheet_token: str, updates: dict) -> bool:
+    """Patch {"E42": value} into the first sheet whose name contains token.
+
+    Returns False when no sheet matches. Raises UnsupportedWorkbook when the
+    package cannot be patched safely (the caller should fall back to a full
+    openpyxl round-trip).
+    """
+    path = Path(path)
+    with zipfile.ZipFile(path) as zin:
+        parts, _ = read_sheet_parts(zin)
+        name = find_sheet_name(parts, sheet_token)
+        if name is None:
+            return False
+        if not updates:
+            return True
+        sheet_part = parts[name]
+
+        sheet_xml, formula_hit = patch_sheet_xml(zin.read(sheet_part), updates)
+        changed = {sheet_part: sheet_xml}
+        workbook_xml = zin.read("xl/workbook.xml")
+        full_calc = _set_full_calc_on_load(workbook_xml)
+        if full_calc != workbook_xml:
+            changed["xl/workbook.xml"] = full_calc
+        dropped = set()
+        if formula_hit and "xl/calcChain.xml" in zin.NameToInfo:
+            changed["xl/_rels/workbook.xml.rels"] = zin.read("xl/_rels/workbook.xml.rels")
+            changed["[Content_Types].xml"] = zin.read("[Content_Types].xml")
+            _drop_calc_chain(changed)
+            dropped.add("xl/calcChain.xml")
+
+        infos = [info for info in zin.infolist() if info.filename not in dropped]
+        fd, tmp = tempfile.mkstemp(prefix=".~", suffix=".xlsx.tmp", dir=str(path.parent))
+        try:
+            with os.fdopen(fd, "wb") as fh, open(path, "rb") as src:
+                _write_archive(src, fh, infos, changed, zin.comment)
+                fh.flush()
+                os.fsync(fh.fileno())
+            shutil.copymode(path, tmp)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    os.replace(tmp, path)
+    return True